@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Remember to update the PYTHON_PATH to
+# export PYTHONPATH=`pwd`:`pwd`
+"""
+Synthetic occurrences and taxa for the benchmarks. The same seed always
+generates the same data
+"""
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+SOURCES = ('gbif', 'inat', 'snib')
+
+RANKS = ('kingdom', 'phylum', 'class_taxon', 'order', 'family', 'genus')
+
+# Share of the eventDates of each format, the rest are missing
+DATE_FORMATS = (('%Y-%m-%d', 0.7), ('%d/%m/%Y', 0.15), ('%Y-%m-%dT%H:%M:%S', 0.1))
+
+
+def taxon_frame(num_taxa: int, seed: int = 0) -> pd.DataFrame:
+    """Distinct taxa with a plausible classification: few kingdoms and
+    more names at every lower rank
+
+    Parameters
+    ----------
+    num_taxa : int
+        Number of taxa
+    seed : int, optional
+        Seed of the generator, by default 0
+
+    Returns
+    -------
+    pd.DataFrame
+        Taxa with the TaxonBuilder.Model columns and verbatim keys
+    """
+    rng = np.random.default_rng(seed)
+    frame = {}
+
+    for depth, rank in enumerate(RANKS):
+        names = max(int(num_taxa ** ((depth + 1) / (len(RANKS) + 1))), 1)
+        frame[rank] = np.char.add(f"{rank.capitalize()}", rng.integers(0, names, num_taxa).astype(str))
+
+    species = np.char.add('sp', np.arange(num_taxa).astype(str))
+    frame['species'] = np.char.add(np.char.add(frame['genus'], ' '), species)
+    frame['scientificName'] = np.char.add(frame['species'], ' L.')
+    frame['canonicalName'] = frame['species']
+    frame['verbatimSource'] = rng.choice(SOURCES, num_taxa)
+    frame['verbatimID'] = np.arange(num_taxa)
+
+    return pd.DataFrame(frame)
+
+
+def event_dates(rows: int, rng: np.random.Generator) -> np.ndarray:
+    """eventDate strings in the DATE_FORMATS, with missing values
+    """
+    seconds = rng.integers(0, 25 * 365 * 86400, rows)
+    stamps = pd.to_datetime(seconds + 946684800, unit='s')
+
+    dates = np.full(rows, '', dtype=object)
+    choice = rng.random(rows)
+    low = 0.0
+    for fmt, share in DATE_FORMATS:
+        mask = (choice >= low) & (choice < low + share)
+        dates[mask] = stamps[mask].strftime(fmt)
+        low += share
+
+    return dates
+
+
+def occurrence_frame(rows: int, num_taxa: int = None, seed: int = 0,
+                     invalid: float = 0.001, taxa: pd.DataFrame = None) -> pd.DataFrame:
+    """Occurrences with their Event and Taxon columns, as read from a source
+
+    Parameters
+    ----------
+    rows : int
+        Number of occurrences
+    num_taxa : int, optional
+        Number of distinct taxa, by default rows // 1000 (at least 10)
+    seed : int, optional
+        Seed of the generator, by default 0
+    invalid : float, optional
+        Share of rows with an invalid latitude, by default 0.001
+    taxa : pd.DataFrame, optional
+        Taxa of the occurrences, by default taxon_frame(num_taxa, seed)
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per occurrence
+    """
+    rng = np.random.default_rng(seed)
+    num_taxa = max(rows // 1000, 10) if num_taxa is None else num_taxa
+
+    if taxa is None:
+        taxa = taxon_frame(num_taxa, seed)
+    frame = taxa.iloc[rng.integers(0, len(taxa), rows)].reset_index(drop=True)
+
+    latitude = rng.uniform(-80, 84, rows).round(6).astype(object)
+    latitude[rng.random(rows) < invalid] = 'bad'
+
+    frame['occurrenceID'] = np.arange(rows).astype(str)
+    frame['latitude'] = latitude
+    frame['longitude'] = rng.uniform(-180, 180, rows).round(6)
+    frame['eventDate'] = event_dates(rows, rng)
+
+    return frame
+
+
+def occurrence_chunks(rows: int, chunk_size: int = 1_000_000, num_taxa: int = None,
+                      seed: int = 0) -> Iterator[pd.DataFrame]:
+    """occurrence_frame in chunks, so 10M rows do not need to be in memory
+    at once. The occurrenceIDs and the index are global
+
+    Parameters
+    ----------
+    rows : int
+        Total number of occurrences
+    chunk_size : int, optional
+        Rows per chunk, by default 1_000_000
+    num_taxa : int, optional
+        Number of distinct taxa of the whole dataset, by default rows // 1000
+    seed : int, optional
+        Seed of the generator, by default 0
+    """
+    num_taxa = max(rows // 1000, 10) if num_taxa is None else num_taxa
+    taxa = taxon_frame(num_taxa, seed)
+
+    for n, start in enumerate(range(0, rows, chunk_size)):
+        size = min(chunk_size, rows - start)
+        chunk = occurrence_frame(size, seed=seed + n, taxa=taxa)
+        chunk['occurrenceID'] = np.arange(start, start + size).astype(str)
+        chunk.index = pd.RangeIndex(start, start + size)
+
+        yield chunk
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Remember to update the PYTHON_PATH to
+# export PYTHONPATH=`pwd`:`pwd`
+"""
+Timing and peak memory of the benchmark stages
+"""
+import gc
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+from datetime import datetime, timezone
+from importlib import metadata
+from typing import Callable, Dict, List
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+# Versions reported with the results
+PACKAGES = ('numpy', 'pandas', 'pyarrow', 'pydantic', 'shapely', 'pymongo')
+
+
+def max_rss() -> int:
+    """Max resident set size of the process in bytes, 0 if unknown
+    """
+    if resource is None:
+        return 0
+
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB and macOS bytes
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def measure(stage: str, func: Callable[[], object], rows: int,
+            repeat: int = 3, warmup: int = 1, memory: bool = True, **params) -> dict:
+    """Runs func warmup + repeat times and reports the wall times. The peak
+    memory is measured in one more run with tracemalloc, so its overhead
+    does not affect the times
+
+    Parameters
+    ----------
+    stage : str
+        Name of the stage
+    func : Callable[[], object]
+        Work to measure, without arguments
+    rows : int
+        Rows processed by one call, for the throughput
+    repeat : int, optional
+        Timed runs, by default 3
+    warmup : int, optional
+        Untimed runs before, by default 1
+    memory : bool, optional
+        Also measures the peak of the python allocations, by default True
+    params : dict
+        Extra values to report, e.g. the scale
+
+    Returns
+    -------
+    dict
+        Times in seconds (min, median, mean, all), rows per second of the
+        median, peak traced bytes and max RSS of the process
+    """
+    for _ in range(warmup):
+        func()
+
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            func()
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+    median = statistics.median(times)
+
+    return {
+        'stage': stage,
+        'rows': rows,
+        **params,
+        'seconds': {
+            'min': min(times),
+            'median': median,
+            'mean': statistics.fmean(times),
+            'runs': times
+        },
+        'rows_per_second': rows / median if median else None,
+        'peak_memory_bytes': peak,
+        'max_rss_bytes': max_rss()
+    }
+
+
+def environment() -> Dict[str, object]:
+    """Versions and machine of the run, to compare results across runs
+    """
+    packages = {}
+    for name in PACKAGES:
+        try:
+            packages[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            packages[name] = None
+
+    return {
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'packages': packages
+    }
+
+
+def summary(results: List[dict]) -> str:
+    """One line per result, for the console
+    """
+    lines = []
+    for result in results:
+        median = result['seconds']['median']
+        peak = result['peak_memory_bytes']
+        peak = '-' if peak is None else f"{peak / 2 ** 20:.1f} MiB"
+        lines.append(f"{result['stage']:<28} {result['rows']:>10} rows  "
+                     f"{median:>9.4f} s  {result['rows_per_second'] or 0:>12.0f} rows/s  {peak}")
+
+    return '\n'.join(lines)
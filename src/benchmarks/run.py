@@ -0,0 +1,233 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Remember to update the PYTHON_PATH to
+# export PYTHONPATH=`pwd`:`pwd`
+"""
+Benchmarks of the model builders and the pipeline stages over synthetic data.
+
+    python benchmarks/run.py -r 10000 100000 -o results.json
+
+Row by row stages use at most --row_limit rows of every scale, the batch
+stages use all of them. The Cachr stages run against --mongo or, without
+it, against an in-process mongomock stand-in if it is installed. mongomock
+scans the collection in every query, so its times only compare runs that
+also used it.
+"""
+import argparse
+import json
+
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from benchmarks.generators import occurrence_frame
+from benchmarks.harness import environment, measure, summary
+
+from da.models.occurrence import EventBuilder as EB, OccurrenceBuilder as OB
+from da.models.taxon import TaxonBuilder as TB, TaxonRegistry
+from da.utils.cachr import Cachr, ClientRegistry
+from da.utils.commons import barified, batchify
+from da.utils.log import get_logger, log_exception
+
+log = get_logger(__name__)
+
+OCCURRENCE_COLUMNS = ['occurrenceID', 'verbatimID', 'verbatimSource',
+                      'latitude', 'longitude', 'eventDate']
+
+TAXON_COLUMNS = ['kingdom', 'phylum', 'class_taxon', 'order', 'family', 'genus', 'species',
+                 'scientificName', 'canonicalName', 'verbatimID', 'verbatimSource']
+
+STANDIN_CONNECTION = 'mongomock://benchmarks'
+
+
+def transform_or_none(record: dict, builder, **kwargs):
+    """builder.transform(record), None for the invalid records as the
+    pipelines skip them. kwargs are the options of barified
+    """
+    try:
+        return builder.transform(record)
+    except Exception:
+        return None
+
+
+def transform_batch_slice(ixs: tuple, data, **kwargs) -> List[int]:
+    """Function of batchify: transforms the rows data[start:end]
+    """
+    start, end = ixs
+    return [len(OB.transform_batch(data.iloc[start:end]))]
+
+
+def row_stages(frame) -> Dict[str, Callable]:
+    events = frame[['latitude', 'longitude', 'eventDate']].to_dict('records')
+    taxa = frame[TAXON_COLUMNS].to_dict('records')
+
+    occurrences = []
+    for record, event in zip(frame[OCCURRENCE_COLUMNS[:3]].to_dict('records'), events):
+        occurrences.append({**record, 'event': event})
+
+    models = [m for m in (transform_or_none(o, OB) for o in occurrences) if m is not None]
+
+    return {
+        'event.transform': lambda: [transform_or_none(e, EB) for e in events],
+        'occurrence.transform': lambda: [transform_or_none(o, OB) for o in occurrences],
+        'taxon.transform': lambda: [transform_or_none(t, TB) for t in taxa],
+        'occurrence.dict': lambda: [m.dict() for m in models],
+        'barified': lambda: barified(transform_or_none, events, EB, hide_bar=True),
+    }
+
+
+def batch_stages(frame) -> Dict[str, Callable]:
+    occurrences = frame[OCCURRENCE_COLUMNS]
+    batch = OB.transform_batch(occurrences)
+
+    return {
+        'event.transform_batch': lambda: EB.transform_batch(occurrences),
+        'occurrence.transform_batch': lambda: OB.transform_batch(occurrences),
+        'taxon.registry': lambda: TaxonRegistry().intern_batch(frame[TAXON_COLUMNS]),
+        'batch.to_arrow': lambda: batch.to_arrow(),
+        'batchify': lambda: batchify(transform_batch_slice, occurrences, hide_bar=True),
+    }
+
+
+def cachr_stages(frame, connection: str) -> Dict[str, Callable]:
+    records = frame[OCCURRENCE_COLUMNS].astype(str).to_dict('records')
+    items = {f"occurrence/{record['occurrenceID']}": record for record in records}
+    eps = [*items]
+
+    cachr = Cachr('benchmarks', connection=connection)
+
+    def single():
+        for ep in eps:
+            cachr.is_cachd(ep)
+
+    return {
+        'cachr.cach_many': lambda: cachr.cach_many(items),
+        'cachr.get_many': lambda: cachr.get_many(eps),
+        'cachr.is_cachd': single,
+    }, cachr
+
+
+def cachr_connection(mongo: str):
+    """Connection of the Cachr stages, None if there is no MongoDB
+    """
+    if mongo is not None:
+        return mongo
+
+    try:
+        import mongomock
+    except ImportError:
+        log.warning("Skipping the Cachr stages: use --mongo or install mongomock")
+        return None
+
+    if STANDIN_CONNECTION not in ClientRegistry._clients:
+        ClientRegistry.register(STANDIN_CONNECTION, mongomock.MongoClient())
+
+    return STANDIN_CONNECTION
+
+
+def run(scales: List[int], stages: List[str] = None, repeat: int = 3, warmup: int = 1,
+        seed: int = 0, row_limit: int = 100_000, cachr_limit: int = 1_000,
+        mongo: str = None, memory: bool = True) -> dict:
+    """Runs the stages at every scale
+
+    Parameters
+    ----------
+    scales : List[int]
+        Number of rows of every run, e.g. 10_000 to 10_000_000
+    stages : List[str], optional
+        Stages to run, by default all of them
+    repeat : int, optional
+        Timed runs per stage, by default 3
+    warmup : int, optional
+        Untimed runs per stage, by default 1
+    seed : int, optional
+        Seed of the synthetic data, by default 0
+    row_limit : int, optional
+        Max rows of the row by row stages, by default 100_000
+    cachr_limit : int, optional
+        Max documents of the Cachr stages, by default 1_000
+    mongo : str, optional
+        MongoDB connection of the Cachr stages, by default a mongomock stand-in
+    memory : bool, optional
+        Measures the peak memory, by default True
+
+    Returns
+    -------
+    dict
+        Environment, configuration and results
+    """
+    config = {'scales': scales, 'stages': stages, 'repeat': repeat, 'warmup': warmup,
+              'seed': seed, 'row_limit': row_limit, 'cachr_limit': cachr_limit,
+              'cachr_backend': 'mongodb' if mongo else 'mongomock'}
+    results = []
+
+    def selected(name):
+        return stages is None or name in stages or name.split('.')[0] in stages
+
+    with_cachr = any(selected(name) for name in ('cachr.cach_many', 'cachr.get_many',
+                                                 'cachr.is_cachd'))
+
+    for scale in scales:
+        log.info(f"Generating {scale} rows")
+        frame = occurrence_frame(scale, seed=seed)
+        limited = frame.iloc[:row_limit]
+
+        groups = [(batch_stages, frame), (row_stages, limited)]
+        for factory, data in groups:
+            for name, func in factory(data).items():
+                if selected(name):
+                    log.info(f"Running {name} with {len(data)} rows")
+                    results.append(measure(name, func, len(data), repeat, warmup, memory,
+                                           scale=scale))
+
+        connection = cachr_connection(mongo) if with_cachr else None
+        if connection is not None:
+            cachr_data = frame.iloc[:cachr_limit]
+            funcs, cachr = cachr_stages(cachr_data, connection)
+            try:
+                for name, func in funcs.items():
+                    if selected(name):
+                        log.info(f"Running {name} with {len(cachr_data)} rows")
+                        results.append(measure(name, func, len(cachr_data), repeat, warmup,
+                                               memory, scale=scale))
+            finally:
+                cachr.cachr_collection.drop()
+                cachr.close()
+
+        del frame, limited
+
+    return {'environment': environment(), 'config': config, 'results': results}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+
+    parser.add_argument('-r', '--rows', help='Scales to run, in rows',
+                        type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('-s', '--stages', help='Stages or groups (event, cachr, ...) to run',
+                        nargs='*', default=None)
+    parser.add_argument('-n', '--repeat', help='Timed runs per stage', type=int, default=3)
+    parser.add_argument('-w', '--warmup', help='Untimed runs per stage', type=int, default=1)
+    parser.add_argument('--seed', help='Seed of the synthetic data', type=int, default=0)
+    parser.add_argument('--row_limit', help='Max rows of the row by row stages',
+                        type=int, default=100_000)
+    parser.add_argument('--cachr_limit', help='Max documents of the Cachr stages',
+                        type=int, default=1_000)
+    parser.add_argument('--mongo', help='MongoDB connection of the Cachr stages', default=None)
+    parser.add_argument('--no_memory', help='Skips the peak memory run', action='store_true')
+    parser.add_argument('-o', '--output', help='JSON file of the results', default=None)
+
+    ARGS = parser.parse_args()
+
+    try:
+        report = run(ARGS.rows, ARGS.stages, ARGS.repeat, ARGS.warmup, ARGS.seed,
+                     ARGS.row_limit, ARGS.cachr_limit, ARGS.mongo, not ARGS.no_memory)
+    except Exception:
+        log_exception(log, "Benchmarks failed")
+        raise
+
+    print(summary(report['results']))
+
+    if ARGS.output:
+        Path(ARGS.output).write_text(json.dumps(report, indent=2))
+        log.info(f"Results written to {ARGS.output}")
@@ -2,40 +2,138 @@
 
 I can't move, and I don't want to
 """
+import functools
+import time
+
 from abc import ABC, abstractmethod
-from typing import List
+from contextlib import contextmanager
+from typing import List, Optional, Union
 
-from uuid import uuid4
+import numpy as np
+import pandas as pd
 
 from pydantic import BaseModel
 from pydantic.class_validators import root_validator
 
+from da.models.batch import ColumnarBatch, RecordView, as_frame, reject
+from da.models.ids import STRATEGIES, IDStrategy, UUID4Strategy
 from da.utils.log import get_logger
+from da.utils.metrics import METRICS
 
 log = get_logger(__name__)
 
 class IDiedModel(BaseModel):
     id: str
-    
-    __ALL_IDS__: set = set()
+
+    # Shared by the subclasses until one of them sets its own
+    __ID_STRATEGY__: IDStrategy = UUID4Strategy()
+
+    @classmethod
+    def use_id_strategy(cls, strategy: Union[IDStrategy, str]):
+        """Sets how the missing ids of this model (and its subclasses
+        without their own strategy) are created
+
+        Parameters
+        ----------
+        strategy : IDStrategy | str
+            Strategy or its name: uuid4, uuid7 or content
+        """
+        if isinstance(strategy, str):
+            strategy = STRATEGIES[strategy]()
+
+        cls.__ID_STRATEGY__ = strategy
+
+    @classmethod
+    @contextmanager
+    def id_strategy(cls, strategy: Union[IDStrategy, str]):
+        """use_id_strategy only within a with block, the previous strategy
+        of the model is restored at its end
+
+        Parameters
+        ----------
+        strategy : IDStrategy | str
+            Strategy or its name: uuid4, uuid7 or content
+        """
+        # None when the strategy is inherited
+        previous = cls.__dict__.get('__ID_STRATEGY__')
+        cls.use_id_strategy(strategy)
+        try:
+            yield cls.__ID_STRATEGY__
+        finally:
+            if previous is None:
+                del cls.__ID_STRATEGY__
+            else:
+                cls.__ID_STRATEGY__ = previous
 
     @classmethod
-    def create_id(cls) -> str:
+    def create_id(cls, values: dict = None) -> str:
         """
-        Creates a unique uuid ID
+        Creates a unique ID with the strategy of the model
+
+        Parameters
+        ----------
+        values : dict, optional
+            Raw values of the model, used by the content strategies
 
         Returns
         -------
         str
-            String of the uuid unique ID.
+            String of the unique ID.
+        """
+        return cls.__ID_STRATEGY__.create(values)
+
+    @classmethod
+    def create_ids(cls, size: int, columns: dict = None) -> List[str]:
+        """
+        Creates size IDs at once, for the batch builders
+
+        Parameters
+        ----------
+        size : int
+            Number of IDs
+        columns : dict, optional
+            Raw values of the models by column
+
+        Returns
+        -------
+        List[str]
+            Strings of the unique IDs.
+        """
+        return cls.__ID_STRATEGY__.create_many(size, columns)
+
+    @classmethod
+    def fill_ids(cls, ids: Optional[pd.Series], frame: pd.DataFrame) -> np.ndarray:
+        """
+        Keeps the given IDs and creates the missing ones in bulk
+
+        Parameters
+        ----------
+        ids : pd.Series, optional
+            Given IDs, None if the batch has none
+        frame : pd.DataFrame
+            Raw values of the batch
+
+        Returns
+        -------
+        np.ndarray
+            object array of IDs
         """
-        tmp_id = str(uuid4())
-        if tmp_id in cls.__ALL_IDS__:
-            tmp_id = cls.create_id()
+        size = len(frame)
+        if ids is None:
+            ids = np.full(size, None, dtype=object)
+            missing = np.ones(size, dtype=bool)
+        else:
+            missing = ids.isna().to_numpy()
+            ids = ids.astype(str).to_numpy(dtype=object)
 
-        cls.__ALL_IDS__.add(tmp_id)
+        if missing.any():
+            columns, fields = None, cls.__ID_STRATEGY__.fields
+            if fields is not None:
+                columns = {name: frame[name].to_numpy(dtype=object)[missing]
+                           for name in fields if name in frame}
+            ids[missing] = cls.create_ids(int(missing.sum()), columns)
 
-        return tmp_id
+        return ids
 
     @root_validator(pre=True)
     def create_id_if_not(cls, values: dict) -> dict:
@@ -53,12 +151,74 @@ class IDiedModel(BaseModel):
             Same object with modified keys
         """
         if 'id' not in values:
-            values['id'] = cls.create_id()
+            values['id'] = cls.create_id(values)
 
         return values
 
+def metered_transform(func):
+    """Observes the seconds of every transform in da_transform_seconds and
+    counts the rows accepted and rejected in da_rows_total
+    """
+    @functools.wraps(func)
+    def transform(cls, *args, **kwargs):
+        if not METRICS.enabled:
+            return func(cls, *args, **kwargs)
+
+        start = time.perf_counter()
+        status = 'rejected'
+        try:
+            model = func(cls, *args, **kwargs)
+            status = 'accepted'
+            return model
+        finally:
+            METRICS.observe('da_transform_seconds', time.perf_counter() - start,
+                            builder=cls.__name__)
+            METRICS.inc('da_rows_total', builder=cls.__name__, status=status)
+
+    return transform
+
+def metered_transform_batch(func):
+    """Observes the seconds of every transform_batch in
+    da_transform_batch_seconds and counts its rows in da_batch_rows_total.
+
+    It also adds the error_policy option: the rejected rows are written
+    to the dead letter sink of the ErrorPolicy
+    """
+    @functools.wraps(func)
+    def transform_batch(cls, data, *args, error_policy=None, **kwargs):
+        if not METRICS.enabled and error_policy is None:
+            return func(cls, data, *args, **kwargs)
+
+        with METRICS.timer('da_transform_batch_seconds', builder=cls.__name__):
+            batch = func(cls, data, *args, **kwargs)
+
+        if error_policy is not None:
+            error_policy.ok(len(batch))
+            error_policy.reject(batch.rejected, data, cls.__name__)
+
+        METRICS.inc('da_batch_rows_total', len(batch), builder=cls.__name__, status='accepted')
+        METRICS.inc('da_batch_rows_total', len(batch.rejected), builder=cls.__name__,
+                    status='rejected')
+
+        return batch
+
+    return transform_batch
+
 class BaseBuilder(ABC):
-    
+    View = RecordView
+
+    def __init_subclass__(cls, **kwargs):
+        """Meters the transform and transform_batch of every builder, and
+        adds the error_policy option to transform_batch
+        """
+        super().__init_subclass__(**kwargs)
+
+        for name, meter in (('transform', metered_transform),
+                            ('transform_batch', metered_transform_batch)):
+            method = cls.__dict__.get(name)
+            if isinstance(method, classmethod):
+                setattr(cls, name, classmethod(meter(method.__func__)))
+
     @classmethod
     @abstractmethod
     def transform(cls, data:dict):
@@ -68,4 +228,35 @@ class BaseBuilder(ABC):
         ----------
         data : dict
             _description_
-        """
\ No newline at end of file
+        """
+
+    @classmethod
+    @metered_transform_batch
+    def transform_batch(cls, data) -> ColumnarBatch:
+        """Creates the models of a whole batch calling transform per row.
+        Builders with a vectorized version override it.
+
+        Parameters
+        ----------
+        data : pd.DataFrame | pa.Table
+            Rows to transform, one column per field of the Model
+        error_policy : ErrorPolicy, optional
+            Also writes the rejected rows to its dead letter sink, in every builder
+
+        Returns
+        -------
+        ColumnarBatch
+            Serialized models of the accepted rows and the rejected ones
+        """
+        frame = as_frame(data)
+        frame = frame.astype(object).where(frame.notna(), None)
+
+        records, index, rejected = [], [], {}
+        for label, row in zip(frame.index, frame.to_dict('records')):
+            try:
+                records.append(cls.transform(row).dict())
+                index.append(label)
+            except Exception as e:
+                reject(rejected, label, str(e))
+
+        return ColumnarBatch.from_records(records, index, rejected, cls)
\ No newline at end of file
@@ -0,0 +1,428 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Remember to update the PYTHON_PATH to
+# export PYTHONPATH=`pwd`:`pwd`
+"""
+Columnar containers used by the transform_batch path of the builders
+"""
+from datetime import timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import shapely
+
+from shapely.geometry.base import BaseGeometry
+
+from da.utils.log import get_logger
+log = get_logger(__name__)
+
+
+def as_frame(data) -> pd.DataFrame:
+    """Normalizes the accepted batch inputs to a pandas DataFrame
+
+    Parameters
+    ----------
+    data : pd.DataFrame | pa.Table | ColumnarBatch
+        Batch to normalize
+
+    Returns
+    -------
+    pd.DataFrame
+        The same data as DataFrame
+
+    Raises
+    ------
+    TypeError
+        If the data is not a supported batch
+    """
+    if isinstance(data, pd.DataFrame):
+        return data
+    if isinstance(data, pa.Table):
+        return data.to_pandas()
+    if isinstance(data, ColumnarBatch):
+        return data.to_pandas()
+
+    raise TypeError(f"Cannot build a batch from {type(data).__name__}")
+
+
+def reject(rejected: Dict[Any, str], label: Any, reason: str):
+    """Registers the reason why a row was rejected. If the row was
+    already rejected the reasons are concatenated
+
+    Parameters
+    ----------
+    rejected : Dict[Any, str]
+        Rejected rows by label
+    label : Any
+        Label of the row in the original batch
+    reason : str
+        Why the row was rejected
+    """
+    if label in rejected:
+        rejected[label] = f"{rejected[label]}; {reason}"
+    else:
+        rejected[label] = reason
+
+
+def coerce_float(values: pd.Series, name: str,
+                 rejected: Dict[Any, str]) -> np.ndarray:
+    """Vectorized float(value). Values that pandas cannot convert are
+    checked again with float, so the rule is the same as the row path.
+    Missing values are rejected, as the row path receives them as None.
+
+    Parameters
+    ----------
+    values : pd.Series
+        Column to convert
+    name : str
+        Name of the column, used for the rejection reason
+    rejected : Dict[Any, str]
+        Rejected rows by label
+
+    Returns
+    -------
+    np.ndarray
+        float64 array with the same length as values
+    """
+    coerced = pd.to_numeric(values, errors='coerce').to_numpy(
+        dtype=np.float64, copy=True)
+
+    missing = values.isna().to_numpy()
+    for pos in np.flatnonzero(missing):
+        reject(rejected, values.index[pos], f"{name}: none is not an allowed value")
+
+    if not pd.api.types.is_numeric_dtype(values.dtype):
+        raw = values.to_numpy(dtype=object)
+        for pos in np.flatnonzero(np.isnan(coerced) & ~missing):
+            try:
+                coerced[pos] = float(raw[pos])
+            except (TypeError, ValueError):
+                reject(rejected, values.index[pos],
+                       f"{name}: could not convert {raw[pos]!r} to float")
+
+    return coerced
+
+
+def coerce_str(values: pd.Series, name: str,
+               rejected: Dict[Any, str], required: bool = True) -> np.ndarray:
+    """Vectorized str(value) keeping the missing values as None
+
+    Parameters
+    ----------
+    values : pd.Series
+        Column to convert
+    name : str
+        Name of the column, used for the rejection reason
+    rejected : Dict[Any, str]
+        Rejected rows by label
+    required : bool, optional
+        If missing values reject the row, by default True
+
+    Returns
+    -------
+    np.ndarray
+        object array of str or None
+    """
+    missing = values.isna().to_numpy()
+    coerced = values.astype(str).to_numpy(dtype=object)
+    coerced[missing] = None
+
+    if required:
+        for pos in np.flatnonzero(missing):
+            reject(rejected, values.index[pos], f"{name}: none is not an allowed value")
+
+    return coerced
+
+
+def as_python(value):
+    """Converts a value read from a column to its python version.
+    Datetimes are naive UTC in the batch, so they are localized again
+
+    Parameters
+    ----------
+    value : Any
+        Value of the column
+
+    Returns
+    -------
+    Any
+        Python version of the value, None for NaT
+    """
+    if isinstance(value, np.datetime64):
+        if np.isnat(value):
+            return None
+        return value.astype('datetime64[us]').item().replace(tzinfo=timezone.utc)
+    if isinstance(value, np.generic):
+        return value.item()
+
+    return value
+
+
+class RecordView:
+    """Read only view of one row of a ColumnarBatch. Nothing is copied, the
+    fields are read from the columns of the batch when accessed.
+
+    Parameters
+    ----------
+    batch : ColumnarBatch
+        Batch that owns the columns
+    pos : int
+        Position of the row in the batch
+    """
+    __slots__ = ('_batch', '_pos')
+
+    def __init__(self, batch: 'ColumnarBatch', pos: int) -> None:
+        self._batch = batch
+        self._pos = pos
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        try:
+            column = self._batch.columns[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+        return as_python(column[self._pos])
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.dict()!r})"
+
+    def dict(self) -> dict:
+        """Returns the serializable version of the row
+
+        Returns
+        -------
+        dict
+            One key per column of the batch
+        """
+        pos = self._pos
+        return {k: as_python(v[pos]) for k, v in self._batch.columns.items()}
+
+    def to_model(self):
+        """Builds the full Model of the row with the builder of the batch
+
+        Returns
+        -------
+        Model
+            Typed version of the row
+        """
+        if self._batch.builder is None:
+            raise TypeError("The batch was not created by a builder")
+
+        return self._batch.builder.transform(self.dict())
+
+
+class ColumnarBatch:
+    """Validated records stored by column instead of by model.
+
+    Datetime columns are kept as naive UTC datetime64 and localized again
+    when the batch is exported.
+
+    Parameters
+    ----------
+    columns : Dict[str, np.ndarray]
+        Arrays of the accepted rows, all with the same length
+    index : np.ndarray
+        Labels of the accepted rows in the original input
+    rejected : Dict[Any, str], optional
+        Labels of the rejected rows with the reason
+    builder : BaseBuilder, optional
+        Builder that created the batch, it provides the View of the rows
+    """
+
+    def __init__(self,
+                 columns: Dict[str, np.ndarray],
+                 index: Optional[np.ndarray] = None,
+                 rejected: Optional[Dict[Any, str]] = None,
+                 builder=None) -> None:
+        lengths = {len(v) for v in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError("All the columns of a batch must have the same length")
+
+        size = lengths.pop() if lengths else 0
+
+        self.columns = columns
+        self.index = np.arange(size) if index is None else np.asarray(index)
+        self.rejected = {} if rejected is None else rejected
+        self.builder = builder
+        self.view = getattr(builder, 'View', RecordView)
+
+    @classmethod
+    def from_validated(cls, columns: Dict[str, np.ndarray], index: pd.Index,
+                       rejected: Dict[Any, str], builder=None) -> 'ColumnarBatch':
+        """Creates the batch dropping the rejected rows from the columns
+
+        Parameters
+        ----------
+        columns : Dict[str, np.ndarray]
+            Arrays of all the rows of the input
+        index : pd.Index
+            Labels of all the rows of the input
+        rejected : Dict[Any, str]
+            Rejected rows with the reason
+        builder : BaseBuilder, optional
+            Builder that validated the columns
+
+        Returns
+        -------
+        ColumnarBatch
+            Batch with the accepted rows only
+        """
+        keep = ~index.isin([*rejected])
+        columns = {k: v[keep] for k, v in columns.items()}
+
+        return cls(columns, index.to_numpy()[keep], rejected, builder)
+
+    @classmethod
+    def from_frame(cls, frame: pd.DataFrame,
+                   rejected: Optional[Dict[Any, str]] = None,
+                   builder=None) -> 'ColumnarBatch':
+        """Creates the batch from a DataFrame
+
+        Parameters
+        ----------
+        frame : pd.DataFrame
+            Accepted rows
+        rejected : Dict[Any, str], optional
+            Rejected rows with the reason
+        builder : BaseBuilder, optional
+            Builder that validated the rows
+
+        Returns
+        -------
+        ColumnarBatch
+            Batch with the columns of the frame
+        """
+        columns = {}
+        for name in frame.columns:
+            series = frame[name]
+            if isinstance(series.dtype, pd.DatetimeTZDtype):
+                series = series.dt.tz_convert('UTC').dt.tz_localize(None)
+            columns[name] = series.to_numpy()
+
+        return cls(columns, frame.index.to_numpy(), rejected, builder)
+
+    @classmethod
+    def from_records(cls, records: List[dict],
+                     index: Iterable,
+                     rejected: Optional[Dict[Any, str]] = None,
+                     builder=None) -> 'ColumnarBatch':
+        """Creates the batch from a list of serialized models
+
+        Parameters
+        ----------
+        records : List[dict]
+            Output of Model.dict() of the accepted rows
+        index : Iterable
+            Labels of the accepted rows
+        rejected : Dict[Any, str], optional
+            Rejected rows with the reason
+        builder : BaseBuilder, optional
+            Builder that created the models
+
+        Returns
+        -------
+        ColumnarBatch
+            Batch with one column per key of the records
+        """
+        index = np.asarray([*index])
+        names = {}
+        for record in records:
+            names.update(dict.fromkeys(record))
+
+        columns = {}
+        for name in names:
+            column = np.empty(len(records), dtype=object)
+            column[:] = [record.get(name) for record in records]
+            columns[name] = column
+
+        return cls(columns, index, rejected, builder)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.columns
+
+    def row(self, pos: int) -> RecordView:
+        """Returns the view of the row in the position pos
+
+        Parameters
+        ----------
+        pos : int
+            Position of the row in the batch
+
+        Returns
+        -------
+        RecordView
+            View of the row, no data is copied
+        """
+        if not -len(self) <= pos < len(self):
+            raise IndexError(f"Row {pos} out of range")
+
+        return self.view(self, pos % len(self))
+
+    def rows(self) -> Iterator[RecordView]:
+        """Iterates over the views of the rows
+        """
+        view = self.view
+        for pos in range(len(self)):
+            yield view(self, pos)
+
+    def to_dicts(self) -> List[dict]:
+        """Serializable version of every row, same as Model.dict()
+        """
+        return [row.dict() for row in self.rows()]
+
+    def to_models(self) -> list:
+        """Builds the full Model of every row. Only use it when the
+        models are really needed
+        """
+        return [row.to_model() for row in self.rows()]
+
+    @property
+    def column_names(self) -> List[str]:
+        return [*self.columns]
+
+    @property
+    def rejected_index(self) -> List[Any]:
+        """Labels of the rows rejected while building the batch
+        """
+        return [*self.rejected]
+
+    def to_pandas(self) -> pd.DataFrame:
+        """Returns the accepted rows as DataFrame
+
+        Returns
+        -------
+        pd.DataFrame
+            One column per column of the batch
+        """
+        frame = pd.DataFrame(self.columns, index=self.index)
+        for name, column in self.columns.items():
+            if np.issubdtype(column.dtype, np.datetime64):
+                frame[name] = frame[name].dt.tz_localize('UTC')
+
+        return frame
+
+    def to_arrow(self) -> pa.Table:
+        """Returns the accepted rows as an arrow Table
+
+        Returns
+        -------
+        pa.Table
+            One column per column of the batch, geometries as WKB
+        """
+        frame = self.to_pandas()
+        for name, column in self.columns.items():
+            # Geometries are stored as WKB
+            if column.dtype == object and len(column) and isinstance(column[0], BaseGeometry):
+                frame[name] = shapely.to_wkb(column)
+
+        return pa.Table.from_pandas(frame, preserve_index=False)
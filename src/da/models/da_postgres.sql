@@ -64,9 +64,29 @@ CREATE TABLE IF NOT EXISTS public.raw_taxa
         ON DELETE NO ACTION
 );
 
+-- Supporting indexes. The PK of raw_occurrences starts with occurrence_id,
+-- so the FK checks of raw_events and the lookups by taxon need their own
+CREATE INDEX IF NOT EXISTS ix_raw_occurrences_event_id
+    ON public.raw_occurrences (event_id);
+
+CREATE INDEX IF NOT EXISTS ix_raw_occurrences_taxon_verbatim_id
+    ON public.raw_occurrences (taxon_verbatim_id);
+
+CREATE INDEX IF NOT EXISTS ix_raw_events_event_type_id
+    ON public.raw_events (event_type_id);
+
 INSERT INTO public.event_types(
 	id, event)
-	VALUES (1, 'catalog');
+	VALUES (1, 'catalog')
+	ON CONFLICT (id) DO NOTHING;
+
+-- The add_* functions are safe to call from concurrent loaders: every
+-- insert is an INSERT ... ON CONFLICT on the unique key, so there is no
+-- window between the check and the insert. They write, so PostgreSQL
+-- requires them to be PARALLEL UNSAFE, which only concerns parallel query
+-- plans and not concurrent sessions. The array overloads process a whole
+-- batch per call, sorted by key so concurrent batches lock in the same order.
+-- Pass typed arrays (e.g. $1::text[]), untyped literals pick the single row version.
 
 CREATE OR REPLACE FUNCTION public.add_raw_occurrence(
 	in_occurrence_id text,
@@ -79,16 +99,39 @@ CREATE OR REPLACE FUNCTION public.add_raw_occurrence(
 AS $BODY$
 BEGIN
 
-    IF NOT EXISTS(SELECT occurrence_id FROM public.raw_occurrences where occurrence_id=in_occurrence_id)
-    THEN
-		INSERT INTO public.raw_occurrences(
-			occurrence_id, taxon_verbatim_id, event_id, updated_at)
-		VALUES (in_occurrence_id, in_taxon_verbatim_id, in_event_id, NOW());
-	ELSE
-		UPDATE public.raw_occurrences
-		set updated_at = NOW()
-		where occurrence_id = in_occurrence_id and taxon_verbatim_id = in_taxon_verbatim_id;
-		END IF;
+	INSERT INTO public.raw_occurrences(
+		occurrence_id, taxon_verbatim_id, event_id, updated_at)
+	VALUES (in_occurrence_id, in_taxon_verbatim_id, in_event_id, NOW())
+	ON CONFLICT (occurrence_id, taxon_verbatim_id) DO UPDATE
+	SET updated_at = EXCLUDED.updated_at;
+END;
+$BODY$;
+
+CREATE OR REPLACE FUNCTION public.add_raw_occurrence(
+	in_occurrence_ids text[],
+	in_taxon_verbatim_ids text[],
+	in_event_ids text[])
+    RETURNS bigint
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+AS $BODY$
+DECLARE
+	n_rows bigint;
+BEGIN
+
+	INSERT INTO public.raw_occurrences(
+		occurrence_id, taxon_verbatim_id, event_id, updated_at)
+	SELECT DISTINCT ON (o.occurrence_id, o.taxon_verbatim_id)
+		o.occurrence_id, o.taxon_verbatim_id, o.event_id, NOW()
+	FROM unnest(in_occurrence_ids, in_taxon_verbatim_ids, in_event_ids)
+		AS o(occurrence_id, taxon_verbatim_id, event_id)
+	ORDER BY o.occurrence_id, o.taxon_verbatim_id
+	ON CONFLICT (occurrence_id, taxon_verbatim_id) DO UPDATE
+	SET updated_at = EXCLUDED.updated_at;
+
+	GET DIAGNOSTICS n_rows = ROW_COUNT;
+	RETURN n_rows;
 END;
 $BODY$;
 
@@ -105,13 +148,39 @@ CREATE OR REPLACE FUNCTION public.add_raw_event_1(
 AS $BODY$
 BEGIN
 
-    IF NOT EXISTS(SELECT event_id FROM public.raw_events where event_id=in_event_id)
-    THEN
-		INSERT INTO public.raw_events(
-			event_id, longitude, latitude, coordinates, event_type_id, event_date)
-		VALUES (in_event_id, in_longitude, in_latitude, POINT(in_longitude, in_latitude), in_event_type_id, in_event_date);
-		END IF;
-	
+	INSERT INTO public.raw_events(
+		event_id, longitude, latitude, coordinates, event_type_id, event_date)
+	VALUES (in_event_id, in_longitude, in_latitude, POINT(in_longitude, in_latitude), in_event_type_id, in_event_date)
+	ON CONFLICT (event_id) DO NOTHING;
+END;
+$BODY$;
+
+CREATE OR REPLACE FUNCTION public.add_raw_event_1(
+	in_event_ids text[],
+	in_longitudes double precision[],
+	in_latitudes double precision[],
+	in_event_type_ids integer[],
+	in_event_dates date[])
+    RETURNS bigint
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+AS $BODY$
+DECLARE
+	n_rows bigint;
+BEGIN
+
+	INSERT INTO public.raw_events(
+		event_id, longitude, latitude, coordinates, event_type_id, event_date)
+	SELECT DISTINCT ON (e.event_id)
+		e.event_id, e.longitude, e.latitude, POINT(e.longitude, e.latitude), e.event_type_id, e.event_date
+	FROM unnest(in_event_ids, in_longitudes, in_latitudes, in_event_type_ids, in_event_dates)
+		AS e(event_id, longitude, latitude, event_type_id, event_date)
+	ORDER BY e.event_id
+	ON CONFLICT (event_id) DO NOTHING;
+
+	GET DIAGNOSTICS n_rows = ROW_COUNT;
+	RETURN n_rows;
 END;
 $BODY$;
 
@@ -135,13 +204,47 @@ CREATE OR REPLACE FUNCTION public.add_raw_taxon(
 AS $BODY$
 BEGIN
 
-    IF NOT EXISTS(SELECT in_taxon_id FROM public.raw_taxa where taxon_id=in_taxon_id)
-    THEN
-		INSERT INTO public.raw_taxa(
-			taxon_id, kingdom, phylum, class_taxon, "order", family, subfamily, genus, subgenus, species, scientific_name, canonical_name)
-			VALUES (in_taxon_id, in_kingdom, in_phylum, in_class_taxon, in_order, in_family, in_subfamily, in_genus, in_subgenus, in_species, in_scientific_name, in_canonical_name);	
-    END IF;
-	
+	INSERT INTO public.raw_taxa(
+		taxon_id, kingdom, phylum, class_taxon, "order", family, subfamily, genus, subgenus, species, scientific_name, canonical_name)
+		VALUES (in_taxon_id, in_kingdom, in_phylum, in_class_taxon, in_order, in_family, in_subfamily, in_genus, in_subgenus, in_species, in_scientific_name, in_canonical_name)
+	ON CONFLICT (taxon_id) DO NOTHING;
+END;
+$BODY$;
+
+CREATE OR REPLACE FUNCTION public.add_raw_taxon(
+	in_taxon_ids text[],
+	in_kingdoms text[],
+	in_phyla text[],
+	in_class_taxa text[],
+	in_orders text[],
+	in_families text[],
+	in_subfamilies text[],
+	in_genera text[],
+	in_subgenera text[],
+	in_species text[],
+	in_scientific_names text[],
+	in_canonical_names text[])
+    RETURNS bigint
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+AS $BODY$
+DECLARE
+	n_rows bigint;
+BEGIN
+
+	INSERT INTO public.raw_taxa(
+		taxon_id, kingdom, phylum, class_taxon, "order", family, subfamily, genus, subgenus, species, scientific_name, canonical_name)
+	SELECT DISTINCT ON (t.taxon_id)
+		t.taxon_id, t.kingdom, t.phylum, t.class_taxon, t.order_taxon, t.family, t.subfamily, t.genus, t.subgenus, t.species, t.scientific_name, t.canonical_name
+	FROM unnest(in_taxon_ids, in_kingdoms, in_phyla, in_class_taxa, in_orders, in_families,
+				in_subfamilies, in_genera, in_subgenera, in_species, in_scientific_names, in_canonical_names)
+		AS t(taxon_id, kingdom, phylum, class_taxon, order_taxon, family, subfamily, genus, subgenus, species, scientific_name, canonical_name)
+	ORDER BY t.taxon_id
+	ON CONFLICT (taxon_id) DO NOTHING;
+
+	GET DIAGNOSTICS n_rows = ROW_COUNT;
+	RETURN n_rows;
 END;
 $BODY$;
 
@@ -158,15 +261,45 @@ CREATE OR REPLACE FUNCTION public.add_taxon(
 AS $BODY$
 BEGIN
 
-    IF NOT EXISTS(SELECT id FROM public.taxon_id_verbatim where verbatim_source = verb_source AND verbatim_id = verb_id)
-    THEN
-		INSERT INTO public.taxon_id_verbatim(
-		id, verbatim_source, verbatim_id)
-		VALUES (taxon_id, verb_source, verb_id);	
-    END IF;
-	
+	-- A concurrent insert of the same key waits for the other transaction,
+	-- then the key is read below
+	INSERT INTO public.taxon_id_verbatim(
+	id, verbatim_source, verbatim_id)
+	VALUES (add_taxon.taxon_id, verb_source, verb_id)
+	ON CONFLICT (verbatim_source, verbatim_id) DO NOTHING;
+
 	RETURN QUERY
-	SELECT id FROM public.taxon_id_verbatim where verbatim_source = verb_source AND verbatim_id = verb_id;
+	SELECT t.id FROM public.taxon_id_verbatim t where t.verbatim_source = verb_source AND t.verbatim_id = verb_id;
+END;
+$BODY$;
+
+CREATE OR REPLACE FUNCTION public.add_taxon(
+	taxon_ids text[],
+	verb_sources text[],
+	verb_ids text[])
+    RETURNS TABLE(_id text, _verbatim_source text, _verbatim_id text)
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+    ROWS 1000
+
+AS $BODY$
+BEGIN
+
+	INSERT INTO public.taxon_id_verbatim(
+	id, verbatim_source, verbatim_id)
+	SELECT DISTINCT ON (v.verbatim_source, v.verbatim_id) v.id, v.verbatim_source, v.verbatim_id
+	FROM unnest(taxon_ids, verb_sources, verb_ids) AS v(id, verbatim_source, verbatim_id)
+	ORDER BY v.verbatim_source, v.verbatim_id
+	ON CONFLICT (verbatim_source, verbatim_id) DO NOTHING;
+
+	-- The id of every key, new or registered before
+	RETURN QUERY
+	SELECT t.id, t.verbatim_source, t.verbatim_id
+	FROM public.taxon_id_verbatim t
+	JOIN (SELECT DISTINCT s.verbatim_source, s.verbatim_id
+		  FROM unnest(verb_sources, verb_ids) AS s(verbatim_source, verbatim_id)) k
+		ON t.verbatim_source = k.verbatim_source AND t.verbatim_id = k.verbatim_id;
 END;
 $BODY$;
 
@@ -176,7 +309,7 @@ CREATE OR REPLACE FUNCTION public.is_in_verbatim_ids(
     RETURNS TABLE(_id text, _verbatim_source text, _verbatim_id text, _taxon_id text) 
     LANGUAGE 'plpgsql'
     COST 100
-    VOLATILE PARALLEL UNSAFE
+    STABLE PARALLEL SAFE
     ROWS 1000
 
 AS $BODY$
@@ -186,4 +319,188 @@ BEGIN
 	FROM public.taxon_id_verbatim where verbatim_id = ANY(in_verbatim_ids) and verbatim_source = in_source_id;
 	
 END;
-$BODY$;
\ No newline at end of file
+$BODY$;
+
+-- Bulk loading. The loader COPYs the batches into the session staging
+-- tables and merges them with one statement per table. Every merge returns
+-- the rows inserted, updated and skipped of the staged rows.
+
+CREATE OR REPLACE FUNCTION public.create_staging_tables()
+    RETURNS void
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+AS $BODY$
+BEGIN
+
+	CREATE TEMP TABLE IF NOT EXISTS stage_taxa
+	(
+		taxon_id text,
+		verbatim_source text,
+		verbatim_id text,
+		kingdom text,
+		phylum text,
+		class_taxon text,
+		"order" text,
+		family text,
+		subfamily text,
+		genus text,
+		subgenus text,
+		species text,
+		scientific_name text,
+		canonical_name text
+	);
+
+	CREATE TEMP TABLE IF NOT EXISTS stage_events
+	(
+		event_id text,
+		longitude double precision,
+		latitude double precision,
+		event_type text,
+		event_date timestamp without time zone
+	);
+
+	CREATE TEMP TABLE IF NOT EXISTS stage_occurrences
+	(
+		occurrence_id text,
+		verbatim_source text,
+		verbatim_id text,
+		event_id text
+	);
+
+	TRUNCATE stage_taxa, stage_events, stage_occurrences;
+END;
+$BODY$;
+
+CREATE OR REPLACE FUNCTION public.merge_taxa()
+    RETURNS TABLE(inserted bigint, updated bigint, skipped bigint)
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+AS $BODY$
+DECLARE
+	n_staged bigint;
+	n_inserted bigint;
+	n_updated bigint;
+BEGIN
+	SELECT count(*) INTO n_staged FROM stage_taxa;
+
+	-- The verbatim keys already registered keep their id
+	INSERT INTO public.taxon_id_verbatim(id, verbatim_source, verbatim_id)
+	SELECT DISTINCT ON (s.verbatim_source, s.verbatim_id) s.taxon_id, s.verbatim_source, s.verbatim_id
+	FROM stage_taxa s
+	WHERE s.verbatim_source IS NOT NULL AND s.verbatim_id IS NOT NULL
+	ORDER BY s.verbatim_source, s.verbatim_id
+	ON CONFLICT DO NOTHING;
+
+	-- Resolves the ids of the whole batch at once
+	UPDATE stage_taxa s
+	SET taxon_id = t.id
+	FROM public.taxon_id_verbatim t
+	WHERE t.verbatim_source = s.verbatim_source AND t.verbatim_id = s.verbatim_id;
+
+	WITH upserted AS (
+		INSERT INTO public.raw_taxa(
+			taxon_id, kingdom, phylum, class_taxon, "order", family, subfamily, genus, subgenus, species, scientific_name, canonical_name)
+		SELECT DISTINCT ON (s.taxon_id)
+			s.taxon_id, s.kingdom, s.phylum, s.class_taxon, s."order", s.family, s.subfamily, s.genus, s.subgenus, s.species, s.scientific_name, s.canonical_name
+		FROM stage_taxa s
+		JOIN public.taxon_id_verbatim t ON t.id = s.taxon_id
+		ORDER BY s.taxon_id
+		ON CONFLICT (taxon_id) DO UPDATE
+		SET kingdom = EXCLUDED.kingdom, phylum = EXCLUDED.phylum, class_taxon = EXCLUDED.class_taxon,
+			"order" = EXCLUDED."order", family = EXCLUDED.family, subfamily = EXCLUDED.subfamily,
+			genus = EXCLUDED.genus, subgenus = EXCLUDED.subgenus, species = EXCLUDED.species,
+			scientific_name = EXCLUDED.scientific_name, canonical_name = EXCLUDED.canonical_name
+		WHERE (raw_taxa.kingdom, raw_taxa.phylum, raw_taxa.class_taxon, raw_taxa."order", raw_taxa.family,
+			   raw_taxa.subfamily, raw_taxa.genus, raw_taxa.subgenus, raw_taxa.species,
+			   raw_taxa.scientific_name, raw_taxa.canonical_name)
+			IS DISTINCT FROM
+			  (EXCLUDED.kingdom, EXCLUDED.phylum, EXCLUDED.class_taxon, EXCLUDED."order", EXCLUDED.family,
+			   EXCLUDED.subfamily, EXCLUDED.genus, EXCLUDED.subgenus, EXCLUDED.species,
+			   EXCLUDED.scientific_name, EXCLUDED.canonical_name)
+		RETURNING (xmax = 0) AS is_insert
+	)
+	SELECT count(*) FILTER (WHERE is_insert), count(*) FILTER (WHERE NOT is_insert)
+	INTO n_inserted, n_updated
+	FROM upserted;
+
+	RETURN QUERY SELECT n_inserted, n_updated, n_staged - n_inserted - n_updated;
+END;
+$BODY$;
+
+CREATE OR REPLACE FUNCTION public.merge_raw_events()
+    RETURNS TABLE(inserted bigint, updated bigint, skipped bigint)
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+AS $BODY$
+DECLARE
+	n_staged bigint;
+	n_inserted bigint;
+	n_updated bigint;
+BEGIN
+	SELECT count(*) INTO n_staged FROM stage_events;
+
+	-- Events with an unknown type are skipped
+	WITH upserted AS (
+		INSERT INTO public.raw_events(
+			event_id, longitude, latitude, coordinates, event_type_id, event_date)
+		SELECT DISTINCT ON (s.event_id)
+			s.event_id, s.longitude, s.latitude, POINT(s.longitude, s.latitude), et.id, s.event_date
+		FROM stage_events s
+		JOIN public.event_types et ON lower(et.event) = lower(s.event_type)
+		ORDER BY s.event_id
+		ON CONFLICT (event_id) DO UPDATE
+		SET longitude = EXCLUDED.longitude, latitude = EXCLUDED.latitude,
+			coordinates = EXCLUDED.coordinates, event_type_id = EXCLUDED.event_type_id,
+			event_date = EXCLUDED.event_date
+		WHERE (raw_events.longitude, raw_events.latitude, raw_events.event_type_id, raw_events.event_date)
+			IS DISTINCT FROM
+			  (EXCLUDED.longitude, EXCLUDED.latitude, EXCLUDED.event_type_id, EXCLUDED.event_date)
+		RETURNING (xmax = 0) AS is_insert
+	)
+	SELECT count(*) FILTER (WHERE is_insert), count(*) FILTER (WHERE NOT is_insert)
+	INTO n_inserted, n_updated
+	FROM upserted;
+
+	RETURN QUERY SELECT n_inserted, n_updated, n_staged - n_inserted - n_updated;
+END;
+$BODY$;
+
+CREATE OR REPLACE FUNCTION public.merge_raw_occurrences()
+    RETURNS TABLE(inserted bigint, updated bigint, skipped bigint)
+    LANGUAGE 'plpgsql'
+    COST 100
+    VOLATILE PARALLEL UNSAFE
+AS $BODY$
+DECLARE
+	n_staged bigint;
+	n_inserted bigint;
+	n_updated bigint;
+BEGIN
+	SELECT count(*) INTO n_staged FROM stage_occurrences;
+
+	-- The taxon of every occurrence is resolved with one join, the
+	-- occurrences of unknown taxa or events are skipped
+	WITH upserted AS (
+		INSERT INTO public.raw_occurrences(
+			occurrence_id, taxon_verbatim_id, event_id, updated_at)
+		SELECT DISTINCT ON (s.occurrence_id, t.id)
+			s.occurrence_id, t.id, s.event_id, NOW()
+		FROM stage_occurrences s
+		JOIN public.taxon_id_verbatim t
+			ON t.verbatim_source = s.verbatim_source AND t.verbatim_id = s.verbatim_id
+		JOIN public.raw_events e ON e.event_id = s.event_id
+		ORDER BY s.occurrence_id, t.id
+		ON CONFLICT (occurrence_id, taxon_verbatim_id) DO UPDATE
+		SET updated_at = EXCLUDED.updated_at, event_id = EXCLUDED.event_id
+		RETURNING (xmax = 0) AS is_insert
+	)
+	SELECT count(*) FILTER (WHERE is_insert), count(*) FILTER (WHERE NOT is_insert)
+	INTO n_inserted, n_updated
+	FROM upserted;
+
+	RETURN QUERY SELECT n_inserted, n_updated, n_staged - n_inserted - n_updated;
+END;
+$BODY$;
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Remember to update the PYTHON_PATH to
+# export PYTHONPATH=`pwd`:`pwd`
+"""
+ID strategies of the IDiedModel. None of them keeps the created ids, the
+collisions are avoided by construction
+"""
+import os
+import time
+import uuid
+
+from abc import ABC, abstractmethod
+from threading import Lock
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+# Namespace of the content hash ids, as the uuid5 namespaces
+CONTENT_NAMESPACE = uuid.UUID('6f3b2a4e-8d1c-4e5b-9a7f-2c1d0e9b8a76')
+
+
+def format_uuids(raw: np.ndarray) -> List[str]:
+    """Formats 16 byte rows as uuid strings
+
+    Parameters
+    ----------
+    raw : np.ndarray
+        uint8 array of shape (n, 16)
+
+    Returns
+    -------
+    List[str]
+        Canonical uuid strings
+    """
+    h = raw.tobytes().hex()
+
+    return [f"{h[i:i + 8]}-{h[i + 8:i + 12]}-{h[i + 12:i + 16]}-{h[i + 16:i + 20]}-{h[i + 20:i + 32]}"
+            for i in range(0, len(h), 32)]
+
+
+class IDStrategy(ABC):
+    """Creates the ids of the models. values are the raw values of the
+    model, so strategies can derive the id from the content
+    """
+    # Fields read by the strategy, None if it does not read the content
+    fields: Optional[Tuple[str, ...]] = None
+
+    @abstractmethod
+    def create(self, values: Optional[Mapping[str, Any]] = None) -> str:
+        """Creates one id
+
+        Parameters
+        ----------
+        values : Mapping[str, Any], optional
+            Values of the model
+
+        Returns
+        -------
+        str
+            New id
+        """
+
+    def create_many(self, size: int,
+                    columns: Optional[Mapping[str, Sequence]] = None) -> List[str]:
+        """Creates size ids at once. Strategies override it when they
+        have a faster bulk version
+
+        Parameters
+        ----------
+        size : int
+            Number of ids
+        columns : Mapping[str, Sequence], optional
+            Values of the models by column, all with length size
+
+        Returns
+        -------
+        List[str]
+            New ids
+        """
+        if columns is None:
+            return [self.create() for _ in range(size)]
+
+        names = [*columns]
+        return [self.create({name: columns[name][pos] for name in names})
+                for pos in range(size)]
+
+
+class UUID4Strategy(IDStrategy):
+    """Random uuid4 ids. With 122 random bits the collisions are not a
+    concern, so no set of the created ids is needed
+    """
+
+    def create(self, values: Optional[Mapping[str, Any]] = None) -> str:
+        return str(uuid.uuid4())
+
+    def create_many(self, size: int,
+                    columns: Optional[Mapping[str, Sequence]] = None) -> List[str]:
+        raw = np.frombuffer(os.urandom(16 * size), dtype=np.uint8).reshape(size, 16).copy()
+        raw[:, 6] = (raw[:, 6] & 0x0F) | 0x40
+        raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+
+        return format_uuids(raw)
+
+
+class UUID7Strategy(IDStrategy):
+    """Time ordered UUIDv7 ids (RFC 9562): 48 bits of unix milliseconds,
+    a 12 bits counter and 62 random bits. The ids created by a process are
+    strictly increasing, the counter borrows the next millisecond when it
+    overflows. Sorting them sorts by creation time, which keeps the
+    database indexes compact.
+    """
+
+    def __init__(self) -> None:
+        self._lock = Lock()
+        self._millis = 0
+        self._counter = 0
+
+    def _reserve(self, size: int):
+        """Reserves size consecutive (millisecond, counter) pairs
+
+        Returns
+        -------
+        Tuple[int, int]
+            Millisecond and counter of the first id
+        """
+        with self._lock:
+            now = time.time_ns() // 1_000_000
+            if now > self._millis:
+                # Random start, half of the range is left for the increments
+                self._millis = now
+                self._counter = int.from_bytes(os.urandom(2), 'big') & 0x7FF
+
+            millis, counter = self._millis, self._counter
+
+            end = counter + size
+            self._millis += end >> 12
+            self._counter = end & 0xFFF
+
+        return millis, counter
+
+    def create(self, values: Optional[Mapping[str, Any]] = None) -> str:
+        return self.create_many(1)[0]
+
+    def create_many(self, size: int,
+                    columns: Optional[Mapping[str, Sequence]] = None) -> List[str]:
+        millis, counter = self._reserve(size)
+
+        sequence = counter + np.arange(size, dtype=np.uint64)
+        millis = np.uint64(millis) + (sequence >> np.uint64(12))
+        sequence &= np.uint64(0xFFF)
+
+        raw = np.empty((size, 16), dtype=np.uint8)
+        for byte in range(6):
+            raw[:, byte] = (millis >> np.uint64(40 - 8 * byte)) & np.uint64(0xFF)
+        raw[:, 6] = 0x70 | (sequence >> np.uint64(8)).astype(np.uint8)
+        raw[:, 7] = (sequence & np.uint64(0xFF)).astype(np.uint8)
+        raw[:, 8:] = np.frombuffer(os.urandom(8 * size), dtype=np.uint8).reshape(size, 8)
+        raw[:, 8] = (raw[:, 8] & 0x3F) | 0x80
+
+        return format_uuids(raw)
+
+
+class ContentHashStrategy(IDStrategy):
+    """Deterministic ids from the content, e.g. verbatimSource and
+    verbatimID. The same record gets the same id in every run and in every
+    process. The id is the uuid5 of the joined fields.
+
+    Records without all the fields get an id of the fallback strategy.
+
+    Parameters
+    ----------
+    fields : Sequence[str], optional
+        Fields hashed, by default ('verbatimSource', 'verbatimID')
+    namespace : uuid.UUID, optional
+        Namespace of the ids, by default CONTENT_NAMESPACE
+    fallback : IDStrategy, optional
+        Strategy of the records without the fields, by default UUID7Strategy
+    """
+
+    def __init__(self, fields: Sequence[str] = ('verbatimSource', 'verbatimID'),
+                 namespace: uuid.UUID = CONTENT_NAMESPACE,
+                 fallback: IDStrategy = None) -> None:
+        self.fields = tuple(fields)
+        self.namespace = namespace
+        self.fallback = UUID7Strategy() if fallback is None else fallback
+
+    @staticmethod
+    def _missing(value) -> bool:
+        # None, NaN, pd.NA and NaT, the containers are values
+        return pd.api.types.is_scalar(value) and pd.isna(value)
+
+    @staticmethod
+    def _join(parts) -> str:
+        # Integers read as floats by pandas, e.g. with missing values, hash as integers.
+        # The unit separator cannot be confused with the content
+        return '\x1f'.join(str(int(part)) if isinstance(part, float) and part.is_integer()
+                            else str(part) for part in parts)
+
+    def _key(self, values: Mapping[str, Any]) -> Optional[str]:
+        parts = [values.get(field) for field in self.fields]
+        if any(self._missing(part) for part in parts):
+            return None
+
+        return self._join(parts)
+
+    def _hash(self, key: str) -> str:
+        return str(uuid.uuid5(self.namespace, key))
+
+    def create(self, values: Optional[Mapping[str, Any]] = None) -> str:
+        key = None if values is None else self._key(values)
+        if key is None:
+            return self.fallback.create(values)
+
+        return self._hash(key)
+
+    def create_many(self, size: int,
+                    columns: Optional[Mapping[str, Sequence]] = None) -> List[str]:
+        if columns is None or any(field not in columns for field in self.fields):
+            return self.fallback.create_many(size, columns)
+
+        fields = [columns[field] for field in self.fields]
+        ids, missing = [], []
+        for pos, parts in enumerate(zip(*fields)):
+            if any(self._missing(part) for part in parts):
+                ids.append(None)
+                missing.append(pos)
+            else:
+                ids.append(self._hash(self._join(parts)))
+
+        if missing:
+            for pos, new_id in zip(missing, self.fallback.create_many(len(missing))):
+                ids[pos] = new_id
+
+        return ids
+
+
+STRATEGIES: Dict[str, type] = {
+    'uuid4': UUID4Strategy,
+    'uuid7': UUID7Strategy,
+    'content': ContentHashStrategy
+}
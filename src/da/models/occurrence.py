@@ -2,23 +2,88 @@
 # -*- coding: utf-8 -*-
 # Remember to update the PYTHON_PATH to
 # export PYTHONPATH=`pwd`:`pwd`
-from copy import deepcopy
-import traceback
-import pendulum
+import uuid
 
-from datetime import datetime
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
 
-from typing import Optional, Union
+import numpy as np
+import pandas as pd
 
-from shapely.geometry import Point, mapping
+from shapely.geometry import Point
 
 from pydantic import root_validator, validator
 
 from da.models.basic import BaseBuilder as BB, IDiedModel
+from da.models.ids import CONTENT_NAMESPACE
+from da.models.batch import (ColumnarBatch, RecordView, as_frame, as_python,
+                             coerce_float, coerce_str, reject)
 
-from da.utils.log import get_logger
+from da.utils import geo
+from da.utils.dates import DATE_PARSER
+from da.utils.log import get_logger, log_exception
 log = get_logger(__name__)
 
+DEFAULT_EVENT_TYPE = "Catalog"
+
+# Namespace of the ids of the interned Events, see EventRegistry
+EVENT_NAMESPACE = uuid.uuid5(CONTENT_NAMESPACE, 'event')
+
+
+def parse_event_date(value):
+    """Parses the eventDate of an Event. Strings are parsed with the DATE_PARSER,
+    empty strings and None are missing dates. Other values are returned as is.
+
+    Parameters
+    ----------
+    value : str | datetime
+        Value to parse
+
+    Returns
+    -------
+    datetime
+        Parsed date or None
+    """
+    if value is None:
+        return
+
+    if isinstance(value, str):
+        value = value.strip()
+
+        if len(value) == 0:
+            value = None
+        else:
+            value = DATE_PARSER.parse(value)
+
+    return value
+
+
+def parse_event_dates(values: pd.Series, rejected: Dict[Any, str]) -> np.ndarray:
+    """Vectorized parse_event_date. Every distinct value is parsed once,
+    with the dominant format of the column first, see DateParser
+
+    Parameters
+    ----------
+    values : pd.Series
+        eventDate column
+    rejected : Dict[Any, str]
+        Rejected rows by label
+
+    Returns
+    -------
+    np.ndarray
+        Naive UTC datetime64 array, NaT for the missing dates
+    """
+    dates, failed = DATE_PARSER.parse_column(values)
+
+    for pos, reason in failed.items():
+        reject(rejected, values.index[pos], f"eventDate: {reason}")
+
+    return dates
+
+
 class EventBuilder(BB):
     """Defines the interface to create the Event Model
     """
@@ -63,9 +128,15 @@ class EventBuilder(BB):
 
                 return values
             except Exception:
-                log.exception(traceback.print_exc())
+                log_exception(log, "Invalid coordinates")
                 raise
 
+        @validator('eventType', pre=True, always=True)
+        def default_event_type(cls, value) -> str:
+            """Missing eventTypes are the default one, as in transform_batch
+            """
+            return DEFAULT_EVENT_TYPE if value is None else value
+
         @validator('eventDate', pre=True, always=True)
         def create_event_date(cls, value) -> datetime:
             """Verifies the eventDate. If it cames from string parses only to date
@@ -81,20 +152,9 @@ class EventBuilder(BB):
                 Date formatted
             """
             try:
-                if value is None:
-                    return
-                
-                if isinstance(value, str):
-                    value = value.strip()
-
-                    if len(value) == 0:
-                        value = None
-                    else:
-                        value = pendulum.parse(value)
-
-                return value
+                return parse_event_date(value)
             except Exception:
-                log.exception(traceback.print_exc())
+                log_exception(log, "Invalid eventDate")
                 raise
 
         def dict(self) -> dict:
@@ -106,20 +166,89 @@ class EventBuilder(BB):
                 Serializable version
             """
             try:
-                tmp = deepcopy(self.__dict__)
-                coords = mapping(tmp['coordinates'])['coordinates']
+                # Every value is immutable, so a shallow copy is enough
+                tmp = dict(self.__dict__)
+                coords = tmp['coordinates']
 
                 tmp['coordinates'] = {
-                    'latitude': coords[1],
-                    'longitude': coords[0]
+                    'latitude': coords.y,
+                    'longitude': coords.x
                 }
-                tmp['eventID'] = tmp['id']
-                del tmp['id']
+                tmp['eventID'] = tmp.pop('id')
                 return tmp
             except Exception:
-                log.exception(traceback.print_exc())
+                log_exception(log, "Cannot serialize the Event")
                 raise
 
+    class View(RecordView):
+        """View of an Event stored in a ColumnarBatch. It has the fields
+        of the Model, the coordinates Point is only built when accessed
+
+        Parameters
+        ----------
+        batch : ColumnarBatch
+            Batch that owns the columns
+        pos : int
+            Position of the row in the batch
+        id_column : str, optional
+            Column with the ID of the Event, by default id
+        """
+        __slots__ = ('_id_column',)
+
+        FIELDS = ('latitude', 'longitude', 'eventType', 'eventDate')
+
+        def __init__(self, batch: ColumnarBatch, pos: int, id_column: str = 'id') -> None:
+            super().__init__(batch, pos)
+            self._id_column = id_column
+
+        @property
+        def id(self) -> str:
+            return self._batch.columns[self._id_column][self._pos]
+
+        @property
+        def coordinates(self) -> Point:
+            columns = self._batch.columns
+            if 'coordinates' in columns:
+                return columns['coordinates'][self._pos]
+
+            return Point(self.longitude, self.latitude)
+
+        def fields(self) -> dict:
+            """Fields of the Model, keyed as the Model
+            """
+            columns, pos = self._batch.columns, self._pos
+            tmp = {'id': self.id}
+            tmp.update((k, as_python(columns[k][pos])) for k in self.FIELDS)
+
+            return tmp
+
+        def dict(self) -> dict:
+            """Same as EventBuilder.Model.dict() without building the Model
+
+            Returns
+            -------
+            dict
+                Serializable version
+            """
+            columns, pos = self._batch.columns, self._pos
+            latitude = as_python(columns['latitude'][pos])
+            longitude = as_python(columns['longitude'][pos])
+
+            return {
+                'latitude': latitude,
+                'longitude': longitude,
+                'eventType': columns['eventType'][pos],
+                'coordinates': {
+                    'latitude': latitude,
+                    'longitude': longitude
+                },
+                'eventDate': as_python(columns['eventDate'][pos]),
+                'eventID': self.id
+            }
+
+        def to_model(self):
+            return EventBuilder.Model(**self.fields())
+
     @classmethod
     def transform(cls, data: dict) -> Model:
         """Creates the Model
@@ -141,6 +270,377 @@ class EventBuilder(BB):
         except Exception:
             raise
 
+    @classmethod
+    def transform_batch(cls, data,
+                        validate_coordinates: bool = False,
+                        fix_swapped: bool = False,
+                        geometry: bool = False,
+                        utm: bool = False,
+                        create_ids: bool = True) -> ColumnarBatch:
+        """Creates the Events of a whole batch with column operations.
+        The rules are the same as the Model: latitude and longitude are
+        coerced to float, eventDate is parsed and missing ids are created.
+
+        Parameters
+        ----------
+        data : pd.DataFrame | pa.Table
+            Data with the latitude, longitude and optionally
+            eventDate, eventType and id columns
+        validate_coordinates : bool, optional
+            Also rejects NaN, out of range and swapped coordinates, by default False
+        fix_swapped : bool, optional
+            Swaps back the swapped coordinates instead of rejecting them, by default False
+        geometry : bool, optional
+            Adds the coordinates column with the Points, by default False.
+            Without it the Points are only built when a View is asked for them
+        utm : bool, optional
+            Adds the utmEasting, utmNorthing, utmZoneNumber and utmZoneLetter
+            columns, by default False
+        create_ids : bool, optional
+            Creates the missing ids, by default True. Without it the id
+            column is left empty for the caller, e.g. the EventRegistry
+
+        Returns
+        -------
+        ColumnarBatch
+            Batch with the id, latitude, longitude, eventType and eventDate
+            columns of the accepted rows, and the rejected ones
+        """
+        try:
+            frame = as_frame(data)
+            rejected = {}
+
+            for name in ('latitude', 'longitude'):
+                if name not in frame:
+                    raise KeyError(f"Missing required column {name}")
+
+            if create_ids:
+                ids = cls.Model.fill_ids(frame.get('id'), frame)
+            else:
+                ids = np.full(len(frame), None, dtype=object)
+
+            columns = {
+                'id': ids,
+                'latitude': coerce_float(frame['latitude'], 'latitude', rejected),
+                'longitude': coerce_float(frame['longitude'], 'longitude', rejected),
+            }
+
+            if 'eventType' in frame:
+                event_type = frame['eventType'].fillna(DEFAULT_EVENT_TYPE)
+                columns['eventType'] = coerce_str(event_type, 'eventType', rejected)
+            else:
+                columns['eventType'] = np.full(len(frame), DEFAULT_EVENT_TYPE, dtype=object)
+
+            if 'eventDate' in frame:
+                columns['eventDate'] = parse_event_dates(frame['eventDate'], rejected)
+            else:
+                columns['eventDate'] = np.full(len(frame), np.datetime64('NaT', 'us'))
+
+            if validate_coordinates or fix_swapped:
+                columns['latitude'], columns['longitude'] = geo.validate_coordinates(
+                    columns['latitude'], columns['longitude'], frame.index.to_numpy(),
+                    rejected, fix_swapped=fix_swapped)
+
+            batch = ColumnarBatch.from_validated(columns, frame.index, rejected, cls)
+
+            # Only for the accepted rows
+            if geometry:
+                batch.columns['coordinates'] = geo.points(batch['latitude'], batch['longitude'])
+            if utm:
+                batch.columns.update(geo.to_utm(batch['latitude'], batch['longitude']))
+
+            return batch
+        except Exception:
+            log_exception(log, "EventBuilder.transform_batch failed")
+            raise
+
+class EventRegistry:
+    """Interns the Events, so the occurrences recorded at the same place and
+    time share one Event Model and ID, and every sampling event is
+    validated and stored once.
+
+    The key is (longitude, latitude, eventDate, eventType) with the
+    coordinates rounded to precision decimals. The id of an Event is the
+    uuid5 of its key, so it does not depend on the run, the process or the
+    order of the rows. The given ids of the rows are ignored.
+
+    With max_size the least recently used Events are evicted and passed to
+    on_evict, e.g. to write them, so the memory is bounded. An evicted
+    Event seen again is created again with the same id, so the writers may
+    receive it twice. The registry is thread safe.
+
+    Parameters
+    ----------
+    precision : int, optional
+        Decimals of the coordinates in the key, by default 5 (about 1 m).
+        None compares the exact coordinates
+    max_size : int, optional
+        Max Events kept, by default unbounded
+    on_evict : Callable[[List[Model]], None], optional
+        Receives the evicted Events
+    """
+
+    def __init__(self, precision: Optional[int] = 5, max_size: Optional[int] = None,
+                 on_evict: Callable[[List[IDiedModel]], None] = None) -> None:
+        self.precision = precision
+        self.max_size = max_size
+        self.on_evict = on_evict
+
+        self._events: OrderedDict = OrderedDict()
+        self._lock = Lock()
+        self._stats = Counter()
+
+    def __len__(self) -> int:
+        return len(self._events)
+
+    def _coordinate(self, value: float) -> str:
+        if self.precision is None:
+            return repr(float(value) + 0.0)
+
+        # + 0.0 turns -0.0 into 0.0
+        return f"{np.round(value, self.precision) + 0.0:.{self.precision}f}"
+
+    def _key(self, longitude: float, latitude: float, date: Optional[int], event_type: str) -> str:
+        # The unit separator cannot be confused with the content
+        return '\x1f'.join((self._coordinate(longitude), self._coordinate(latitude),
+                             '' if date is None else str(date), str(event_type)))
+
+    @staticmethod
+    def _date(value) -> Optional[int]:
+        """Microseconds since the epoch of a date, naive dates are UTC"""
+        if value is None:
+            return None
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+
+        return int(np.datetime64(value, 'us').astype(np.int64))
+
+    def key_of(self, data: dict) -> str:
+        """Key of the raw Event
+
+        Parameters
+        ----------
+        data : dict
+            Raw Event
+
+        Returns
+        -------
+        str
+            Key in the registry
+
+        Raises
+        ------
+        ValueError
+            If the coordinates or the eventDate are invalid
+        """
+        event_type = data.get('eventType')
+
+        return self._key(float(data['longitude']), float(data['latitude']),
+                         self._date(parse_event_date(data.get('eventDate'))),
+                         DEFAULT_EVENT_TYPE if event_type is None else event_type)
+
+    @staticmethod
+    def id_of_key(key: str) -> str:
+        return str(uuid.uuid5(EVENT_NAMESPACE, key))
+
+    def _intern(self, key: str, create: Callable[[str], IDiedModel], rows: int = 1) -> IDiedModel:
+        with self._lock:
+            event = self._events.get(key)
+            if event is not None:
+                self._events.move_to_end(key)
+                self._stats['hits'] += rows
+                return event
+
+        # Validated without the lock, so the threads validate in parallel
+        try:
+            event = create(self.id_of_key(key))
+        except Exception:
+            with self._lock:
+                self._stats['rejected'] += rows
+            raise
+
+        evicted = []
+        with self._lock:
+            # Another thread may have interned it meanwhile
+            interned = self._events.setdefault(key, event)
+            if interned is not event:
+                self._events.move_to_end(key)
+                self._stats['hits'] += rows
+                return interned
+
+            self._stats['misses'] += 1
+            self._stats['hits'] += rows - 1
+
+            while self.max_size is not None and len(self._events) > self.max_size:
+                evicted.append(self._events.popitem(last=False)[1])
+            self._stats['evicted'] += len(evicted)
+
+        if evicted and self.on_evict is not None:
+            self.on_evict(evicted)
+
+        return event
+
+    def intern(self, data: dict) -> IDiedModel:
+        """Returns the shared Model of the Event, it is created the first
+        time the Event is seen
+
+        Parameters
+        ----------
+        data : dict
+            Raw Event
+
+        Returns
+        -------
+        Model
+            Interned Event
+        """
+        try:
+            key = self.key_of(data)
+        except Exception:
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise
+
+        return self._intern(key, lambda event_id: EventBuilder.transform({**data, 'id': event_id}))
+
+    def id_of(self, data: dict) -> str:
+        """ID of the interned Event, see intern
+        """
+        return self.intern(data).id
+
+    def transform_batch(self, data, **event_options) -> ColumnarBatch:
+        """EventBuilder.transform_batch with the ids of the interned Events.
+        Only the first row of every distinct key creates a Model
+
+        Parameters
+        ----------
+        data : pd.DataFrame | pa.Table
+            Raw Events, as in EventBuilder.transform_batch
+        event_options : dict
+            Options of EventBuilder.transform_batch, e.g. validate_coordinates
+
+        Returns
+        -------
+        ColumnarBatch
+            Events of the accepted rows, the id column is the one of the
+            interned Event of every row
+        """
+        try:
+            frame = as_frame(data).drop(columns=['id'], errors='ignore')
+            # The ids are the ones of the keys, the strategy of the Model is not used
+            events = EventBuilder.transform_batch(frame, **{**event_options, 'create_ids': False})
+            with self._lock:
+                self._stats['rejected'] += len(events.rejected)
+            if len(events) == 0:
+                return events
+
+            longitude, latitude = events['longitude'], events['latitude']
+            if self.precision is not None:
+                longitude = np.round(longitude, self.precision) + 0.0
+                latitude = np.round(latitude, self.precision) + 0.0
+
+            dates = events['eventDate'].astype('datetime64[us]')
+            keys = pd.DataFrame({
+                'longitude': longitude,
+                'latitude': latitude,
+                'eventDate': np.where(np.isnat(dates), np.iinfo(np.int64).min,
+                                      dates.astype(np.int64)),
+                'eventType': events['eventType']
+            })
+            groups = keys.groupby([*keys.columns], sort=False, dropna=False).ngroup().to_numpy()
+            distinct, first, counts = np.unique(groups, return_index=True, return_counts=True)
+
+            ids = np.empty(len(distinct), dtype=object)
+            for group, pos, rows in zip(distinct, first, counts):
+                date = None if np.isnat(dates[pos]) else int(dates[pos].astype(np.int64))
+                key = self._key(events['longitude'][pos], events['latitude'][pos], date,
+                                events['eventType'][pos])
+                ids[group] = self._intern(key, lambda event_id: self._construct(event_id, events, pos),
+                                          int(rows)).id
+
+            events.columns['id'] = ids[groups]
+
+            return events
+        except Exception:
+            log_exception(log, "EventRegistry.transform_batch failed")
+            raise
+
+    @staticmethod
+    def _construct(event_id: str, events: ColumnarBatch, pos: int) -> IDiedModel:
+        # The row was already validated by transform_batch
+        latitude, longitude = float(events['latitude'][pos]), float(events['longitude'][pos])
+        date = events['eventDate'][pos]
+
+        return EventBuilder.Model.construct(
+            id=event_id,
+            latitude=latitude,
+            longitude=longitude,
+            eventType=events['eventType'][pos],
+            coordinates=Point(longitude, latitude),
+            eventDate=None if np.isnat(date) else
+            pd.Timestamp(date).tz_localize('UTC').to_pydatetime())
+
+    def events(self) -> List[IDiedModel]:
+        """Interned Events not evicted, from the least recently used
+        """
+        with self._lock:
+            return [*self._events.values()]
+
+    @staticmethod
+    def to_columns(events: List[IDiedModel]) -> ColumnarBatch:
+        """Batch of Events with the columns of EventBuilder.transform_batch
+        """
+        # The min int64 is NaT
+        nat = np.iinfo(np.int64).min
+        dates = np.array([nat if e.eventDate is None else EventRegistry._date(e.eventDate)
+                          for e in events], dtype=np.int64)
+
+        return ColumnarBatch({
+            'id': np.array([e.id for e in events], dtype=object),
+            'latitude': np.array([e.latitude for e in events], dtype=float),
+            'longitude': np.array([e.longitude for e in events], dtype=float),
+            'eventType': np.array([e.eventType for e in events], dtype=object),
+            'eventDate': dates.view('datetime64[us]'),
+        }, builder=EventBuilder)
+
+    def to_batch(self) -> ColumnarBatch:
+        """Deduplicated Events table of the Events kept
+
+        Returns
+        -------
+        ColumnarBatch
+            One row per interned Event
+        """
+        return self.to_columns(self.events())
+
+    def stats(self) -> dict:
+        """Hit statistics
+
+        Returns
+        -------
+        dict
+            Rows found in the registry (hits), distinct Events created
+            (misses), rows rejected, Events evicted, number of Events and hit rate
+        """
+        with self._lock:
+            hits, misses = self._stats['hits'], self._stats['misses']
+            total = hits + misses
+
+            return {
+                'hits': hits,
+                'misses': misses,
+                'rejected': self._stats['rejected'],
+                'evicted': self._stats['evicted'],
+                'size': len(self._events),
+                'hit_rate': hits / total if total else 0.0
+            }
+
+    def clear(self):
+        with self._lock:
+            self._events.clear()
+            self._stats.clear()
+
+
 class OccurrenceBuilder(BB):
     """Defines the interface to create the Occurrence Model
     """
@@ -170,7 +670,7 @@ class OccurrenceBuilder(BB):
                 Serializable version
             """
             try:
-                tmp = deepcopy(self.__dict__)
+                tmp = dict(self.__dict__)
                 event_dict = self.event.dict()
 
                 del tmp['event']
@@ -178,9 +678,42 @@ class OccurrenceBuilder(BB):
 
                 return tmp
             except Exception:
-                log.exception(traceback.print_exc())
+                log_exception(log, "Cannot serialize the Occurrence")
                 raise
 
+    class View(RecordView):
+        """View of an Occurrence stored in a ColumnarBatch. The Event is
+        another view over the same row
+        """
+        __slots__ = ()
+
+        FIELDS = ('id', 'occurrenceID', 'verbatimID', 'verbatimSource')
+
+        @property
+        def event(self) -> EventBuilder.View:
+            return EventBuilder.View(self._batch, self._pos, 'eventID')
+
+        def dict(self) -> dict:
+            """Same as OccurrenceBuilder.Model.dict() without building the Model
+
+            Returns
+            -------
+            dict
+                Serializable version
+            """
+            columns, pos = self._batch.columns, self._pos
+            tmp = {k: columns[k][pos] for k in self.FIELDS}
+            tmp.update(self.event.dict())
+
+            return tmp
+
+        def to_model(self):
+            columns, pos = self._batch.columns, self._pos
+            tmp = {k: columns[k][pos] for k in self.FIELDS}
+            tmp['event'] = self.event.to_model()
+
+            return OccurrenceBuilder.Model(**tmp)
+
     @classmethod
     def transform(cls, data: dict) -> Model:
         """Creates the Model
@@ -201,3 +734,89 @@ class OccurrenceBuilder(BB):
             return data_typed
         except Exception:
             raise
+
+    @classmethod
+    def validate_batch(cls, frame: pd.DataFrame) -> Tuple[Dict[str, np.ndarray], Dict[Any, str]]:
+        """Coerces the Occurrence columns of a batch, without its Event
+
+        Parameters
+        ----------
+        frame : pd.DataFrame
+            Data with the occurrenceID, verbatimID and verbatimSource columns
+
+        Returns
+        -------
+        Tuple[Dict[str, np.ndarray], Dict[Any, str]]
+            occurrenceID, verbatimID and verbatimSource columns of every row,
+            and the rejected rows with the reason
+        """
+        rejected = {}
+
+        for name in ('occurrenceID', 'verbatimSource'):
+            if name not in frame:
+                raise KeyError(f"Missing required column {name}")
+
+        verbatim_id = frame.get('verbatimID', pd.Series(None, index=frame.index, dtype=object))
+        columns = {
+            'occurrenceID': coerce_str(frame['occurrenceID'], 'occurrenceID', rejected),
+            'verbatimID': coerce_str(verbatim_id, 'verbatimID', rejected, required=False),
+            'verbatimSource': coerce_str(frame['verbatimSource'], 'verbatimSource', rejected),
+        }
+
+        return columns, rejected
+
+    @classmethod
+    def transform_batch(cls, data, event_registry: EventRegistry = None,
+                        **event_options) -> ColumnarBatch:
+        """Creates the Occurrences of a whole batch with column operations.
+        The Event of every row is created with EventBuilder.transform_batch,
+        only for the rows whose Occurrence columns are valid.
+
+        Parameters
+        ----------
+        data : pd.DataFrame | pa.Table
+            Data with the occurrenceID, verbatimID, verbatimSource and the
+            Event columns. The ids of the Events are read from eventID
+        event_registry : EventRegistry, optional
+            Interns the Events, so the rows at the same place and time
+            share the eventID. The given eventIDs are ignored, and the
+            rejected Occurrences do not reach the registry
+        event_options : dict
+            Options of EventBuilder.transform_batch, e.g. validate_coordinates
+
+        Returns
+        -------
+        ColumnarBatch
+            Batch with the Occurrence columns, the eventID and the other
+            columns of its Event
+        """
+        try:
+            frame = as_frame(data)
+            columns, rejected = cls.validate_batch(frame)
+            columns = {'id': cls.Model.fill_ids(frame.get('id'), frame), **columns}
+
+            # Only the Events of the valid Occurrences
+            event_frame = frame.drop(columns=['id'], errors='ignore')
+            if rejected:
+                event_frame = event_frame[~frame.index.isin([*rejected])]
+            event_frame = event_frame.rename(columns={'eventID': 'id'})
+            if event_registry is not None:
+                events = event_registry.transform_batch(event_frame, **event_options)
+            else:
+                events = EventBuilder.transform_batch(event_frame, **event_options)
+
+            # Events are the accepted rows, so the Occurrence columns are aligned to them
+            for label, reason in events.rejected.items():
+                reject(rejected, label, reason)
+
+            keep = ~frame.index.isin([*rejected])
+            columns = {k: v[keep] for k, v in columns.items()}
+            columns['eventID'] = events['id']
+            for name in events.column_names:
+                if name != 'id':
+                    columns[name] = events[name]
+
+            return ColumnarBatch.from_validated(columns, frame.index[keep], rejected, cls)
+        except Exception:
+            log_exception(log, "OccurrenceBuilder.transform_batch failed")
+            raise
@@ -3,11 +3,18 @@
 # -*- coding: utf-8 -*-
 # Remember to update the PYTHON_PATH to
 # export PYTHONPATH=`pwd`:`pwd`
-from typing import Optional, Union
+
+from collections import Counter
+from threading import Lock
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import pandas as pd
 
 from da.models.basic import BaseBuilder as BB, IDiedModel
+from da.models.batch import ColumnarBatch, as_frame, reject
 
-from da.utils.log import get_logger
+from da.utils.log import get_logger, log_exception
 log = get_logger(__name__)
 
 
@@ -69,3 +76,270 @@ class TaxonBuilder(BB):
             return data_typed
         except Exception:
             raise
+
+
+def normalize_key_value(value, casefold: bool = False) -> str:
+    """Normalizes one value of a registry key. Missing values are empty
+    strings and integers read as floats, e.g. 10.0, are integers again
+
+    Parameters
+    ----------
+    value : Any
+        Value to normalize
+    casefold : bool, optional
+        Also ignores the case, by default False
+
+    Returns
+    -------
+    str
+        Normalized value
+    """
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+
+    value = str(value).strip()
+
+    return value.casefold() if casefold else value
+
+
+class TaxonRegistry:
+    """Interns the Taxa, so every distinct taxon is validated once and all
+    its rows share the same Model and ID.
+
+    The key is (verbatimSource, verbatimID) or the classification, with the
+    names stripped and case insensitive. The taxa whose key fields are all
+    empty are rejected, as they cannot be told apart. The registry is
+    thread safe.
+
+    Parameters
+    ----------
+    key : str, optional
+        verbatim or classification, by default verbatim
+    builder : BaseBuilder, optional
+        Builder of the Models, by default TaxonBuilder
+    """
+    KEYS = {
+        'verbatim': ('verbatimSource', 'verbatimID'),
+        'classification': ('kingdom', 'phylum', 'class_taxon', 'order', 'family',
+                           'subfamily', 'genus', 'subgenus', 'species',
+                           'scientificName', 'canonicalName')
+    }
+
+    def __init__(self, key: str = 'verbatim', builder=None) -> None:
+        if key not in self.KEYS:
+            raise ValueError(f"Unknown key {key}, use one of {[*self.KEYS]}")
+
+        self.key = key
+        self.fields = self.KEYS[key]
+        self.builder = TaxonBuilder if builder is None else builder
+
+        self._taxa: Dict[str, IDiedModel] = {}
+        self._lock = Lock()
+        self._stats = Counter()
+
+    def __len__(self) -> int:
+        return len(self._taxa)
+
+    def __contains__(self, data: dict) -> bool:
+        return self.key_of(data) in self._taxa
+
+    def key_of(self, data: dict) -> str:
+        """Normalized key of the raw taxon
+
+        Parameters
+        ----------
+        data : dict
+            Raw taxon
+
+        Returns
+        -------
+        str
+            Key in the registry
+
+        Raises
+        ------
+        ValueError
+            If every field of the key is empty
+        """
+        casefold = self.key == 'classification'
+
+        return self._join([normalize_key_value(data.get(field), casefold)
+                           for field in self.fields])
+
+    def _join(self, values: List[str]) -> str:
+        if not any(values):
+            raise ValueError(f"Taxon without {', '.join(self.fields)}")
+
+        # The unit separator cannot be confused with the content
+        return '\x1f'.join(values)
+
+    def _intern(self, key: str, data: dict, rows: int = 1) -> IDiedModel:
+        with self._lock:
+            taxon = self._taxa.get(key)
+            if taxon is not None:
+                self._stats['hits'] += rows
+                return taxon
+
+        # Validated without the lock, so the threads validate in parallel
+        try:
+            taxon = self.builder.transform(data)
+        except Exception:
+            with self._lock:
+                self._stats['rejected'] += rows
+            raise
+
+        with self._lock:
+            # Another thread may have interned it meanwhile
+            interned = self._taxa.setdefault(key, taxon)
+            if interned is taxon:
+                self._stats['misses'] += 1
+                self._stats['hits'] += rows - 1
+            else:
+                self._stats['hits'] += rows
+
+        return interned
+
+    def intern(self, data: dict) -> IDiedModel:
+        """Returns the shared Model of the taxon, it is created the first
+        time the taxon is seen
+
+        Parameters
+        ----------
+        data : dict
+            Raw taxon
+
+        Returns
+        -------
+        Model
+            Interned taxon
+
+        Raises
+        ------
+        ValueError
+            If every field of the key is empty
+        """
+        try:
+            key = self.key_of(data)
+        except ValueError:
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise
+
+        return self._intern(key, data)
+
+    def id_of(self, data: dict) -> str:
+        """ID of the interned taxon, see intern
+        """
+        return self.intern(data).id
+
+    def intern_batch(self, data) -> Tuple[np.ndarray, Dict[Any, str]]:
+        """Interns the taxa of a whole batch. Only the first row of every
+        distinct key is transformed
+
+        Parameters
+        ----------
+        data : pd.DataFrame | pa.Table
+            Raw taxa, one column per field of the Model
+
+        Returns
+        -------
+        Tuple[np.ndarray, Dict[Any, str]]
+            ID of the taxon of every row, None if it was rejected, and the
+            rejected rows with the reason
+        """
+        try:
+            frame = as_frame(data)
+            casefold = self.key == 'classification'
+
+            # Every column is normalized once per distinct value
+            normalized = {}
+            for field in self.fields:
+                if field in frame:
+                    codes, uniques = pd.factorize(frame[field])
+                    values = np.array([normalize_key_value(v, casefold) for v in uniques] + [''],
+                                      dtype=object)
+                    normalized[field] = values[codes]
+                else:
+                    normalized[field] = np.full(len(frame), '', dtype=object)
+
+            groups = pd.DataFrame(normalized).groupby([*self.fields], sort=False).ngroup()
+            groups = groups.to_numpy()
+            distinct, first, counts = np.unique(groups, return_index=True, return_counts=True)
+
+            records = frame.iloc[first].astype(object)
+            records = records.where(records.notna(), None).to_dict('records')
+
+            ids = np.empty(len(distinct), dtype=object)
+            errors = {}
+            for group, pos, rows, record in zip(distinct, first, counts, records):
+                try:
+                    key = self._join([normalized[field][pos] for field in self.fields])
+                except ValueError as e:
+                    with self._lock:
+                        self._stats['rejected'] += int(rows)
+                    errors[group] = str(e)
+                    continue
+
+                try:
+                    ids[group] = self._intern(key, record, int(rows)).id
+                except Exception as e:
+                    errors[group] = str(e)
+
+            # The rows of all the rejected taxa in one pass
+            rejected = {}
+            if errors:
+                positions = np.flatnonzero(np.isin(groups, [*errors]))
+                for label, group in zip(frame.index[positions], groups[positions]):
+                    reject(rejected, label, errors[group])
+
+            return ids[groups], rejected
+        except Exception:
+            log_exception(log, "TaxonRegistry.intern_batch failed")
+            raise
+
+    def taxa(self) -> List[IDiedModel]:
+        """Interned taxa, each one once, in the order they were seen
+        """
+        with self._lock:
+            return [*self._taxa.values()]
+
+    def to_batch(self) -> ColumnarBatch:
+        """Deduplicated taxa table
+
+        Returns
+        -------
+        ColumnarBatch
+            One row per interned taxon
+        """
+        taxa = self.taxa()
+
+        return ColumnarBatch.from_records([taxon.dict() for taxon in taxa],
+                                          range(len(taxa)), builder=self.builder)
+
+    def stats(self) -> dict:
+        """Hit statistics
+
+        Returns
+        -------
+        dict
+            Rows found in the registry (hits), distinct taxa created (misses),
+            rows rejected, number of taxa and hit rate
+        """
+        with self._lock:
+            hits, misses = self._stats['hits'], self._stats['misses']
+            total = hits + misses
+
+            return {
+                'hits': hits,
+                'misses': misses,
+                'rejected': self._stats['rejected'],
+                'size': len(self._taxa),
+                'hit_rate': hits / total if total else 0.0
+            }
+
+    def clear(self):
+        with self._lock:
+            self._taxa.clear()
+            self._stats.clear()
@@ -0,0 +1,362 @@
+
+import os
+import asyncio
+import inspect
+
+from datetime import datetime
+from typing import Dict, Iterable, Mapping, Optional, Tuple, Union
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+from dotenv import load_dotenv
+
+from da.utils.cachr import (BULK_SIZE, CACHR_DB, CLIENT_SETTINGS,
+                            CachrModelBuilder, DocumentCodec, FrontCache,
+                            chunked, decode, to_projection, to_update)
+from da.utils.log import get_logger, log_exception
+
+load_dotenv()
+
+log = get_logger(__name__)
+
+try:
+    # pymongo>=4.10 ships its own asyncio client
+    from pymongo import AsyncMongoClient
+except ImportError:
+    try:
+        from motor.motor_asyncio import AsyncIOMotorClient as AsyncMongoClient
+    except ImportError:
+        AsyncMongoClient = None
+
+# Max number of operations in flight per AsyncCachr
+MAX_CONCURRENCY = int(os.environ.get("CACHR_MAX_CONCURRENCY", 64))
+
+
+class AsyncCachr:
+    """asyncio version of the Cachr. The methods are the same but they are
+    awaited, and at most max_concurrency operations reach MongoDB at once.
+
+    It needs pymongo>=4.10 or motor.
+    """
+
+    def __init__(self, key_collection: str, front_cache: FrontCache = None,
+                 connection: str = None, max_concurrency: int = MAX_CONCURRENCY,
+                 client=None, codec: DocumentCodec = None, **settings) -> None:
+        """
+        Parameters
+        ----------
+        key_collection : str
+            Collection of the documents
+        front_cache : FrontCache, optional
+            In-memory cache checked before MongoDB, by default None
+        connection : str, optional
+            Connection string, by default CACHR_DB_CONNECTION
+        max_concurrency : int, optional
+            Max number of operations in flight, by default MAX_CONCURRENCY
+        client : AsyncMongoClient, optional
+            Client to share between AsyncCachrs, it is not closed by close()
+        codec : DocumentCodec, optional
+            Compresses the big documents, by default they are stored as is
+        settings : dict
+            Client options, see CLIENT_SETTINGS
+        """
+        if client is None:
+            if AsyncMongoClient is None:
+                raise ImportError("AsyncCachr needs pymongo>=4.10 or motor")
+
+            if connection is None:
+                connection = os.environ.get("CACHR_DB_CONNECTION")
+            client = AsyncMongoClient(connection, **{**CLIENT_SETTINGS, **settings})
+            self._owns_client = True
+        else:
+            self._owns_client = False
+
+        self.client = client
+        self.__collection_name = key_collection
+        self.cachr_collection = self.client[CACHR_DB][key_collection]
+        self.front_cache = front_cache
+        self.codec = codec
+        self.max_concurrency = max_concurrency
+
+        self.__semaphore = None
+        self.__loop = None
+        self._indexed = False
+
+    @property
+    def _semaphore(self) -> asyncio.Semaphore:
+        """Limit of the operations in flight. On python<3.10 a semaphore is
+        bound to the loop current at its creation, so it is created in the
+        running loop, e.g. for an AsyncCachr built before asyncio.run
+        """
+        loop = asyncio.get_running_loop()
+        if self.__loop is not loop:
+            self.__semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.__loop = loop
+
+        return self.__semaphore
+
+    async def __aenter__(self) -> 'AsyncCachr':
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        """Closes the client if it was created by this AsyncCachr
+        """
+        if self._owns_client:
+            self._owns_client = False
+            closed = self.client.close()
+            if inspect.isawaitable(closed):
+                await closed
+
+    def _front_key(self, ep: str) -> Tuple[str, str]:
+        return (self.__collection_name, ep)
+
+    async def _ensure_index(self):
+        """Creates the unique index of document_id the first time the
+        collection is used
+        """
+        if self._indexed:
+            return
+
+        try:
+            await self.cachr_collection.create_index("document_id", unique=True)
+        except OperationFailure:
+            # Old collections may already contain repeated endpoints
+            log.warning(f"Repeated document_id in {self.__collection_name}, "
+                        "creating a non unique index")
+            await self.cachr_collection.create_index("document_id")
+
+        self._indexed = True
+
+    async def cach(self, ep: str, data: dict):
+        """
+
+        Parameters
+        ----------
+        ep : str
+            Endpoint to cach
+        data : dict
+            Data to store if not found
+        """
+        try:
+            await self._ensure_index()
+            doc = CachrModelBuilder.transform({
+                "document_id": ep,
+                "updated_at": datetime.now(),
+                "document": data
+            })
+
+            async with self._semaphore:
+                await self.cachr_collection.update_one(
+                    {"document_id": doc.document_id},
+                    to_update(doc.__dict__, self.codec),
+                    upsert=True
+                )
+
+            if self.front_cache is not None:
+                self.front_cache.put(self._front_key(ep), dict(doc.__dict__))
+
+        except Exception:
+            log_exception(log, "AsyncCachr.cach failed")
+            raise
+
+    async def is_cachd(self, ep: str, projection=None) -> dict:
+        """Verified if the endpoint is already cachd
+
+        Parameters
+        ----------
+        ep : str
+            Endpoint to verify if exists
+        projection : Iterable[str] | Mapping[str, Any], optional
+            Fields to retrieve, e.g. ['updated_at'] for freshness checks.
+            By default the whole document
+
+        Returns
+        -------
+        dict
+            Document cached
+
+        Raises
+        ------
+        Exception
+            If multiple document wetre found with the same ID
+        """
+        try:
+            if self.front_cache is not None:
+                found, doc = self.front_cache.get(self._front_key(ep))
+                if found:
+                    return doc
+
+            await self._ensure_index()
+            async with self._semaphore:
+                cursor = self.cachr_collection.find({"document_id": ep},
+                                                    to_projection(projection)).limit(2)
+                docs = [doc async for doc in cursor]
+
+            if len(docs) > 1:
+                raise Exception(f"More than one document the endopint {ep}")
+
+            docs = [decode(doc) for doc in docs]
+
+            if self.front_cache is not None:
+                if not docs:
+                    self.front_cache.put_missing(self._front_key(ep))
+                elif projection is None:
+                    self.front_cache.put(self._front_key(ep), docs[0])
+
+            if len(docs) == 1:
+                return docs[0]
+
+        except Exception:
+            log_exception(log, "AsyncCachr.is_cachd failed")
+            raise
+
+    async def cach_many(self, items: Union[Mapping[str, dict], Iterable[Tuple[str, dict]]],
+                        bulk_size: int = None) -> int:
+        """Stores multiple endpoints with unordered bulk upserts. The
+        chunks are written concurrently
+
+        Parameters
+        ----------
+        items : Mapping[str, dict] | Iterable[Tuple[str, dict]]
+            Endpoints with the data to cach
+        bulk_size : int, optional
+            Number of documents per bulk_write, by default BULK_SIZE
+
+        Returns
+        -------
+        int
+            Number of documents inserted or updated
+        """
+        try:
+            await self._ensure_index()
+            bulk_size = bulk_size or BULK_SIZE
+
+            if isinstance(items, Mapping):
+                items = items.items()
+
+            now = datetime.now()
+            operations, docs = [], []
+            for ep, data in items:
+                doc = CachrModelBuilder.transform({
+                    "document_id": ep,
+                    "updated_at": now,
+                    "document": data
+                })
+                docs.append(doc)
+                operations.append(UpdateOne(
+                    {"document_id": doc.document_id},
+                    to_update(doc.__dict__, self.codec),
+                    upsert=True
+                ))
+
+            async def write(chunk):
+                async with self._semaphore:
+                    result = await self.cachr_collection.bulk_write(chunk, ordered=False)
+                return result.matched_count + result.upserted_count
+
+            written = await asyncio.gather(*[write(chunk)
+                                             for chunk in chunked(operations, bulk_size)])
+
+            if self.front_cache is not None:
+                for doc in docs:
+                    self.front_cache.put(self._front_key(doc.document_id),
+                                         dict(doc.__dict__))
+
+            return sum(written)
+        except Exception:
+            log_exception(log, "AsyncCachr.cach_many failed")
+            raise
+
+    async def get_many(self, eps: Iterable[str], bulk_size: int = None,
+                       projection=None) -> Dict[str, dict]:
+        """Retrieves the cachd endpoints with one $in query per bulk_size
+        endpoints. The queries run concurrently
+
+        Parameters
+        ----------
+        eps : Iterable[str]
+            Endpoints to retrieve
+        bulk_size : int, optional
+            Number of endpoints per query, by default BULK_SIZE
+        projection : Iterable[str] | Mapping[str, Any], optional
+            Fields to retrieve, by default the whole document
+
+        Returns
+        -------
+        Dict[str, dict]
+            Documents cachd keyed by document_id. Endpoints not found are omitted
+
+        Raises
+        ------
+        Exception
+            If multiple documents were found with the same ID
+        """
+        try:
+            await self._ensure_index()
+            bulk_size = bulk_size or BULK_SIZE
+            eps = [*dict.fromkeys(eps)]
+
+            cached = {}
+            if self.front_cache is not None:
+                pending = []
+                for ep in eps:
+                    found, doc = self.front_cache.get(self._front_key(ep))
+                    if not found:
+                        pending.append(ep)
+                    elif doc is not None:
+                        cached[ep] = doc
+                eps = pending
+
+            async def read(chunk):
+                async with self._semaphore:
+                    cursor = self.cachr_collection.find({
+                        "document_id": {"$in": chunk}
+                    }, to_projection(projection))
+                    return [doc async for doc in cursor]
+
+            results = await asyncio.gather(*[read(chunk)
+                                             for chunk in chunked(eps, bulk_size)])
+
+            docs = {}
+            for chunk_docs in results:
+                for doc in chunk_docs:
+                    ep = doc["document_id"]
+                    if ep in docs:
+                        raise Exception(f"More than one document the endopint {ep}")
+                    docs[ep] = decode(doc)
+
+            if self.front_cache is not None:
+                for ep in eps:
+                    if ep not in docs:
+                        self.front_cache.put_missing(self._front_key(ep))
+                    elif projection is None:
+                        self.front_cache.put(self._front_key(ep), docs[ep])
+                docs.update(cached)
+
+            return docs
+        except Exception:
+            log_exception(log, "AsyncCachr.get_many failed")
+            raise
+
+    async def is_cachd_many(self, eps: Iterable[str]) -> Dict[str, Optional[dict]]:
+        """Runs is_cachd for every endpoint concurrently, bounded by
+        max_concurrency. Prefer get_many for large lists
+
+        Parameters
+        ----------
+        eps : Iterable[str]
+            Endpoints to verify
+
+        Returns
+        -------
+        Dict[str, Optional[dict]]
+            Document of every endpoint, None if it is not cachd
+        """
+        eps = [*dict.fromkeys(eps)]
+        docs = await asyncio.gather(*[self.is_cachd(ep) for ep in eps])
+
+        return dict(zip(eps, docs))
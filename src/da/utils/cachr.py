@@ -1,19 +1,28 @@
 
 import os
-import traceback
+import zlib
 import multiprocessing
 
 import pymongo
 
+from collections import OrderedDict
 from threading import Lock
-from datetime import datetime
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple, Union
+
+import bson
+
+from pymongo import UpdateOne
+from pymongo.errors import ConnectionFailure, OperationFailure
 
 from pydantic import BaseModel
 from da.models.basic import BaseBuilder
 
 from dotenv import load_dotenv
 
-from da.utils.log import get_logger
+from da.utils.errors import Retry
+from da.utils.log import get_logger, log_exception
+from da.utils.metrics import METRICS
 
 load_dotenv()
 
@@ -22,6 +31,544 @@ log = get_logger(__name__)
 NUM_PROCESSES = multiprocessing.cpu_count() - 2
 LOCK = Lock()
 
+# Number of documents per bulk_write or $in query
+BULK_SIZE = int(os.environ.get("CACHR_BULK_SIZE", 1000))
+
+CACHR_DB = "bed_cachr"
+
+# Documents bigger than this number of bytes are compressed by the DocumentCodec
+COMPRESS_THRESHOLD = int(os.environ.get("CACHR_COMPRESS_THRESHOLD", 16 * 1024))
+
+# Attempts and seconds before the first retry of the MongoDB calls that
+# fail with transient errors. Every call of Cachr is idempotent
+CACHR_RETRIES = int(os.environ.get("CACHR_RETRIES", 3))
+CACHR_RETRY_BACKOFF = float(os.environ.get("CACHR_RETRY_BACKOFF", 0.5))
+
+# Lost connections, timeouts and primary changes
+TRANSIENT_ERRORS = (ConnectionFailure,)
+
+# Settings of the MongoClient shared by every Cachr of the same connection
+CLIENT_SETTINGS = {
+    "maxPoolSize": int(os.environ.get("CACHR_MAX_POOL_SIZE", 100)),
+    "serverSelectionTimeoutMS": int(os.environ.get("CACHR_TIMEOUT_MS", 30000)),
+    "connectTimeoutMS": int(os.environ.get("CACHR_CONNECT_TIMEOUT_MS", 20000)),
+}
+
+
+def chunked(items: List, size: int):
+    """Splits the items in lists of size elements
+
+    Parameters
+    ----------
+    items : List
+        Items to split
+    size : int
+        Max size of each chunk
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class FrontCache:
+    """Bounded in-memory LRU in front of the Cachr collections. Entries expire
+    ttl seconds after their updated_at, and missing endpoints are also
+    stored for negative_ttl seconds so they do not reach the database again.
+
+    The documents are kept BSON encoded, so every get returns a new copy
+    as MongoDB does, and changing it does not change the cached one.
+    It is thread safe, so the same instance can be used from barified.
+
+    Parameters
+    ----------
+    max_entries : int, optional
+        Max number of entries, by default 10000
+    max_bytes : int, optional
+        Max size in bytes of the BSON documents, by default 64MB
+    ttl : float, optional
+        Seconds a document is fresh after its updated_at, by default 1 hour
+    negative_ttl : float, optional
+        Seconds a missing endpoint is remembered, by default 1 minute.
+        0 disables the negative entries
+    """
+    _MISSING = object()
+
+    def __init__(self,
+                 max_entries: int = 10_000,
+                 max_bytes: int = 64 * 1024 * 1024,
+                 ttl: float = 3600,
+                 negative_ttl: float = 60) -> None:
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = timedelta(seconds=ttl)
+        self.negative_ttl = timedelta(seconds=negative_ttl)
+
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self._bytes = 0
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def size_bytes(self) -> int:
+        return self._bytes
+
+    def get(self, key: Any) -> Tuple[bool, Optional[dict]]:
+        """Looks for the key in the cache
+
+        Parameters
+        ----------
+        key : Any
+            Key of the entry
+
+        Returns
+        -------
+        Tuple[bool, Optional[dict]]
+            If the key was found and a copy of the document. The document
+            is None for the endpoints known to be missing
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+
+            doc, expires_at, _ = entry
+            if expires_at <= datetime.now():
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            if doc is self._MISSING:
+                self.negative_hits += 1
+                return True, None
+
+            self.hits += 1
+
+        # Decoded out of the lock, the entry is immutable
+        return True, bson.decode(doc)
+
+    def put(self, key: Any, doc: dict):
+        """Stores the document of the key. It expires ttl seconds after
+        its updated_at
+
+        Parameters
+        ----------
+        key : Any
+            Key of the entry
+        doc : dict
+            Document stored in the Cachr
+        """
+        expires_at = doc.get("updated_at", datetime.now()) + self.ttl
+        if expires_at <= datetime.now():
+            return
+
+        encoded = bson.encode(doc)
+        self._store(key, encoded, expires_at, len(encoded))
+
+    def put_missing(self, key: Any):
+        """Remembers that the key is not in the Cachr
+
+        Parameters
+        ----------
+        key : Any
+            Key of the entry
+        """
+        if not self.negative_ttl:
+            return
+
+        self._store(key, self._MISSING, datetime.now() + self.negative_ttl, 0)
+
+    def invalidate(self, key: Any):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        """Counters of the cache
+
+        Returns
+        -------
+        dict
+            hits, negative_hits, misses, evictions, expirations, entries and bytes
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "negative_hits": self.negative_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "bytes": self._bytes
+            }
+
+    def _store(self, key: Any, doc: Any, expires_at: datetime, size: int):
+        if size > self.max_bytes:
+            self.invalidate(key)
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+
+            self._entries[key] = (doc, expires_at, size)
+            self._bytes += size
+
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def _remove(self, key: Any):
+        _, _, size = self._entries.pop(key)
+        self._bytes -= size
+
+
+class DocumentCodec:
+    """Opt-in storage codec of the Cachr. The documents bigger than threshold
+    bytes are stored as compressed BSON, the Cachr decompresses them
+    transparently on read.
+
+    Parameters
+    ----------
+    algorithm : str, optional
+        zlib or zstd (needs zstandard), by default zlib
+    threshold : int, optional
+        Min size in bytes of the BSON document to compress, by default COMPRESS_THRESHOLD
+    level : int, optional
+        Compression level, by default the one of the algorithm
+    """
+    ALGORITHMS = ('zlib', 'zstd')
+
+    def __init__(self, algorithm: str = 'zlib',
+                 threshold: int = COMPRESS_THRESHOLD,
+                 level: int = None) -> None:
+        if algorithm not in self.ALGORITHMS:
+            raise ValueError(f"Unknown algorithm {algorithm}, use one of {self.ALGORITHMS}")
+        if algorithm == 'zstd':
+            import zstandard  # noqa: F401 fails early if it is not installed
+
+        self.algorithm = algorithm
+        self.threshold = threshold
+        self.level = level
+
+    def compress(self, raw: bytes) -> bytes:
+        if self.algorithm == 'zstd':
+            import zstandard
+            level = 3 if self.level is None else self.level
+            return zstandard.ZstdCompressor(level=level).compress(raw)
+
+        return zlib.compress(raw, -1 if self.level is None else self.level)
+
+    @staticmethod
+    def decompress(algorithm: str, data: bytes) -> bytes:
+        if algorithm == 'zstd':
+            import zstandard
+            return zstandard.ZstdDecompressor().decompress(data)
+        if algorithm == 'zlib':
+            return zlib.decompress(data)
+
+        raise ValueError(f"Unknown algorithm {algorithm}")
+
+    def encode(self, fields: dict) -> dict:
+        """Compresses the document of the fields if it is big enough
+
+        Parameters
+        ----------
+        fields : dict
+            Fields of the CachrModelBuilder.Model
+
+        Returns
+        -------
+        dict
+            Same fields, the document may be replaced by its compressed version
+        """
+        raw = bson.encode(fields['document'])
+        if len(raw) < self.threshold:
+            return fields
+
+        return {
+            **fields,
+            'document': bson.Binary(self.compress(raw)),
+            'codec': self.algorithm,
+            'document_size': len(raw)
+        }
+
+
+def to_update(fields: dict, codec: DocumentCodec = None) -> dict:
+    """Creates the update of a document. The codec fields are removed when
+    the document is stored uncompressed, so old versions are not decoded
+
+    Parameters
+    ----------
+    fields : dict
+        Fields of the CachrModelBuilder.Model
+    codec : DocumentCodec, optional
+        Codec of the Cachr, by default None
+
+    Returns
+    -------
+    dict
+        Update for update_one or UpdateOne
+    """
+    if codec is not None:
+        fields = codec.encode(fields)
+
+    if 'codec' in fields:
+        return {"$set": fields}
+
+    return {"$set": fields, "$unset": {"codec": "", "document_size": ""}}
+
+
+def decode(doc: Optional[dict]) -> Optional[dict]:
+    """Decompresses the document if it was stored by a DocumentCodec
+
+    Parameters
+    ----------
+    doc : dict
+        Document read from MongoDB
+
+    Returns
+    -------
+    dict
+        Same document with the original document field
+    """
+    if doc is None or 'codec' not in doc:
+        return doc
+
+    algorithm = doc.pop('codec')
+    doc.pop('document_size', None)
+    if 'document' in doc:
+        doc['document'] = bson.decode(DocumentCodec.decompress(algorithm, doc['document']))
+
+    return doc
+
+
+def to_projection(projection) -> Optional[dict]:
+    """Normalizes a find projection. The codec fields are added when the
+    document is requested, so it can be decoded
+
+    Parameters
+    ----------
+    projection : Iterable[str] | Mapping[str, Any]
+        Fields to include or exclude
+
+    Returns
+    -------
+    dict
+        Projection for find
+    """
+    if projection is None:
+        return None
+
+    if isinstance(projection, Mapping):
+        projection = dict(projection)
+    else:
+        projection = dict.fromkeys(projection, 1)
+
+    if any(v for k, v in projection.items() if k != '_id'):
+        projection['document_id'] = 1
+        if projection.get('document'):
+            projection.update(codec=1, document_size=1)
+    elif 'document' in projection:
+        projection.update(codec=0, document_size=0)
+
+    return projection
+
+
+class ClientRegistry:
+    """Shares one pooled MongoClient per connection string. Every Cachr
+    acquires the client of its connection and releases it on close, the
+    client is closed when nobody uses it.
+
+    The clients registered with register are not closed with the last
+    handle, they are kept until unregister.
+
+    The clients are not inherited by forked processes: the registry is
+    emptied in the child, so each process opens its own pool.
+    """
+    _clients = {}
+    _handles = {}
+    _settings = {}
+    _registered = set()
+    _indexed = set()
+    _lock = Lock()
+    _pid = os.getpid()
+
+    @classmethod
+    def acquire(cls, connection: Optional[str] = None, **settings) -> pymongo.MongoClient:
+        """Returns the shared client of the connection, creating it if needed
+
+        Parameters
+        ----------
+        connection : str, optional
+            Connection string, by default CACHR_DB_CONNECTION
+        settings : dict
+            MongoClient options that replace CLIENT_SETTINGS, only used
+            when the client is created. Other settings than the ones of
+            the existing client are ignored with a warning
+
+        Returns
+        -------
+        pymongo.MongoClient
+            Client shared by the connection
+        """
+        with cls._lock:
+            cls._check_fork()
+            client = cls._clients.get(connection)
+
+            if client is None:
+                settings = {**CLIENT_SETTINGS, **settings}
+                # connect=False delays the sockets until the first operation
+                client = pymongo.MongoClient(connection, connect=False, **settings)
+                cls._clients[connection] = client
+                cls._handles[connection] = 0
+                cls._settings[connection] = settings
+            elif settings:
+                current = cls._settings.get(connection)
+                if current is None or any(current.get(k) != v for k, v in settings.items()):
+                    log.warning(f"Connection {connection} already has a client, "
+                                f"ignoring the settings {sorted(settings)}")
+
+            cls._handles[connection] += 1
+
+            return client
+
+    @classmethod
+    def register(cls, connection: str, client) -> None:
+        """Uses an existing client for the connection, e.g. an in-process
+        stand-in as mongomock for tests and benchmarks. It is kept, even
+        without handles, until unregister
+
+        Parameters
+        ----------
+        connection : str
+            Connection string the Cachrs will use
+        client : pymongo.MongoClient
+            Client of the connection
+        """
+        with cls._lock:
+            cls._check_fork()
+            if connection in cls._clients:
+                raise ValueError(f"Connection {connection} already has a client")
+
+            cls._clients[connection] = client
+            cls._handles[connection] = 0
+            cls._registered.add(connection)
+
+    @classmethod
+    def unregister(cls, connection: str) -> None:
+        """Closes and forgets the client of register
+
+        Parameters
+        ----------
+        connection : str
+            Connection string of the client
+        """
+        with cls._lock:
+            cls._check_fork()
+            if connection in cls._registered:
+                cls._close(connection)
+
+    @classmethod
+    def release(cls, connection: Optional[str] = None):
+        """Releases one handle of the connection, the client is closed
+        with the last one unless it was registered
+
+        Parameters
+        ----------
+        connection : str, optional
+            Connection string of the client
+        """
+        with cls._lock:
+            cls._check_fork()
+            if connection not in cls._clients:
+                return
+
+            cls._handles[connection] -= 1
+            if cls._handles[connection] <= 0 and connection not in cls._registered:
+                cls._close(connection)
+
+    @classmethod
+    def close_all(cls):
+        """Closes every client of the registry
+        """
+        with cls._lock:
+            for connection in [*cls._clients]:
+                cls._close(connection)
+
+    @classmethod
+    def ensure_index(cls, connection: Optional[str], collection) -> None:
+        """Creates the unique index of document_id the first time the
+        collection is used, so the lookups are not collection scans
+
+        Parameters
+        ----------
+        connection : str
+            Connection string of the collection
+        collection : pymongo.collection.Collection
+            Collection to index
+        """
+        key = (connection, collection.full_name)
+        if key in cls._indexed:
+            return
+
+        with cls._lock:
+            if key in cls._indexed:
+                return
+
+            try:
+                collection.create_index("document_id", unique=True)
+            except OperationFailure:
+                # Old collections may already contain repeated endpoints
+                log.warning(f"Repeated document_id in {collection.name}, "
+                            "creating a non unique index")
+                collection.create_index("document_id")
+
+            cls._indexed.add(key)
+
+    @classmethod
+    def _close(cls, connection: Optional[str]):
+        cls._clients.pop(connection).close()
+        cls._handles.pop(connection, None)
+        cls._settings.pop(connection, None)
+        cls._registered.discard(connection)
+        cls._indexed = {k for k in cls._indexed if k[0] != connection}
+
+    @classmethod
+    def _check_fork(cls):
+        # Sockets and monitor threads of the parent are not usable after a fork
+        if cls._pid != os.getpid():
+            cls._reset()
+
+    @classmethod
+    def _reset(cls):
+        cls._clients = {}
+        cls._handles = {}
+        cls._settings = {}
+        cls._registered = set()
+        cls._indexed = set()
+        cls._lock = Lock()
+        cls._pid = os.getpid()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=ClientRegistry._reset)
+
 
 class CachrModelBuilder(BaseBuilder):
     class Model(BaseModel):
@@ -43,24 +590,98 @@ class CachrModelBuilder(BaseBuilder):
 
 class Cachr:
     """Provides the methods to store and retrieve information from the MongoDB <<Cachr>>
+
+    Every Cachr is a lightweight handle of one collection, the MongoClient
+    is shared through the ClientRegistry by all the Cachrs of the same connection.
+    The client is acquired again in every process, so a Cachr inherited by
+    forked workers does not use the sockets of its parent.
     """
-    _shared_borg_state = {}
 
-    def __init__(self, key_collection: str) -> None:
-        CACHR_CONNECTION = os.environ.get("CACHR_DB_CONNECTION")
-        self.client = pymongo.MongoClient(CACHR_CONNECTION)
+    def __init__(self, key_collection: str, front_cache: FrontCache = None,
+                 connection: str = None, codec: DocumentCodec = None,
+                 retry: Retry = None, **settings) -> None:
+        """
+        Parameters
+        ----------
+        key_collection : str
+            Collection of the documents
+        front_cache : FrontCache, optional
+            In-memory cache checked before MongoDB, by default None
+        connection : str, optional
+            Connection string, by default CACHR_DB_CONNECTION
+        codec : DocumentCodec, optional
+            Compresses the big documents, by default they are stored as is
+        retry : Retry, optional
+            Retries the MongoDB calls that fail with TRANSIENT_ERRORS,
+            by default CACHR_RETRIES attempts
+        settings : dict
+            MongoClient options, see CLIENT_SETTINGS
+        """
+        if connection is None:
+            connection = os.environ.get("CACHR_DB_CONNECTION")
+
+        self.connection = connection
+        self.__settings = settings
         self.__collection_name = key_collection
+        self.__pid = None
+        self.__client = None
+        self.__collection = None
+        self._closed = False
+        self._acquire()
+
+        self.front_cache = front_cache
+        self.codec = codec
+        self.retry = retry or Retry(CACHR_RETRIES, CACHR_RETRY_BACKOFF,
+                                    exceptions=TRANSIENT_ERRORS)
+
+    def _acquire(self):
+        # The handle of a parent process is not ours, its registry was emptied
+        if self.__pid != os.getpid():
+            self.__client = ClientRegistry.acquire(self.connection, **self.__settings)
+            self.__collection = self.__client[CACHR_DB][self.__collection_name]
+            self.__pid = os.getpid()
 
-        self.__db = self.client["bed_cachr"]
-        self.cachr_collection = self.__db[key_collection]
+    @property
+    def client(self) -> pymongo.MongoClient:
+        """Client of the connection in the current process
+        """
+        self._acquire()
+        return self.__client
+
+    @property
+    def cachr_collection(self):
+        self._acquire()
+        return self.__collection
+
+    def __enter__(self) -> 'Cachr':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
 
-    def __new__(cls, *args, **kwargs):
-        """We do this to create a singleton
+    def close(self):
+        """Releases the shared client, it is closed when the last Cachr
+        of the connection is closed
         """
-        obj = super(Cachr, cls).__new__(cls)
-        obj.__dict__ = cls._shared_borg_state
-        return obj
-    
+        if not self._closed:
+            self._closed = True
+            if self.__pid == os.getpid():
+                ClientRegistry.release(self.connection)
+
+    def _front_key(self, ep: str) -> Tuple[str, str]:
+        return (self.__collection_name, ep)
+
+    def _ensure_index(self):
+        ClientRegistry.ensure_index(self.connection, self.cachr_collection)
+
+    def _count(self, layer: str, hits: int, misses: int):
+        # Requests answered by the layer, front (FrontCache) or mongo
+        METRICS.inc('da_cache_requests_total', hits, collection=self.__collection_name,
+                    layer=layer, result='hit')
+        METRICS.inc('da_cache_requests_total', misses, collection=self.__collection_name,
+                    layer=layer, result='miss')
+
+    @METRICS.timed('da_cachr_seconds', op='cach')
     def cach(self, ep: str, data: dict):
         """
 
@@ -72,30 +693,39 @@ class Cachr:
             Data to store if not found
         """
         try:
+            self._ensure_index()
             doc = CachrModelBuilder.transform({
                 "document_id": ep,
                 "updated_at": datetime.now(),
                 "document": data
             })
 
-            with LOCK:
-                self.cachr_collection.update_one(
-                    {"document_id": doc.document_id},
-                    {"$set": doc.__dict__},
-                    upsert=True
-                )
+            # The client is thread safe, the upsert does not need the LOCK
+            self.retry(
+                self.cachr_collection.update_one,
+                {"document_id": doc.document_id},
+                to_update(doc.__dict__, self.codec),
+                upsert=True
+            )
+
+            if self.front_cache is not None:
+                self.front_cache.put(self._front_key(ep), dict(doc.__dict__))
 
         except Exception:
-            log.exception(traceback.print_exc())
+            log_exception(log, "Cachr.cach failed")
             raise
 
-    def is_cachd(self, ep: str) -> dict:
+    @METRICS.timed('da_cachr_seconds', op='is_cachd')
+    def is_cachd(self, ep: str, projection=None) -> dict:
         """Verified if the endpoint is already cachd
 
         Parameters
         ----------
         ep : str
             Endpoint to verify if exists
+        projection : Iterable[str] | Mapping[str, Any], optional
+            Fields to retrieve, e.g. ['updated_at'] for freshness checks.
+            By default the whole document
 
         Returns
         -------
@@ -108,17 +738,155 @@ class Cachr:
             If multiple document wetre found with the same ID
         """
         try:
-            docs = self.cachr_collection.find({
+            if self.front_cache is not None:
+                found, doc = self.front_cache.get(self._front_key(ep))
+                if found:
+                    self._count('front', int(doc is not None), int(doc is None))
+                    return doc
+
+            self._ensure_index()
+            # Two documents are enough to know if the endpoint is repeated
+            docs = self.retry(lambda: [*self.cachr_collection.find({
                 "document_id": ep
-            })
-            docs = [*docs]
+            }, to_projection(projection)).limit(2)])
+
+            if len(docs) > 1:
+                raise Exception(f"More than one document the endopint {ep}")
+
+            docs = [decode(doc) for doc in docs]
+            self._count('mongo', len(docs), 1 - len(docs))
 
+            if self.front_cache is not None:
+                if not docs:
+                    self.front_cache.put_missing(self._front_key(ep))
+                elif projection is None:
+                    self.front_cache.put(self._front_key(ep), docs[0])
 
             if len(docs) == 1:
                 return docs[0]
-            elif len(docs) > 1:
-                raise Exception(f"More than one document the endopint {ep}")
 
         except Exception:
-            log.exception(traceback.print_exc())
+            log_exception(log, "Cachr.is_cachd failed")
+            raise
+
+    @METRICS.timed('da_cachr_seconds', op='cach_many')
+    def cach_many(self, items: Union[Mapping[str, dict], Iterable[Tuple[str, dict]]],
+                  bulk_size: int = None) -> int:
+        """Stores multiple endpoints with unordered bulk upserts, one
+        round-trip per bulk_size documents
+
+        Parameters
+        ----------
+        items : Mapping[str, dict] | Iterable[Tuple[str, dict]]
+            Endpoints with the data to cach
+        bulk_size : int, optional
+            Number of documents per bulk_write, by default BULK_SIZE
+
+        Returns
+        -------
+        int
+            Number of documents inserted or updated
+        """
+        try:
+            self._ensure_index()
+            bulk_size = bulk_size or BULK_SIZE
+
+            if isinstance(items, Mapping):
+                items = items.items()
+
+            now = datetime.now()
+            operations, docs = [], []
+            for ep, data in items:
+                doc = CachrModelBuilder.transform({
+                    "document_id": ep,
+                    "updated_at": now,
+                    "document": data
+                })
+                docs.append(doc)
+                operations.append(UpdateOne(
+                    {"document_id": doc.document_id},
+                    to_update(doc.__dict__, self.codec),
+                    upsert=True
+                ))
+
+            total = 0
+            for chunk in chunked(operations, bulk_size):
+                result = self.retry(self.cachr_collection.bulk_write, chunk, ordered=False)
+                total += result.matched_count + result.upserted_count
+
+            if self.front_cache is not None:
+                for doc in docs:
+                    self.front_cache.put(self._front_key(doc.document_id),
+                                         dict(doc.__dict__))
+
+            return total
+        except Exception:
+            log_exception(log, "Cachr.cach_many failed")
+            raise
+
+    @METRICS.timed('da_cachr_seconds', op='get_many')
+    def get_many(self, eps: Iterable[str], bulk_size: int = None,
+                 projection=None) -> Dict[str, dict]:
+        """Retrieves the cachd endpoints with one $in query per bulk_size endpoints
+
+        Parameters
+        ----------
+        eps : Iterable[str]
+            Endpoints to retrieve
+        bulk_size : int, optional
+            Number of endpoints per query, by default BULK_SIZE
+        projection : Iterable[str] | Mapping[str, Any], optional
+            Fields to retrieve, by default the whole document
+
+        Returns
+        -------
+        Dict[str, dict]
+            Documents cachd keyed by document_id. Endpoints not found are omitted
+
+        Raises
+        ------
+        Exception
+            If multiple documents were found with the same ID
+        """
+        try:
+            self._ensure_index()
+            bulk_size = bulk_size or BULK_SIZE
+            eps = [*dict.fromkeys(eps)]
+
+            docs = {}
+            if self.front_cache is not None:
+                pending = []
+                for ep in eps:
+                    found, doc = self.front_cache.get(self._front_key(ep))
+                    if not found:
+                        pending.append(ep)
+                    elif doc is not None:
+                        docs[ep] = doc
+                self._count('front', len(docs), len(eps) - len(pending) - len(docs))
+                cached, eps = docs, pending
+                docs = {}
+
+            for chunk in chunked(eps, bulk_size):
+                found = self.retry(lambda: [*self.cachr_collection.find({
+                    "document_id": {"$in": chunk}
+                }, to_projection(projection))])
+                for doc in found:
+                    ep = doc["document_id"]
+                    if ep in docs:
+                        raise Exception(f"More than one document the endopint {ep}")
+                    docs[ep] = decode(doc)
+
+            self._count('mongo', len(docs), len(eps) - len(docs))
+
+            if self.front_cache is not None:
+                for ep in eps:
+                    if ep not in docs:
+                        self.front_cache.put_missing(self._front_key(ep))
+                    elif projection is None:
+                        self.front_cache.put(self._front_key(ep), docs[ep])
+                docs.update(cached)
+
+            return docs
+        except Exception:
+            log_exception(log, "Cachr.get_many failed")
             raise
@@ -0,0 +1,156 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Remember to update the PYTHON_PATH to
+# export PYTHONPATH=`pwd`:`pwd`
+"""
+Checkpoints of the chunked conversions. Every input chunk is fingerprinted
+and, once its output is written, recorded in a manifest next to the output.
+A rerun skips the chunks with the same fingerprint whose files still exist,
+so only the new or changed chunks are converted again.
+"""
+import hashlib
+import json
+import os
+
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+import pandas as pd
+
+from da.utils.log import get_logger, log_exception
+
+log = get_logger(__name__)
+
+MANIFEST_VERSION = 1
+
+
+def fingerprint(frame: pd.DataFrame) -> str:
+    """Hash of the content of a chunk: its columns, types, index and values
+
+    Parameters
+    ----------
+    frame : pd.DataFrame
+        Chunk as read from the source
+
+    Returns
+    -------
+    str
+        sha256 hex digest
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps([[str(name), str(dtype)] for name, dtype in frame.dtypes.items()])
+                  .encode())
+    digest.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+
+    return digest.hexdigest()
+
+
+class ChunkManifest:
+    """Completed chunks of a conversion, stored as JSON in path. The output
+    files are relative to the directory of the manifest.
+
+    The manifest is only valid for the same config, e.g. the chunk size and
+    the output format. With another config every chunk is converted again.
+
+    Parameters
+    ----------
+    path : Path | str
+        JSON file of the manifest
+    config : dict, optional
+        Options that change the output of the chunks
+    """
+
+    def __init__(self, path: Union[Path, str], config: Optional[dict] = None) -> None:
+        self.path = Path(path)
+        self.root = self.path.parent
+        self.config = json.loads(json.dumps(config or {}, default=str))
+        self.chunks: Dict[str, dict] = {}
+
+        if self.path.exists():
+            stored = json.loads(self.path.read_text())
+            if stored.get('version') == MANIFEST_VERSION and stored.get('config') == self.config:
+                self.chunks = stored.get('chunks', {})
+            else:
+                log.warning(f"The config of {self.path} changed, every chunk is converted again")
+                for chunk in stored.get('chunks', {}).values():
+                    self._remove_files(chunk)
+
+    def _remove_files(self, entry: dict):
+        for file in entry.get('files', {}):
+            (self.root / file).unlink(missing_ok=True)
+
+    def entry(self, chunk: int) -> Optional[dict]:
+        return self.chunks.get(str(chunk))
+
+    def is_done(self, chunk: int, chunk_fingerprint: str) -> bool:
+        """True if the chunk was completed with the same fingerprint and its
+        files are still there with the same size
+        """
+        entry = self.entry(chunk)
+        if entry is None or entry['fingerprint'] != chunk_fingerprint:
+            return False
+
+        for file, size in entry['files'].items():
+            file = self.root / file
+            if not file.exists() or file.stat().st_size != size:
+                return False
+
+        return True
+
+    def invalidate(self, chunk: int):
+        """Forgets the chunk and removes its files, before converting it again
+        """
+        entry = self.chunks.pop(str(chunk), None)
+        if entry is not None:
+            self._remove_files(entry)
+            self.save()
+
+    def done(self, chunk: int, chunk_fingerprint: str, files: Iterable[Path], **stats):
+        """Records a completed chunk and saves the manifest
+
+        Parameters
+        ----------
+        chunk : int
+            Number of the chunk
+        chunk_fingerprint : str
+            fingerprint of its input
+        files : Iterable[Path]
+            Output files of the chunk
+        stats : dict
+            Values kept with the chunk, e.g. the rows written
+        """
+        files = {Path(file).relative_to(self.root).as_posix(): Path(file).stat().st_size
+                 for file in files}
+        self.chunks[str(chunk)] = {'fingerprint': chunk_fingerprint, 'files': files, **stats}
+        self.save()
+
+    def prune(self, num_chunks: int) -> List[str]:
+        """Removes the chunks from num_chunks on, e.g. when the source is
+        shorter than in the last run
+
+        Returns
+        -------
+        List[str]
+            Chunks removed
+        """
+        removed = [key for key in self.chunks if int(key) >= num_chunks]
+        for key in removed:
+            self._remove_files(self.chunks.pop(key))
+
+        if removed:
+            self.save()
+
+        return removed
+
+    def save(self):
+        """Writes the manifest at once, so a crash never leaves it half written
+        """
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+            tmp = self.path.with_name(f".{self.path.name}.tmp")
+            tmp.write_text(json.dumps({'version': MANIFEST_VERSION, 'config': self.config,
+                                       'chunks': self.chunks}, indent=2, sort_keys=True))
+            os.replace(tmp, self.path)
+        except Exception:
+            log_exception(log, "ChunkManifest.save failed")
+            raise
@@ -3,21 +3,27 @@
 # Remember to update the PYTHON_PATH to
 # export PYTHONPATH=`pwd`:`pwd`
 
-import traceback
+import math
+import functools
 import time
 import multiprocessing
 
+import itertools
 import collections
 import traceback
 
 from threading import Lock
 
 from tqdm import tqdm
-from typing import Callable, List
-from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, NamedTuple, Tuple
+from concurrent.futures import (FIRST_COMPLETED, Executor, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
 from da.utils.config import Config
+from da.utils.errors import Failure
+from da.utils.shared import SharedTable
 
-from da.utils.log import get_logger
+from da.utils.log import get_logger, log_exception
+from da.utils.metrics import METRICS
 
 log = get_logger(__name__)
 
@@ -27,6 +33,133 @@ LOCK = Lock()
 
 MAX_NUM_WORKERS_ALLOWED = 0
 
+def _max_workers(kwargs: dict) -> int:
+    """Number of workers requested with max_workers, capped by Config().NUM_WORKERS
+    """
+    tmp = kwargs.get('max_workers', multiprocessing.cpu_count())
+    max_workers = Config().NUM_WORKERS
+
+    return min(tmp, max_workers)
+
+BACKENDS = ('threads', 'processes')
+
+# Options of the executors of barified, iter_barified and batchify. They are
+# not passed to func, unlike max_workers, hide_bar, num_batches and batch_size
+EXECUTOR_OPTIONS = ('backend', 'chunksize', 'stream', 'max_in_flight', 'ordered', 'error_policy')
+BATCHIFY_OPTIONS = ('shared', 'adaptive', 'scheduler')
+
+def _split_options(kwargs: dict, names: tuple = EXECUTOR_OPTIONS) -> Tuple[dict, dict]:
+    """Splits the options of the executor from the kwargs of func
+    """
+    options = {name: kwargs[name] for name in names if name in kwargs}
+    kwargs = {name: value for name, value in kwargs.items() if name not in options}
+
+    return options, kwargs
+
+def _backend(options: dict) -> str:
+    return options.get('backend') or Config().BACKEND
+
+class _Call:
+    """Picklable version of lambda x: func(x, *args, **kwargs), so the
+    tasks can be send to a process pool
+    """
+    def __init__(self, func: Callable, args: tuple, kwargs: dict) -> None:
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+
+    def __call__(self, item):
+        return self.func(item, *self.args, **self.kwargs)
+
+class _MeteredCall(_Call):
+    """_Call that observes the seconds of every task in da_task_seconds.
+    In a process pool it also returns the metrics recorded by the worker,
+    so the parent merges them with _unwrap
+    """
+    def __init__(self, func: Callable, args: tuple, kwargs: dict, stage: str,
+                 backend: str) -> None:
+        super().__init__(func, args, kwargs)
+        self.labels = {'stage': stage, 'func': getattr(func, '__qualname__', type(func).__name__)}
+        self.drain = backend == 'processes'
+
+    def __call__(self, item):
+        with METRICS.timer('da_task_seconds', **self.labels):
+            result = super().__call__(item)
+
+        return (result, METRICS.drain()) if self.drain else result
+
+def _call(func: Callable, args: tuple, kwargs: dict, stage: str, backend: str) -> _Call:
+    """Task of the pools, metered only with the metrics enabled
+    """
+    if METRICS.enabled:
+        return _MeteredCall(func, args, kwargs, stage, backend)
+
+    return _Call(func, args, kwargs)
+
+class _Guarded:
+    """Task of a run with an error_policy: the exceptions are returned as
+    a Failure with the item, so the parent records them and goes on
+    """
+    def __init__(self, call: _Call) -> None:
+        self.call = call
+        self.drain = getattr(call, 'drain', False)
+
+    def __call__(self, item):
+        try:
+            return self.call(item)
+        except Exception as e:
+            return Failure.of(item, e)
+
+def _guard(call: _Call, policy) -> _Call:
+    return call if policy is None else _Guarded(call)
+
+def _settle(call: _Call, result, policy, stage: str):
+    """Result of a task of call. The failures are recorded by the policy
+    and replaced by its placeholder
+    """
+    if isinstance(result, Failure):
+        policy.record(result, stage)
+        return policy.placeholder
+
+    if policy is not None:
+        policy.ok()
+
+    return _unwrap(call, result)
+
+def _unwrap(call: _Call, result):
+    """Result of a task of call, merging the metrics of the worker
+    """
+    if getattr(call, 'drain', False):
+        result, metrics = result
+        METRICS.merge(metrics)
+
+    return result
+
+def _init_worker(config_state: dict, metrics_enabled: bool = False):
+    """Initializes each process of the pool once: the Config of the parent
+    is copied, and the logger is set up by importing this module. The
+    metrics copied by the fork are dropped, the parent already has them
+    """
+    Config._shared_borg_state.update(config_state)
+    METRICS.enabled = metrics_enabled
+    METRICS.reset()
+
+def _executor(options: dict, max_workers: int) -> Executor:
+    """Creates the executor of the backend requested with backend,
+    by default Config().BACKEND
+    """
+    backend = _backend(options)
+
+    if backend == 'threads':
+        return ThreadPoolExecutor(max_workers=max_workers)
+    if backend == 'processes':
+        return ProcessPoolExecutor(max_workers=max_workers,
+                                   initializer=_init_worker,
+                                   initargs=(dict(Config._shared_borg_state),
+                                             METRICS.enabled))
+
+    raise ValueError(f"Unknown backend {backend}, use one of {BACKENDS}")
+
 def barified(func: Callable,
              data: collections,
              *args,
@@ -37,6 +170,12 @@ def barified(func: Callable,
     The data is splitted in items and send to a function with signature
     func(item, *args, **kwargs).
 
+    With stream=True it returns the generator of iter_barified instead of
+    the list, see its options.
+
+    With backend='processes' the items are executed in a process pool,
+    func, the items and the results must be picklable. The items are send
+    in chunks of chunksize to reduce the IPC.
 
     Parameters
     ----------
@@ -44,6 +183,16 @@ def barified(func: Callable,
         Function to execute for each item in the data collection
     data : collections.Sized
         Data to process, should contains the len method (collections.Sized)
+    backend : str, optional
+        threads or processes, by default Config().BACKEND
+    chunksize : int, optional
+        Items per task of the process backend, by default the data is
+        split in 4 chunks per worker
+    error_policy : ErrorPolicy, optional
+        Records the failing items and goes on, their result is the
+        placeholder of the policy. By default the first error is raised
+
+    The EXECUTOR_OPTIONS are not passed to func.
 
     Returns
     -------
@@ -51,6 +200,13 @@ def barified(func: Callable,
         List of the results of func function
     """
     try:
+        options, kwargs = _split_options(kwargs)
+        if options.get('stream', False):
+            return iter_barified(func, data, *args, **options, **kwargs)
+
+        policy = options.get('error_policy')
+        stage = getattr(func, '__qualname__', type(func).__name__)
+
         total = 0
 
         if not hasattr(data, '__len__'):
@@ -58,28 +214,329 @@ def barified(func: Callable,
         else:
             total = len(data)
 
-        tmp = kwargs.get('max_workers', multiprocessing.cpu_count())
-        max_workers = Config().NUM_WORKERS
-
-        max_workers = min(tmp, max_workers)
+        max_workers = _max_workers(kwargs)
             
         hide_bar = kwargs.get('hide_bar', False)
         processes_results = []
 
-        with tqdm(total=total, disable=hide_bar) as pbar:
-            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        chunksize = options.get('chunksize') or max(total // (4 * max_workers), 1)
+
+        with METRICS.timer('da_stage_seconds', stage='barified'), \
+                tqdm(total=total, disable=hide_bar) as pbar:
+            with _executor(options, max_workers) as executor:
                 try:
-                    for result in executor.map(lambda x: func(x, *args, **kwargs), data):
-                        processes_results.append(result)
+                    # chunksize is ignored by the thread pool
+                    call = _guard(_call(func, args, kwargs, 'barified', _backend(options)),
+                                  policy)
+                    for result in executor.map(call, data, chunksize=chunksize):
+                        processes_results.append(_settle(call, result, policy, stage))
                         pbar.update(1)
                 except Exception:
-                    log.exception(traceback.print_exc())
+                    log_exception(log, "barified failed")
                     raise
 
+        METRICS.inc('da_items_total', len(processes_results), stage='barified')
+
         return processes_results
     except Exception:
         raise
 
+def iter_barified(func: Callable,
+                  data: Iterable,
+                  *args,
+                  **kwargs) -> Iterator:
+    """Streaming version of barified. The data is pulled lazily from any
+    iterable and at most max_in_flight items are submitted at once, so the
+    memory does not grow with the size of the data.
+
+    The items are send to a function with signature func(item, *args, **kwargs).
+
+    Parameters
+    ----------
+    func : Callable
+        Function to execute for each item in the data
+    data : Iterable
+        Data to process, it may be a generator of unknown size
+    max_in_flight : int, optional
+        Max number of submitted tasks, by default twice the number of workers
+    ordered : bool, optional
+        Yields the results in the order of the data, by default True.
+        With False they are yielded as completed
+    backend : str, optional
+        threads or processes, by default Config().BACKEND
+    error_policy : ErrorPolicy, optional
+        As in barified
+
+    The EXECUTOR_OPTIONS are not passed to func.
+
+    Yields
+    ------
+    Any
+        Results of func function
+    """
+    total = len(data) if hasattr(data, '__len__') else None
+
+    options, kwargs = _split_options(kwargs)
+    max_workers = _max_workers(kwargs)
+    max_in_flight = options.get('max_in_flight') or 2 * max_workers
+    ordered = options.get('ordered', True)
+    hide_bar = kwargs.get('hide_bar', False)
+
+    policy = options.get('error_policy')
+    stage = getattr(func, '__qualname__', type(func).__name__)
+
+    items = iter(data)
+    pending = collections.deque() if ordered else set()
+    call = _guard(_call(func, args, kwargs, 'iter_barified', _backend(options)), policy)
+
+    def submit(executor, n: int):
+        for item in itertools.islice(items, n):
+            future = executor.submit(call, item)
+            if ordered:
+                pending.append(future)
+            else:
+                pending.add(future)
+
+    with tqdm(total=total, disable=hide_bar) as pbar:
+        with _executor(options, max_workers) as executor:
+            try:
+                submit(executor, max_in_flight)
+
+                while pending:
+                    if ordered:
+                        done = [pending.popleft()]
+                    else:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        pending.difference_update(done)
+
+                    for future in done:
+                        result = _settle(call, future.result(), policy, stage)
+                        pbar.update(1)
+                        yield result
+
+                    submit(executor, max_in_flight - len(pending))
+            except Exception:
+                log_exception(log, "iter_barified failed")
+                raise
+            finally:
+                for future in pending:
+                    future.cancel()
+
+class _TimedCall(_Call):
+    """_Call that also returns how long the task took in the worker. As
+    _MeteredCall, in a process pool it also returns the metrics of the worker
+    """
+    def __init__(self, func: Callable, args: tuple, kwargs: dict, backend: str) -> None:
+        super().__init__(func, args, kwargs)
+        self.drain = METRICS.enabled and backend == 'processes'
+
+    def __call__(self, item):
+        start_time = time.perf_counter()
+        result = self.func(item, *self.args, **self.kwargs)
+        result = result, time.perf_counter() - start_time
+
+        return (result, METRICS.drain()) if self.drain else result
+
+class BatchTiming(NamedTuple):
+    start: int
+    end: int
+    duration: float
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+    @property
+    def items_per_second(self) -> float:
+        return self.size / self.duration if self.duration > 0 else math.inf
+
+class AdaptiveScheduler:
+    """Scheduler of batchify that adapts the batch size while it runs.
+    It starts with small batches, measures the seconds per item of each one
+    and sizes the next ones to last target_duration seconds.
+
+    The pending rows are a shared range that the idle workers split: a batch
+    is never bigger than the remaining rows divided by the workers, so a slow
+    batch at the tail does not leave the rest of the workers idle.
+
+    The timing of every batch is kept in stats.
+
+    Parameters
+    ----------
+    target_duration : float, optional
+        Seconds that each batch should last, by default 0.5
+    initial_batch_size : int, optional
+        Size of the first batches, by default 32
+    min_batch_size : int, optional
+        Min size of the batches, by default 1
+    max_batch_size : int, optional
+        Max size of the batches, by default unbounded
+    smoothing : float, optional
+        Weight of the last batch in the moving average of the seconds per item,
+        by default 0.3
+    """
+
+    def __init__(self,
+                 target_duration: float = 0.5,
+                 initial_batch_size: int = 32,
+                 min_batch_size: int = 1,
+                 max_batch_size: int = None,
+                 smoothing: float = 0.3) -> None:
+        self.target_duration = target_duration
+        self.initial_batch_size = initial_batch_size
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.smoothing = smoothing
+
+        self.stats: List[BatchTiming] = []
+        self._seconds_per_item = None
+
+    def next_size(self, remaining: int, workers: int) -> int:
+        """Size of the next batch
+
+        Parameters
+        ----------
+        remaining : int
+            Rows not submitted yet
+        workers : int
+            Number of workers
+
+        Returns
+        -------
+        int
+            Number of rows of the batch
+        """
+        if self._seconds_per_item is None:
+            size = self.initial_batch_size
+        elif self._seconds_per_item == 0:
+            size = self.max_batch_size or remaining
+        else:
+            size = int(self.target_duration / self._seconds_per_item)
+
+        if self.max_batch_size is not None:
+            size = min(size, self.max_batch_size)
+
+        size = min(size, math.ceil(remaining / workers))
+
+        return max(size, self.min_batch_size, 1)
+
+    def record(self, timing: BatchTiming):
+        """Registers the timing of a finished batch and updates the
+        moving average of the seconds per item
+
+        Parameters
+        ----------
+        timing : BatchTiming
+            Timing of the batch
+        """
+        self.stats.append(timing)
+        if timing.size == 0:
+            return
+
+        seconds = timing.duration / timing.size
+        if self._seconds_per_item is None:
+            self._seconds_per_item = seconds
+        else:
+            self._seconds_per_item = (self.smoothing * seconds
+                                      + (1 - self.smoothing) * self._seconds_per_item)
+
+    def summary(self) -> dict:
+        """Aggregated stats of the batches
+
+        Returns
+        -------
+        dict
+            batches, items, mean, min and max duration and sizes
+        """
+        if not self.stats:
+            return {"batches": 0, "items": 0}
+
+        durations = [t.duration for t in self.stats]
+        sizes = [t.size for t in self.stats]
+
+        return {
+            "batches": len(self.stats),
+            "items": sum(sizes),
+            "mean_duration": sum(durations) / len(durations),
+            "min_duration": min(durations),
+            "max_duration": max(durations),
+            "min_batch_size": min(sizes),
+            "max_batch_size": max(sizes),
+            "seconds_per_item": self._seconds_per_item
+        }
+
+    def run(self, func: Callable, data, args: tuple, kwargs: dict) -> List:
+        """Executes func over all the rows of data with adaptive batches
+
+        Parameters
+        ----------
+        func : Callable
+            Function with the batchify signature func((start, end), data, *args, **kwargs)
+        data : collections.Sized
+            Data to batchify
+        args : tuple
+            Extra arguments of func
+        kwargs : dict
+            Extra keyword arguments of func. The EXECUTOR_OPTIONS configure
+            the executor and are not passed to func
+
+        Returns
+        -------
+        List
+            Results of every batch in the order of the data
+        """
+        total = len(data)
+        options, kwargs = _split_options(kwargs)
+        max_workers = _max_workers(kwargs)
+        hide_bar = kwargs.get('hide_bar', False)
+
+        policy = options.get('error_policy')
+        # The scheduler stays in this process, only func and its arguments reach the workers
+        call = _guard(_TimedCall(func, (data, *args), kwargs, _backend(options)), policy)
+        name = getattr(func, '__qualname__', type(func).__name__)
+        results = {}
+        pending = {}
+        cursor = 0
+
+        with tqdm(total=total, disable=hide_bar) as pbar:
+            with _executor(options, max_workers) as executor:
+                try:
+                    def submit():
+                        nonlocal cursor
+                        while cursor < total and len(pending) < max_workers:
+                            size = self.next_size(total - cursor, max_workers)
+                            ixs = (cursor, min(cursor + size, total))
+                            pending[executor.submit(call, ixs)] = ixs
+                            cursor = ixs[1]
+
+                    submit()
+                    while pending:
+                        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            start, end = pending.pop(future)
+                            result = future.result()
+                            pbar.update(end - start)
+
+                            if isinstance(result, Failure):
+                                results[start] = _settle(call, result, policy, name)
+                                continue
+
+                            result, duration = _settle(call, result, policy, name)
+
+                            results[start] = result
+                            self.record(BatchTiming(start, end, duration))
+                            METRICS.observe('da_task_seconds', duration,
+                                            stage='batchify', func=name)
+
+                        submit()
+                except Exception:
+                    for future in pending:
+                        future.cancel()
+                    log_exception(log, "AdaptiveScheduler.run failed")
+                    raise
+
+        return [results[start] for start in sorted(results)]
+
 def batchify(func: Callable,
              data: collections,
              *args,
@@ -97,6 +554,24 @@ def batchify(func: Callable,
         Function to call on batches
     data : collections
         Data to batchify
+    backend : str, optional
+        threads or processes, by default Config().BACKEND. With processes
+        func must be picklable and data is pickled once per batch
+    shared : bool, optional
+        Writes the data once in shared memory and sends a SharedTable to
+        func instead, so the processes do not receive a copy per batch.
+        data must be a DataFrame, an arrow Table or a ColumnarBatch, and
+        func receives its rows data[start:end] as DataFrame
+    adaptive : bool, optional
+        Sizes the batches with an AdaptiveScheduler instead of
+        num_batches and batch_size, by default False
+    scheduler : AdaptiveScheduler, optional
+        Scheduler to use, e.g. to read its stats afterwards. It implies adaptive
+    error_policy : ErrorPolicy, optional
+        Records the failing batches, as (start, end), and goes on without
+        their rows. By default the first error is raised
+
+    The EXECUTOR_OPTIONS, shared, adaptive and scheduler are not passed to func.
 
     Returns
     -------
@@ -104,6 +579,7 @@ def batchify(func: Callable,
         List of batches
     """
     try:
+        batchify_options, kwargs = _split_options(kwargs, BATCHIFY_OPTIONS)
         num_batches = kwargs.get('num_batches')
         batch_size = kwargs.get('batch_size')
 
@@ -116,12 +592,28 @@ def batchify(func: Callable,
         batch_ixs = range(0, len(data), batch_size)
         batch_ixs = [*map(lambda x: (x, x + batch_size), batch_ixs)]
 
-        tmp = barified(func, 
-                       batch_ixs,
-                       data,
-                       *args,
-                       **kwargs)
-        
+        shared = None
+        if batchify_options.get('shared', False):
+            shared = data = SharedTable.create(data)
+
+        scheduler = batchify_options.get('scheduler')
+        if scheduler is None and batchify_options.get('adaptive', False):
+            scheduler = AdaptiveScheduler()
+
+        try:
+            with METRICS.timer('da_stage_seconds', stage='batchify'):
+                if scheduler is not None:
+                    tmp = scheduler.run(func, data, args, kwargs)
+                else:
+                    tmp = barified(func,
+                                   batch_ixs,
+                                   data,
+                                   *args,
+                                   **kwargs)
+        finally:
+            if shared is not None:
+                shared.unlink()
+
 
         if tmp is not None and isinstance(tmp, list):
             tmp = filter(lambda x: x is not None, tmp)
@@ -129,23 +621,27 @@ def batchify(func: Callable,
 
             return res
     except Exception:
-        log.exception(traceback.print_exc())
+        log_exception(log, "batchify failed")
         raise
 
-def timed(func, *args, **kwargs):
-    """Decorator to measure the excuyion time of a process
+def timed(func):
+    """Decorator to measure the execution time of a function. The time is
+    logged and, with the metrics enabled, observed in da_function_seconds
 
     Parameters
     ----------
     func : Callable
         Function to execute
     """
-    def wrapper(*aegs, **kwargs):
-        start_time = time.time()
-
-        func(*args, **kwargs)
-
-        log.info("--- %s seconds ---" % (time.time() - start_time))
-
-    return wrapper  
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - start_time
+            log.info("--- %s seconds ---" % elapsed)
+            METRICS.observe('da_function_seconds', elapsed, function=func.__qualname__)
+
+    return wrapper
 # endregion
@@ -11,6 +11,7 @@ class Config(object):
     """
     _num_workers = None
     _num_batches = None
+    _backend = None
     _shared_borg_state = {}
 
     def __new__(cls, *args, **kwargs):
@@ -49,3 +50,19 @@ class Config(object):
             num_batches = max(multiprocessing.cpu_count() - 1, 1)
 
         return num_batches
+
+    @property
+    def BACKEND(self) -> str:
+        """Executor used by barified and batchify, threads or processes
+
+        Returns
+        -------
+        str
+            Name of the backend
+        """
+        backend = self._backend
+
+        if backend is None:
+            backend = 'threads'
+
+        return backend
@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Remember to update the PYTHON_PATH to
+# export PYTHONPATH=`pwd`:`pwd`
+"""
+Date parsing with known formats first and pendulum only for the outliers
+"""
+import re
+
+from collections import Counter, OrderedDict
+from datetime import datetime, timezone
+from threading import Lock
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+import pandas as pd
+import pendulum
+
+from da.utils.log import get_logger
+
+log = get_logger(__name__)
+
+# (strptime format, regex of the strings with that format). The regexes do
+# not overlap, so a string is parsed the same whichever format is dominant
+KNOWN_FORMATS = [
+    ('%Y-%m-%d', r'\d{4}-\d{2}-\d{2}'),
+    ('%d/%m/%Y', r'\d{1,2}/\d{1,2}/\d{4}'),
+    ('%Y/%m/%d', r'\d{4}/\d{1,2}/\d{1,2}'),
+    ('%Y-%m-%dT%H:%M:%S', r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}'),
+    ('%Y-%m-%d %H:%M:%S', r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}'),
+    ('%Y-%m-%dT%H:%M:%S%z', r'\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:Z|[+-]\d{2}:?\d{2})'),
+]
+
+# Number of strings used to detect the dominant format of a column
+SAMPLE_SIZE = 1000
+
+UNIT = 'datetime64[us]'
+
+
+class DateParser:
+    """Parses dates with the known formats and falls back to pendulum for
+    the rest. Naive dates are UTC, as pendulum does.
+
+    Single strings are memoized in a bounded LRU. Columns are parsed once
+    per distinct string, the dominant format is tried first with
+    pd.to_datetime and an explicit format.
+
+    Parameters
+    ----------
+    formats : List[Tuple[str, str]], optional
+        Known formats, by default KNOWN_FORMATS
+    max_cache : int, optional
+        Max number of memoized strings, by default 100000
+    """
+
+    def __init__(self, formats: List[Tuple[str, str]] = None,
+                 max_cache: int = 100_000) -> None:
+        formats = KNOWN_FORMATS if formats is None else formats
+        self.formats = [(fmt, re.compile(regex)) for fmt, regex in formats]
+        self.max_cache = max_cache
+
+        self._cache = OrderedDict()
+        self._lock = Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = Counter()
+            self._formats = Counter()
+            self.dominant_format = None
+
+    def stats(self) -> dict:
+        """Parse-hit statistics
+
+        Returns
+        -------
+        dict
+            Values parsed by format (fast), by pendulum (fallback), failed,
+            memo hits and misses, rows per format and the last dominant format
+        """
+        with self._lock:
+            return {
+                **{k: self._stats[k] for k in ('fast', 'fallback', 'failed',
+                                                'memo_hits', 'memo_misses')},
+                'formats': dict(self._formats),
+                'dominant_format': self.dominant_format
+            }
+
+    def _strptime(self, value: str) -> Tuple[Any, str]:
+        for fmt, regex in self.formats:
+            if regex.fullmatch(value):
+                try:
+                    parsed = datetime.strptime(value.replace('Z', '+0000'), fmt)
+                except ValueError:
+                    break
+                if parsed.tzinfo is None:
+                    parsed = parsed.replace(tzinfo=timezone.utc)
+                return parsed, fmt
+
+        return None, None
+
+    def _lookup(self, value: str) -> Tuple[Any, str, str]:
+        """Memoized parse of one string
+
+        Returns
+        -------
+        Tuple[Any, str, str]
+            Parsed date, error and format. The format is None when it was
+            parsed by pendulum and the date is None when it failed
+        """
+        with self._lock:
+            cached = self._cache.get(value)
+            if cached is not None:
+                self._cache.move_to_end(value)
+                self._stats['memo_hits'] += 1
+                return cached
+
+            self._stats['memo_misses'] += 1
+
+        parsed, fmt = self._strptime(value)
+        if parsed is not None:
+            cached = (parsed, None, fmt)
+        else:
+            try:
+                cached = (pendulum.parse(value), None, None)
+            except Exception as e:
+                cached = (None, str(e), None)
+
+        with self._lock:
+            self._cache[value] = cached
+            if len(self._cache) > self.max_cache:
+                self._cache.popitem(last=False)
+
+        return cached
+
+    def _count(self, fmt: str, error: str, rows: int = 1):
+        with self._lock:
+            if error is not None:
+                self._stats['failed'] += rows
+            elif fmt is not None:
+                self._stats['fast'] += rows
+                self._formats[fmt] += rows
+            else:
+                self._stats['fallback'] += rows
+
+    def parse(self, value: str) -> datetime:
+        """Parses one date string, the result is memoized
+
+        Parameters
+        ----------
+        value : str
+            Date to parse, already stripped
+
+        Returns
+        -------
+        datetime
+            Timezone aware date
+
+        Raises
+        ------
+        ValueError
+            If the string is not a date
+        """
+        parsed, error, fmt = self._lookup(value)
+        self._count(fmt, error)
+
+        if error is not None:
+            raise ValueError(error)
+
+        return parsed
+
+    def dominant(self, strings: pd.Series) -> List[Tuple[str, Any]]:
+        """Sorts the formats by the number of strings of the sample they match
+
+        Parameters
+        ----------
+        strings : pd.Series
+            Strings of the column
+
+        Returns
+        -------
+        List[Tuple[str, Any]]
+            Formats, the dominant first
+        """
+        sample = strings.iloc[:SAMPLE_SIZE]
+        counts = [int(sample.str.fullmatch(regex.pattern).sum()) for _, regex in self.formats]
+        order = sorted(range(len(self.formats)), key=lambda ix: -counts[ix])
+
+        if counts[order[0]] > 0:
+            with self._lock:
+                self.dominant_format = self.formats[order[0]][0]
+
+        return [self.formats[ix] for ix in order]
+
+    def parse_column(self, values: pd.Series) -> Tuple[np.ndarray, Dict[int, str]]:
+        """Parses a column. Empty strings and missing values are NaT, other
+        values that are not strings are converted as they are
+
+        Parameters
+        ----------
+        values : pd.Series
+            Dates to parse
+
+        Returns
+        -------
+        Tuple[np.ndarray, Dict[int, str]]
+            Naive UTC datetime64 array and the positions that could not be
+            parsed with the reason
+        """
+        if pd.api.types.is_datetime64_any_dtype(values.dtype):
+            dates = pd.to_datetime(values, utc=True).dt.tz_localize(None)
+            return dates.to_numpy().astype(UNIT), {}
+
+        codes, uniques = pd.factorize(values)
+        uniques = np.asarray(uniques, dtype=object)
+        rows = np.bincount(codes[codes >= 0], minlength=len(uniques))
+
+        # The extra NaT is picked by the -1 code of the missing values
+        parsed = np.full(len(uniques) + 1, np.datetime64('NaT'), dtype=UNIT)
+        errors = {}
+
+        is_str = np.fromiter((isinstance(v, str) for v in uniques), bool, len(uniques))
+        str_ix = np.flatnonzero(is_str)
+        strings = pd.Series(uniques[is_str], dtype=object).str.strip()
+        pending = (strings.str.len() > 0).to_numpy(copy=True)
+
+        formats = Counter()
+        for fmt, regex in self.dominant(strings[pending]):
+            if not pending.any():
+                break
+
+            candidates = pending & strings.str.fullmatch(regex.pattern).to_numpy()
+            if not candidates.any():
+                continue
+
+            dates = pd.to_datetime(strings[candidates].str.replace('Z', '+0000', regex=False),
+                                   format=fmt, errors='coerce', utc=True)
+            ok = dates.notna().to_numpy()
+            positions = np.flatnonzero(candidates)[ok]
+
+            parsed[str_ix[positions]] = dates[ok].dt.tz_localize(None).to_numpy().astype(UNIT)
+            pending[positions] = False
+
+            formats[fmt] += int(rows[str_ix[positions]].sum())
+
+        # Outliers and values that are not strings
+        outliers = [*str_ix[pending], *np.flatnonzero(~is_str)]
+        for ix in outliers:
+            value, error, fmt = uniques[ix], None, None
+            try:
+                if isinstance(value, str):
+                    value, error, fmt = self._lookup(value.strip())
+                if error is None:
+                    stamp = pd.Timestamp(value)
+                    if stamp.tzinfo is None:
+                        stamp = stamp.tz_localize('UTC')
+                    parsed[ix] = stamp.tz_convert('UTC').tz_localize(None).to_datetime64()
+            except Exception as e:
+                error = str(e)
+
+            if error is not None:
+                errors[ix] = error
+            self._count(fmt, error, int(rows[ix]))
+
+        with self._lock:
+            self._stats['fast'] += sum(formats.values())
+            self._formats.update(formats)
+
+        # The rows of all the failed values in one pass
+        failed = {}
+        if errors:
+            positions = np.flatnonzero(np.isin(codes, [*errors]))
+            failed = {int(pos): errors[code] for pos, code in zip(positions, codes[positions])}
+
+        return parsed[codes], failed
+
+
+DATE_PARSER = DateParser()
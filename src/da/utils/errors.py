@@ -0,0 +1,366 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Remember to update the PYTHON_PATH to
+# export PYTHONPATH=`pwd`:`pwd`
+"""
+Error policies of the long runs. With an ErrorPolicy the failing items of
+barified, batchify and the builders' transform_batch are written to a
+dead letter sink and the run goes on, until max_errors is reached.
+
+    with ErrorPolicy('rejected.jsonl', max_errors=1000) as policy:
+        barified(func, data, error_policy=policy)
+
+Retry repeats the calls that fail with transient errors, e.g. the MongoDB
+calls of Cachr.
+"""
+import json
+import random
+import time
+import traceback
+
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+from pathlib import Path
+from threading import Lock
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple, Type, Union
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from da.models.batch import as_frame
+from da.utils.log import get_logger
+from da.utils.metrics import METRICS
+
+log = get_logger(__name__)
+
+DEAD_LETTER_SCHEMA = pa.schema([
+    pa.field('at', pa.string()),
+    pa.field('stage', pa.string()),
+    pa.field('label', pa.string()),
+    pa.field('error', pa.string()),
+    pa.field('message', pa.string()),
+    pa.field('traceback', pa.string()),
+    pa.field('item', pa.string()),
+])
+
+
+class TooManyErrors(Exception):
+    """The run exceeded the max errors of its ErrorPolicy"""
+
+
+class Failure(NamedTuple):
+    """Item whose task raised, returned by the workers instead of the
+    exception so the parent decides what to do with it
+    """
+    item: Any
+    error: str
+    message: str
+    traceback: str
+
+    @classmethod
+    def of(cls, item: Any, exc: BaseException) -> 'Failure':
+        return cls(item, type(exc).__name__, str(exc),
+                   ''.join(traceback.format_exception(type(exc), exc, exc.__traceback__)))
+
+
+def _missing_to_none(item: Any) -> Any:
+    if isinstance(item, dict):
+        return {key: _missing_to_none(value) for key, value in item.items()}
+    if isinstance(item, (list, tuple)):
+        return [_missing_to_none(value) for value in item]
+
+    try:
+        # NaN, None, pd.NA and NaT, the arrays are not scalars
+        return None if pd.isna(item) is True else item
+    except (TypeError, ValueError):
+        return item
+
+
+def to_jsonable(item: Any) -> Any:
+    """Item as a value json.dumps accepts: the missing values (NaN, NA,
+    NaT) as None, which is valid JSON, and the unknown types as str
+    """
+    if isinstance(item, pd.Series):
+        item = item.to_dict()
+
+    return json.loads(json.dumps(_missing_to_none(item), default=str))
+
+
+class DeadLetterSink(ABC):
+    """Destination of the failing items"""
+
+    @abstractmethod
+    def write(self, record: dict):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemorySink(DeadLetterSink):
+    """Keeps the records in records, for the tests and the small runs"""
+
+    def __init__(self) -> None:
+        self.records: List[dict] = []
+
+    def write(self, record: dict):
+        self.records.append(record)
+
+
+class JSONLSink(DeadLetterSink):
+    """Appends one JSON object per record to the file
+
+    Parameters
+    ----------
+    path : Path | str
+        File of the records
+    """
+
+    def __init__(self, path: Union[Path, str]) -> None:
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = None
+
+    def write(self, record: dict):
+        if self._file is None:
+            self._file = self.path.open('a', encoding='utf-8')
+
+        self._file.write(json.dumps(record, default=str, allow_nan=False) + '\n')
+        self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class ParquetSink(DeadLetterSink):
+    """Writes the records to a Parquet file with DEAD_LETTER_SCHEMA, the
+    items as JSON. The records are buffered and written every buffer_size
+
+    Parameters
+    ----------
+    path : Path | str
+        File of the records
+    buffer_size : int, optional
+        Records per row group, by default 10_000
+    """
+
+    def __init__(self, path: Union[Path, str], buffer_size: int = 10_000) -> None:
+        self.path = Path(path)
+        self.buffer_size = buffer_size
+        self._buffer: List[dict] = []
+        self._writer = None
+
+    def write(self, record: dict):
+        self._buffer.append({**record, 'label': None if record['label'] is None
+                             else str(record['label']),
+                             'item': json.dumps(record['item'], default=str,
+                                                allow_nan=False)})
+        if len(self._buffer) >= self.buffer_size:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+
+        if self._writer is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._writer = pq.ParquetWriter(self.path, DEAD_LETTER_SCHEMA)
+
+        self._writer.write_table(pa.Table.from_pylist(self._buffer, schema=DEAD_LETTER_SCHEMA))
+        self._buffer = []
+
+    def close(self):
+        self._flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+
+def dead_letter_sink(path: Union[Path, str]) -> DeadLetterSink:
+    """ParquetSink for the .parquet files, JSONLSink for the rest
+    """
+    if Path(path).suffix == '.parquet':
+        return ParquetSink(path)
+
+    return JSONLSink(path)
+
+
+class ErrorPolicy:
+    """Collects the failing items in a dead letter sink instead of aborting
+    the run. The run is only aborted with TooManyErrors when the errors
+    exceed max_errors or, after min_items, max_error_rate.
+
+    Use it with barified(..., error_policy=policy), batchify or
+    transform_batch(..., error_policy=policy) and close it at the end.
+    The sink is only written by the process that owns the policy, the
+    workers of a process pool return the failures to it.
+
+    Parameters
+    ----------
+    sink : DeadLetterSink | Path | str, optional
+        Destination of the failing items, by default they are only counted
+    max_errors : int, optional
+        Errors allowed, by default unlimited
+    max_error_rate : float, optional
+        Share of errors allowed over the items processed, by default unlimited
+    min_items : int, optional
+        Items processed before max_error_rate is checked, by default 1000
+    placeholder : Any, optional
+        Result of the failing items in barified, by default None
+    """
+
+    def __init__(self, sink: Union[DeadLetterSink, Path, str, None] = None,
+                 max_errors: Optional[int] = None,
+                 max_error_rate: Optional[float] = None,
+                 min_items: int = 1000,
+                 placeholder: Any = None) -> None:
+        if sink is not None and not isinstance(sink, DeadLetterSink):
+            sink = dead_letter_sink(sink)
+
+        self.sink = sink
+        self.max_errors = max_errors
+        self.max_error_rate = max_error_rate
+        self.min_items = min_items
+        self.placeholder = placeholder
+
+        self.processed = 0
+        self.errors = 0
+        self._lock = Lock()
+
+    def __enter__(self) -> 'ErrorPolicy':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self.sink is not None:
+            self.sink.close()
+
+    def ok(self, size: int = 1):
+        """Counts items processed without errors"""
+        with self._lock:
+            self.processed += size
+
+    def record(self, failure: Failure, stage: str, label: Any = None):
+        """Writes a failing item to the sink
+
+        Parameters
+        ----------
+        failure : Failure
+            Item and its exception
+        stage : str
+            Where it failed, e.g. the function of barified
+        label : Any, optional
+            Index of the item in its batch
+
+        Raises
+        ------
+        TooManyErrors
+            If the errors exceed the limits
+        """
+        record = {
+            'at': datetime.now(timezone.utc).isoformat(),
+            'stage': stage,
+            'label': label,
+            'error': failure.error,
+            'message': failure.message,
+            'traceback': failure.traceback,
+            'item': to_jsonable(failure.item)
+        }
+
+        with self._lock:
+            self.processed += 1
+            self.errors += 1
+            if self.sink is not None:
+                self.sink.write(record)
+
+        METRICS.inc('da_dead_letters_total', stage=stage, error=failure.error)
+        log.warning(f"{stage} failed: {failure.error}: {failure.message}")
+
+        self.check()
+
+    def reject(self, rejected: Dict[Any, str], data, stage: str):
+        """Writes the rows rejected by a transform_batch to the sink
+
+        Parameters
+        ----------
+        rejected : Dict[Any, str]
+            Reason by label, e.g. ColumnarBatch.rejected
+        data : pd.DataFrame | pa.Table | ColumnarBatch
+            Rows of the batch, labeled as in rejected
+        stage : str
+            Where they were rejected, e.g. the builder
+        """
+        if not rejected:
+            return
+
+        frame = as_frame(data)
+        for label, reason in rejected.items():
+            item = frame.loc[label] if label in frame.index else None
+            self.record(Failure(item, 'Rejected', reason, ''), stage, label)
+
+    def check(self):
+        """Raises TooManyErrors if the errors exceed the limits"""
+        if self.max_errors is not None and self.errors > self.max_errors:
+            raise TooManyErrors(f"{self.errors} errors, the max is {self.max_errors}")
+
+        if self.max_error_rate is not None and self.processed >= self.min_items \
+                and self.errors > self.max_error_rate * self.processed:
+            raise TooManyErrors(f"{self.errors} errors in {self.processed} items, "
+                                f"the max rate is {self.max_error_rate}")
+
+    def stats(self) -> dict:
+        return {'processed': self.processed, 'errors': self.errors}
+
+
+class Retry:
+    """Repeats the calls that raise transient errors, waiting an
+    exponential backoff with jitter between the attempts. Use it only
+    with idempotent calls
+
+    Parameters
+    ----------
+    attempts : int, optional
+        Max calls, by default 3
+    backoff : float, optional
+        Seconds before the second call, doubled after every one, by default 0.5
+    max_backoff : float, optional
+        Max seconds between calls, by default 30
+    exceptions : Tuple[Type[BaseException]], optional
+        Transient errors, by default ConnectionError and TimeoutError
+    """
+
+    def __init__(self, attempts: int = 3, backoff: float = 0.5, max_backoff: float = 30,
+                 exceptions: Tuple[Type[BaseException], ...] = (ConnectionError, TimeoutError)
+                 ) -> None:
+        self.attempts = max(attempts, 1)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.exceptions = exceptions
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait after the failed attempt, 1 based"""
+        delay = min(self.backoff * 2 ** (attempt - 1), self.max_backoff)
+        # Jitter, so the workers that failed at once do not retry at once
+        return delay * random.uniform(0.5, 1)
+
+    def __call__(self, func: Callable, *args, **kwargs):
+        """Calls func(*args, **kwargs) until it does not raise a transient
+        error or there are no attempts left
+        """
+        for attempt in range(1, self.attempts + 1):
+            try:
+                return func(*args, **kwargs)
+            except self.exceptions as e:
+                if attempt == self.attempts:
+                    raise
+
+                name = getattr(func, '__qualname__', type(func).__name__)
+                METRICS.inc('da_retries_total', func=name, error=type(e).__name__)
+                log.warning(f"{name} failed with {type(e).__name__}: {e}, "
+                            f"retry {attempt} of {self.attempts - 1}")
+                time.sleep(self.delay(attempt))
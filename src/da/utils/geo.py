@@ -0,0 +1,176 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Remember to update the PYTHON_PATH to
+# export PYTHONPATH=`pwd`:`pwd`
+"""
+Coordinate stage of the batch path: validation, geometries and UTM over arrays
+"""
+from typing import Any, Dict, Tuple
+
+import numpy as np
+import shapely
+import utm
+
+from da.models.batch import reject
+from da.utils.log import get_logger
+
+log = get_logger(__name__)
+
+# Latitude bands of UTM, each one of 8 degrees from -80, X has 12
+ZONE_LETTERS = np.array([*'CDEFGHJKLMNPQRSTUVWXX'])
+
+
+def validate_coordinates(latitude: np.ndarray,
+                         longitude: np.ndarray,
+                         index: np.ndarray,
+                         rejected: Dict[Any, str],
+                         allow_nan: bool = False,
+                         fix_swapped: bool = False) -> Tuple[np.ndarray, np.ndarray]:
+    """Checks in bulk that the coordinates are inside ±90 and ±180.
+
+    A latitude out of range with a longitude that is a valid latitude is
+    reported as swapped, or swapped back with fix_swapped.
+
+    Parameters
+    ----------
+    latitude : np.ndarray
+        float latitudes
+    longitude : np.ndarray
+        float longitudes
+    index : np.ndarray
+        Labels of the rows
+    rejected : Dict[Any, str]
+        Rejected rows by label
+    allow_nan : bool, optional
+        Accepts NaN coordinates, by default False
+    fix_swapped : bool, optional
+        Swaps back the swapped coordinates instead of rejecting them, by default False
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        latitude and longitude, swapped back if needed
+    """
+    nan = np.isnan(latitude) | np.isnan(longitude)
+
+    with np.errstate(invalid='ignore'):
+        bad_latitude = np.abs(latitude) > 90
+        bad_longitude = np.abs(longitude) > 180
+        swapped = bad_latitude & ~bad_longitude & (np.abs(longitude) <= 90)
+
+    if fix_swapped and swapped.any():
+        latitude, longitude = latitude.copy(), longitude.copy()
+        latitude[swapped], longitude[swapped] = longitude[swapped], latitude[swapped]
+        bad_latitude = bad_latitude & ~swapped
+        swapped = np.zeros_like(swapped)
+
+    if not allow_nan:
+        for pos in np.flatnonzero(nan):
+            reject(rejected, index[pos], "coordinates: latitude and longitude must be numbers")
+
+    for pos in np.flatnonzero(swapped):
+        reject(rejected, index[pos],
+               f"coordinates: latitude {latitude[pos]} and longitude {longitude[pos]} look swapped")
+    for pos in np.flatnonzero(bad_latitude & ~swapped):
+        reject(rejected, index[pos], f"latitude: {latitude[pos]} is out of ±90")
+    for pos in np.flatnonzero(bad_longitude):
+        reject(rejected, index[pos], f"longitude: {longitude[pos]} is out of ±180")
+
+    return latitude, longitude
+
+
+def points(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """Creates all the Points with one call
+
+    Parameters
+    ----------
+    latitude : np.ndarray
+        float latitudes
+    longitude : np.ndarray
+        float longitudes
+
+    Returns
+    -------
+    np.ndarray
+        Array of shapely Points (x=longitude, y=latitude)
+    """
+    return shapely.points(longitude, latitude)
+
+
+def zone_numbers(latitude: np.ndarray, longitude: np.ndarray) -> np.ndarray:
+    """Vectorized utm.latlon_to_zone_number, with the Norway and Svalbard exceptions
+    """
+    with np.errstate(invalid='ignore'):
+        zones = np.floor((longitude + 180) / 6).astype(np.int64) % 60 + 1
+
+        norway = (latitude >= 56) & (latitude < 64) & (longitude >= 3) & (longitude < 12)
+        zones[norway] = 32
+
+        svalbard = (latitude >= 72) & (latitude <= 84) & (longitude >= 0) & (longitude < 42)
+        for low, high, zone in ((0, 9, 31), (9, 21, 33), (21, 33, 35), (33, 42, 37)):
+            zones[svalbard & (longitude >= low) & (longitude < high)] = zone
+
+    return zones
+
+
+def zone_letters(latitude: np.ndarray) -> np.ndarray:
+    """Vectorized utm.latitude_to_zone_letter, None out of -80 to 84
+    """
+    with np.errstate(invalid='ignore'):
+        valid = (latitude >= -80) & (latitude <= 84)
+        bands = np.clip(np.floor((latitude + 80) / 8), 0, 20)
+
+    letters = np.full(len(latitude), None, dtype=object)
+    letters[valid] = ZONE_LETTERS[bands[valid].astype(np.int64)]
+
+    return letters
+
+
+def to_utm(latitude: np.ndarray, longitude: np.ndarray) -> Dict[str, np.ndarray]:
+    """Converts the coordinates to UTM with one utm call per zone and hemisphere.
+    The coordinates out of the UTM latitudes (-80 to 84) are NaN
+
+    Parameters
+    ----------
+    latitude : np.ndarray
+        float latitudes
+    longitude : np.ndarray
+        float longitudes
+
+    Returns
+    -------
+    Dict[str, np.ndarray]
+        utmEasting, utmNorthing, utmZoneNumber and utmZoneLetter arrays.
+        The zone number is 0 when the coordinate cannot be converted
+    """
+    size = len(latitude)
+    easting = np.full(size, np.nan)
+    northing = np.full(size, np.nan)
+
+    letters = zone_letters(latitude)
+    with np.errstate(invalid='ignore'):
+        valid = (letters != None) & (np.abs(longitude) <= 180)  # noqa: E711
+
+    numbers = zone_numbers(latitude, longitude)
+    numbers[~valid] = 0
+
+    with np.errstate(invalid='ignore'):
+        northern = latitude >= 0
+    for zone in np.unique(numbers[valid]):
+        for north in (True, False):
+            mask = valid & (numbers == zone) & (northern == north)
+            if not mask.any():
+                continue
+
+            # The forced letter only tells utm the hemisphere
+            e, n, _, _ = utm.from_latlon(latitude[mask], longitude[mask],
+                                         force_zone_number=int(zone),
+                                         force_zone_letter='N' if north else 'M')
+            easting[mask], northing[mask] = e, n
+
+    return {
+        'utmEasting': easting,
+        'utmNorthing': northing,
+        'utmZoneNumber': numbers,
+        'utmZoneLetter': letters
+    }
@@ -1,8 +1,13 @@
 import os
 import sys
+import queue
+import atexit
 import logging
 import tempfile
 import platform
+import threading
+
+from logging.handlers import QueueHandler, QueueListener
 
 from dotenv import load_dotenv
 load_dotenv()
@@ -24,11 +29,156 @@ PATH = os.path.join(foldername, FILENAME)
 FORMAT = "%(asctime)s [%(name)-12s] [%(levelname)-5.5s]  %(message)s"
 DEFAULT_LEVEL = logging.INFO
 logFormatter = logging.Formatter(FORMAT)
-logging.basicConfig(stream=sys.stderr, format=FORMAT)
 
+# Writes the records from a background thread. LOG_ASYNC=0 writes them in the caller
+LOG_ASYNC = os.environ.get("LOG_ASYNC", "1").lower() not in ("0", "false", "no")
+
+# Limits the WARNING+ records per call site of the loggers of get_logger,
+# opt-in with LOG_RATE_LIMIT=1 or get_logger(..., rate_limit=True)
+LOG_RATE_LIMIT = os.environ.get("LOG_RATE_LIMIT", "0").lower() in ("1", "true", "yes")
+
+# Records per call site and interval (in seconds) before the repeated ones are
+# suppressed. LOG_RATE_BURST=0 disables the limit
+LOG_RATE_BURST = int(os.environ.get("LOG_RATE_BURST", 10))
+LOG_RATE_INTERVAL = float(os.environ.get("LOG_RATE_INTERVAL", 60))
+
+_lock = threading.Lock()
+# Handler attached to the loggers by destination
+_handlers = {}
+_listeners = []
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves the formatting to the listener thread. Only
+    the message is merged with its args, the traceback is formatted when
+    written
+    """
+
+    def prepare(self, record):
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+
+        return record
 
-def get_logger(name, path=PATH, level=DEFAULT_LEVEL):
-    """Return a logger with the specified name.
+
+class RateLimitFilter(logging.Filter):
+    """Lets through burst records per call site and interval. The rest are
+    counted and the next record that passes reports how many were
+    suppressed, so per row errors do not flood the logs
+
+    Parameters
+    ----------
+    burst : int, optional
+        Records per call site and interval, by default LOG_RATE_BURST
+    interval : float, optional
+        Seconds of the interval, by default LOG_RATE_INTERVAL
+    sample : int, optional
+        Also lets through one of every sample suppressed records, by default 0 (none)
+    min_level : int, optional
+        Records below the level are never limited, by default WARNING
+    """
+
+    def __init__(self, burst: int = LOG_RATE_BURST, interval: float = LOG_RATE_INTERVAL,
+                 sample: int = 0, min_level: int = logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.sample = sample
+        self.min_level = min_level
+
+        self._lock = threading.Lock()
+        # [start of the interval, records passed, records suppressed] by call site
+        self._sites = {}
+
+    def filter(self, record) -> bool:
+        if self.burst <= 0 or record.levelno < self.min_level:
+            return True
+
+        key = (record.name, record.pathname, record.lineno, record.levelno)
+
+        with self._lock:
+            site = self._sites.get(key)
+            if site is None or record.created - site[0] >= self.interval:
+                site = self._sites[key] = [record.created, 0, site[2] if site else 0]
+
+            if site[1] < self.burst:
+                site[1] += 1
+                suppressed, site[2] = site[2], 0
+            else:
+                site[2] += 1
+                if not self.sample or site[2] % self.sample:
+                    return False
+                suppressed, site[2] = site[2] - 1, 0
+
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+            record.args = None
+
+        return True
+
+
+RATE_LIMIT = RateLimitFilter()
+
+
+def _handler(key, factory):
+    """Handler of a destination, created once. With LOG_ASYNC it is a
+    DeferredQueueHandler whose listener writes to the handler of factory
+    """
+    with _lock:
+        handler = _handlers.get(key)
+        if handler is None:
+            target = factory()
+            target.setFormatter(logFormatter)
+
+            if LOG_ASYNC:
+                handler = DeferredQueueHandler(queue.SimpleQueue())
+                listener = QueueListener(handler.queue, target, respect_handler_level=True)
+                listener.start()
+                _listeners.append(listener)
+            else:
+                handler = target
+
+            _handlers[key] = handler
+
+        return handler
+
+
+def stop_listeners():
+    """Writes the queued records and stops the background threads. Called
+    at exit, before logging closes the handlers
+    """
+    with _lock:
+        while _listeners:
+            _listeners.pop().stop()
+
+
+def _restart_listeners():
+    # The threads do not survive a fork, the queues and the handlers do. The
+    # records queued before the fork are written by the parent
+    global _lock
+    _lock = threading.Lock()
+    for listener in _listeners:
+        while True:
+            try:
+                listener.queue.get_nowait()
+            except queue.Empty:
+                break
+        listener._thread = None
+        listener.start()
+
+
+atexit.register(stop_listeners)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listeners)
+
+if not logging.getLogger().handlers:
+    logging.basicConfig(handlers=[_handler('<stderr>', lambda: logging.StreamHandler(sys.stderr))])
+
+
+def get_logger(name, path=PATH, level=DEFAULT_LEVEL, rate_limit=None):
+    """Return a logger with the specified name. Calling it again for the
+    same name and path does not add handlers
 
     Parameters
     ----------
@@ -38,6 +188,9 @@ def get_logger(name, path=PATH, level=DEFAULT_LEVEL):
         Path of the file for logging (default is PATH)
     level : int or str, optional
         Logging level of this logger (default is DEFAULT_LEVEL)
+    rate_limit : bool, optional
+        Suppresses the repeated WARNING+ records of a call site with
+        RATE_LIMIT, False removes it (default is LOG_RATE_LIMIT)
 
     Returns
     -------
@@ -47,9 +200,33 @@ def get_logger(name, path=PATH, level=DEFAULT_LEVEL):
     logger = logging.getLogger(name)
     logger.setLevel(level)
 
-    filename = path
-    fileHandler = logging.FileHandler(filename, mode='a')
-    fileHandler.setFormatter(logFormatter)
-    logger.addHandler(fileHandler)
+    filename = os.path.abspath(path)
+    fileHandler = _handler(filename, lambda: logging.FileHandler(filename, mode='a'))
+    if fileHandler not in logger.handlers:
+        logger.addHandler(fileHandler)
+
+    if rate_limit or (rate_limit is None and LOG_RATE_LIMIT):
+        if RATE_LIMIT not in logger.filters:
+            logger.addFilter(RATE_LIMIT)
+    elif rate_limit is False:
+        logger.removeFilter(RATE_LIMIT)
+
+    return logger
 
-    return logger
\ No newline at end of file
+
+def log_exception(logger, message="Unhandled exception", level=logging.ERROR):
+    """logger.exception for the hot paths: nothing is built when the level
+    is disabled and the traceback is formatted by the listener thread
+
+    Parameters
+    ----------
+    logger : Logger
+        Logger of the caller
+    message : str, optional
+        Message of the record (default is "Unhandled exception")
+    level : int, optional
+        Level of the record (default is ERROR)
+    """
+    if logger.isEnabledFor(level):
+        # stacklevel reports the caller, the rate limit is per call site
+        logger.log(level, message, exc_info=True, stacklevel=2)
@@ -0,0 +1,349 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Remember to update the PYTHON_PATH to
+# export PYTHONPATH=`pwd`:`pwd`
+"""
+Counters and latency histograms of the pipeline stages. The metrics are
+disabled by default (DA_METRICS=1 or METRICS.enable()), then every call only
+checks METRICS.enabled.
+
+    from da.utils.metrics import METRICS
+
+    METRICS.enable()
+    with METRICS.timer('da_stage_seconds', stage='load'):
+        ...
+    METRICS.to_prometheus('metrics.prom')
+
+The process pools of barified and batchify send the metrics of their
+workers back to the parent, see drain and merge.
+"""
+import bisect
+import functools
+import json
+import math
+import os
+import time
+
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, Tuple, Union
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Upper bounds in seconds of the latency buckets, the last one is +Inf
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 60.0)
+
+
+def _key(name: str, labels: dict) -> Tuple[str, tuple]:
+    return name, tuple(sorted(labels.items()))
+
+
+def _format_labels(labels: tuple, extra: str = None) -> str:
+    parts = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    if extra is not None:
+        parts.append(extra)
+
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return '+Inf'
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Timer:
+    """Context manager that observes the seconds of its block in a histogram
+    """
+    __slots__ = ('metrics', 'name', 'labels', 'start', 'elapsed')
+
+    def __init__(self, metrics: 'Metrics', name: str, labels: dict) -> None:
+        self.metrics = metrics
+        self.name = name
+        self.labels = labels
+        self.start = None
+        self.elapsed = None
+
+    def __enter__(self) -> 'Timer':
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.metrics.observe(self.name, self.elapsed, **self.labels)
+
+
+class _NullTimer:
+    """Timer of the disabled metrics"""
+    __slots__ = ()
+    elapsed = None
+
+    def __enter__(self) -> '_NullTimer':
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+class Metrics:
+    """Registry of counters and histograms identified by name and labels.
+    The updates hold a lock, so the threads of a pool share one registry.
+    Processes have their own registry and send it with drain to the parent,
+    that adds it with merge.
+
+    Parameters
+    ----------
+    enabled : bool, optional
+        Records the updates, by default False
+    buckets : Tuple[float], optional
+        Upper bounds of the histograms, by default DEFAULT_BUCKETS
+    """
+
+    def __init__(self, enabled: bool = False, buckets: Tuple[float] = DEFAULT_BUCKETS) -> None:
+        self.enabled = enabled
+        self.buckets = tuple(sorted(buckets))
+
+        self._lock = Lock()
+        self._counters: Dict[tuple, float] = {}
+        # [count per bucket and +Inf, sum, min, max] by key
+        self._histograms: Dict[tuple, list] = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def inc(self, name: str, value: float = 1, **labels):
+        """Adds value to a counter
+
+        Parameters
+        ----------
+        name : str
+            Name of the counter, e.g. da_rows_total
+        value : float, optional
+            Increment, by default 1
+        labels : dict
+            Labels of the counter, e.g. status='rejected'
+        """
+        if not self.enabled:
+            return
+
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        """Adds a value, usually seconds, to a histogram
+
+        Parameters
+        ----------
+        name : str
+            Name of the histogram, e.g. da_transform_seconds
+        value : float
+            Observed value
+        labels : dict
+            Labels of the histogram
+        """
+        if not self.enabled:
+            return
+
+        key = _key(name, labels)
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1),
+                                                     0.0, math.inf, -math.inf]
+            histogram[0][position] += 1
+            histogram[1] += value
+            histogram[2] = min(histogram[2], value)
+            histogram[3] = max(histogram[3], value)
+
+    def timer(self, name: str, **labels) -> Union[Timer, _NullTimer]:
+        """Context manager that observes the seconds of its block
+
+        Parameters
+        ----------
+        name : str
+            Name of the histogram
+        labels : dict
+            Labels of the histogram
+
+        Returns
+        -------
+        Timer
+            Timer of the block, its elapsed seconds are kept after the block
+        """
+        if not self.enabled:
+            return NULL_TIMER
+
+        return Timer(self, name, labels)
+
+    def timed(self, name: str, **labels) -> Callable:
+        """Decorator that observes the seconds of every call. The calls that
+        raise are also counted in da_errors_total
+
+        Parameters
+        ----------
+        name : str
+            Name of the histogram
+        labels : dict
+            Labels of the histogram
+        """
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    self.inc('da_errors_total', metric=name, **labels)
+                    raise
+                finally:
+                    self.observe(name, time.perf_counter() - start, **labels)
+
+            return wrapper
+
+        return decorator
+
+    def _snapshot(self, counters: dict, histograms: dict) -> dict:
+        return {
+            'buckets': [*self.buckets],
+            'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                         for (name, labels), value in counters.items()],
+            'histograms': [{'name': name, 'labels': dict(labels), 'counts': [*counts],
+                            'count': sum(counts), 'sum': total,
+                            'min': low, 'max': high,
+                            'mean': total / sum(counts)}
+                           for (name, labels), (counts, total, low, high) in histograms.items()]
+        }
+
+    def snapshot(self) -> dict:
+        """Current values, serializable as JSON
+
+        Returns
+        -------
+        dict
+            buckets, counters and histograms, each one with its name and labels
+        """
+        with self._lock:
+            return self._snapshot(self._counters, self._histograms)
+
+    def drain(self) -> dict:
+        """snapshot and reset, e.g. to send the metrics of a worker
+        """
+        with self._lock:
+            counters, self._counters = self._counters, {}
+            histograms, self._histograms = self._histograms, {}
+
+        return self._snapshot(counters, histograms)
+
+    def merge(self, snapshot: dict):
+        """Adds the values of a snapshot, e.g. the drain of a worker. The
+        snapshot must use the same buckets
+
+        Parameters
+        ----------
+        snapshot : dict
+            Output of snapshot or drain
+        """
+        if snapshot is None:
+            return
+
+        if [*snapshot['buckets']] != [*self.buckets]:
+            raise ValueError("Cannot merge histograms with different buckets")
+
+        with self._lock:
+            for counter in snapshot['counters']:
+                key = _key(counter['name'], counter['labels'])
+                self._counters[key] = self._counters.get(key, 0) + counter['value']
+
+            for other in snapshot['histograms']:
+                key = _key(other['name'], other['labels'])
+                histogram = self._histograms.get(key)
+                if histogram is None:
+                    histogram = self._histograms[key] = [[0] * (len(self.buckets) + 1),
+                                                         0.0, math.inf, -math.inf]
+                histogram[0] = [a + b for a, b in zip(histogram[0], other['counts'])]
+                histogram[1] += other['sum']
+                histogram[2] = min(histogram[2], other['min'])
+                histogram[3] = max(histogram[3], other['max'])
+
+    def reset(self):
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+    def to_json(self, path: Union[Path, str] = None) -> str:
+        """snapshot as JSON, also written to path if given
+        """
+        text = json.dumps(self.snapshot(), indent=2)
+        if path is not None:
+            _write(path, text)
+
+        return text
+
+    def to_prometheus(self, path: Union[Path, str] = None) -> str:
+        """Values in the Prometheus text format, also written to path if
+        given, e.g. for the textfile collector of the node exporter
+
+        Returns
+        -------
+        str
+            Text of the metrics
+        """
+        snapshot = self.snapshot()
+        lines, types = [], set()
+
+        for counter in sorted(snapshot['counters'], key=lambda c: c['name']):
+            name = counter['name']
+            if name not in types:
+                types.add(name)
+                lines.append(f"# TYPE {name} counter")
+            labels = _format_labels(_key(name, counter['labels'])[1])
+            lines.append(f"{name}{labels} {_format_value(counter['value'])}")
+
+        for histogram in sorted(snapshot['histograms'], key=lambda h: h['name']):
+            name = histogram['name']
+            if name not in types:
+                types.add(name)
+                lines.append(f"# TYPE {name} histogram")
+
+            labels = _key(name, histogram['labels'])[1]
+            cumulative = 0
+            for bound, count in zip([*self.buckets, math.inf], histogram['counts']):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{name}_bucket{_format_labels(labels, le)} {cumulative}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(histogram['sum'])}")
+            lines.append(f"{name}_count{_format_labels(labels)} {histogram['count']}")
+
+        text = '\n'.join(lines) + '\n'
+        if path is not None:
+            _write(path, text)
+
+        return text
+
+
+def _write(path: Union[Path, str], text: str):
+    # Replaces the file at once, so the readers never see it half written
+    path = Path(path)
+    tmp = path.with_name(f".{path.name}.tmp")
+    tmp.write_text(text)
+    os.replace(tmp, path)
+
+
+METRICS = Metrics(enabled=os.environ.get("DA_METRICS", "0").lower() in ("1", "true", "yes"))
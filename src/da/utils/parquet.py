@@ -0,0 +1,359 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Remember to update the PYTHON_PATH to
+# export PYTHONPATH=`pwd`:`pwd`
+"""
+Streams the validated batches to Parquet with the schema of the models
+"""
+
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Union
+from urllib.parse import quote
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import shapely
+
+from da.models.batch import ColumnarBatch
+from da.utils.log import get_logger, log_exception
+
+log = get_logger(__name__)
+
+TIMESTAMP = pa.timestamp('us', tz='UTC')
+
+EVENT_FIELDS = [
+    pa.field('latitude', pa.float64(), nullable=False),
+    pa.field('longitude', pa.float64(), nullable=False),
+    pa.field('eventType', pa.string(), nullable=False),
+    pa.field('eventDate', TIMESTAMP),
+]
+
+# Columns added by the options of EventBuilder.transform_batch
+GEO_FIELDS = [
+    pa.field('coordinates', pa.binary()),
+    pa.field('utmEasting', pa.float64()),
+    pa.field('utmNorthing', pa.float64()),
+    pa.field('utmZoneNumber', pa.int64()),
+    pa.field('utmZoneLetter', pa.string()),
+]
+
+EVENT_SCHEMA = pa.schema([
+    pa.field('id', pa.string(), nullable=False),
+    *EVENT_FIELDS
+])
+
+OCCURRENCE_SCHEMA = pa.schema([
+    pa.field('id', pa.string(), nullable=False),
+    pa.field('occurrenceID', pa.string(), nullable=False),
+    pa.field('verbatimID', pa.string()),
+    pa.field('verbatimSource', pa.string(), nullable=False),
+    pa.field('eventID', pa.string(), nullable=False),
+    *EVENT_FIELDS
+])
+
+TAXON_SCHEMA = pa.schema([
+    pa.field('id', pa.string(), nullable=False),
+    *[pa.field(name, pa.string()) for name in ('kingdom', 'phylum', 'class_taxon', 'order',
+                                               'family', 'subfamily', 'genus', 'subgenus',
+                                               'species')],
+    pa.field('scientificName', pa.string(), nullable=False),
+    pa.field('canonicalName', pa.string(), nullable=False),
+    pa.field('verbatimID', pa.string()),
+    pa.field('verbatimSource', pa.string()),
+])
+
+SCHEMAS = {
+    'event': EVENT_SCHEMA,
+    'occurrence': OCCURRENCE_SCHEMA,
+    'taxon': TAXON_SCHEMA
+}
+
+# Partition columns derived from the data
+DERIVED_COLUMNS = {
+    'eventYear': lambda table: pc.year(table['eventDate']),
+}
+
+# Same name as Hive and Spark for the null partitions
+NULL_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+
+ROW_GROUP_SIZE = 128 * 1024
+
+# Files of the partitions kept open at once by the ParquetBatchWriter
+MAX_OPEN_FILES = 64
+
+
+def to_arrow(data, schema: pa.Schema) -> pa.Table:
+    """Converts a batch to a Table with the schema. The columns not in the
+    schema are dropped, except the GEO_FIELDS, and the missing nullable
+    columns are nulls
+
+    Parameters
+    ----------
+    data : ColumnarBatch | pa.Table | pd.DataFrame
+        Batch to convert
+    schema : pa.Schema
+        Schema of the output
+
+    Returns
+    -------
+    pa.Table
+        Batch with the schema
+
+    Raises
+    ------
+    KeyError
+        If a not nullable column is missing
+    """
+    if isinstance(data, ColumnarBatch):
+        columns = data.columns
+    elif isinstance(data, pd.DataFrame):
+        columns = {name: data[name].to_numpy() for name in data.columns}
+    elif isinstance(data, pa.Table):
+        columns = {name: data[name] for name in data.column_names}
+    else:
+        raise TypeError(f"Cannot write {type(data).__name__}")
+
+    size = len(data)
+    arrays = []
+    for field in schema:
+        column = columns.get(field.name)
+        if column is None:
+            if not field.nullable:
+                raise KeyError(f"Missing required column {field.name}")
+            arrays.append(pa.nulls(size, field.type))
+            continue
+
+        if isinstance(column, np.ndarray) and column.dtype == object and size \
+                and isinstance(column[0], shapely.Geometry):
+            column = shapely.to_wkb(column)
+
+        if isinstance(column, np.ndarray) and np.issubdtype(column.dtype, np.datetime64):
+            # Batch datetimes are naive UTC
+            column = pa.array(column.astype('datetime64[us]'), type=TIMESTAMP)
+        elif not isinstance(column, (pa.Array, pa.ChunkedArray)):
+            column = pa.array(column, from_pandas=True)
+
+        arrays.append(column if column.type == field.type else column.cast(field.type))
+
+    return pa.Table.from_arrays(arrays, schema=schema)
+
+
+def extend_schema(schema: pa.Schema, data) -> pa.Schema:
+    """Adds the GEO_FIELDS present in the batch to the schema
+    """
+    names = data.columns if isinstance(data, pd.DataFrame) else data.column_names
+    for field in GEO_FIELDS:
+        if field.name in names and field.name not in schema.names:
+            schema = schema.append(field)
+
+    return schema
+
+
+def partition_path(names: Sequence[str], values: Sequence) -> str:
+    """Hive style directories of one partition, e.g. verbatimSource=x/eventYear=2020
+    """
+    parts = []
+    for name, value in zip(names, values):
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            value = NULL_PARTITION
+        elif isinstance(value, float) and value.is_integer():
+            # Integer columns with nulls are read as floats by pandas
+            value = int(value)
+        parts.append(f"{name}={quote(str(value), safe='')}")
+
+    return '/'.join(parts)
+
+
+class ParquetBatchWriter:
+    """Writes batches to Parquet as they arrive. The rows are buffered per
+    partition until a row group is complete, so the memory is bounded by
+    row_group_size per open partition and never by the whole dataset.
+
+    Partitions use Hive style directories and their columns are not
+    stored in the files, e.g. read them back with
+    pyarrow.dataset.dataset(path, partitioning='hive').
+
+    At most max_open_files files are open at once. The least recently
+    written one is closed to open another, and if its partition comes
+    back it goes on in a new file, e.g. part-0-1.parquet.
+
+    Parameters
+    ----------
+    path : Path | str
+        Directory of the dataset, or the .parquet file without partitions
+    schema : pa.Schema | str
+        Schema of the files or the name of one in SCHEMAS
+    partition_by : Sequence[str], optional
+        Partition columns, they can be DERIVED_COLUMNS as eventYear
+    row_group_size : int, optional
+        Rows per row group, by default ROW_GROUP_SIZE
+    compression : str, optional
+        Parquet codec: snappy, gzip, brotli, lz4, zstd or none, by default zstd
+    compression_level : int, optional
+        Level of the codec, by default the codec default
+    basename : str, optional
+        Name of the files in every directory, by default part-0
+    max_open_files : int, optional
+        Files open at once, by default MAX_OPEN_FILES
+    """
+
+    def __init__(self, path: Union[Path, str],
+                 schema: Union[pa.Schema, str],
+                 partition_by: Optional[Sequence[str]] = None,
+                 row_group_size: int = ROW_GROUP_SIZE,
+                 compression: str = 'zstd',
+                 compression_level: Optional[int] = None,
+                 basename: str = 'part-0',
+                 max_open_files: int = MAX_OPEN_FILES) -> None:
+        if max_open_files < 1:
+            raise ValueError("max_open_files must be at least 1")
+
+        self.path = Path(path)
+        self.schema = SCHEMAS[schema] if isinstance(schema, str) else schema
+        self.partition_by = [*(partition_by or [])]
+        self.row_group_size = row_group_size
+        self.compression = compression
+        self.compression_level = compression_level
+        self.basename = basename
+        self.max_open_files = max_open_files
+
+        self._file_schema = None
+        # From the least recently written
+        self._writers: OrderedDict[str, pq.ParquetWriter] = OrderedDict()
+        # Files opened by partition, the closed ones included
+        self._parts: Dict[str, int] = {}
+        # Metadata of the closed files, with their actual row groups
+        self._metadata: List[pq.FileMetaData] = []
+        self._buffers: Dict[str, List[pa.Table]] = {}
+        self._buffered: Dict[str, int] = {}
+        self._stats = {'rows': 0, 'row_groups': 0, 'files': 0}
+        # Files written, in the order they were opened
+        self.files: List[Path] = []
+
+    def __enter__(self) -> 'ParquetBatchWriter':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _file(self, partition: str, part: int = 0) -> Path:
+        # The single file is never reopened, it is the only one
+        if not self.partition_by and self.path.suffix == '.parquet':
+            return self.path
+
+        name = self.basename if part == 0 else f"{self.basename}-{part}"
+
+        return self.path / partition / f"{name}.parquet"
+
+    def _open(self, partition: str) -> pq.ParquetWriter:
+        while len(self._writers) >= self.max_open_files:
+            self._writers.popitem(last=False)[1].close()
+
+        part = self._parts.get(partition, 0)
+        self._parts[partition] = part + 1
+
+        file = self._file(partition, part)
+        file.parent.mkdir(parents=True, exist_ok=True)
+        writer = self._writers[partition] = pq.ParquetWriter(
+            file, self._file_schema,
+            compression=self.compression,
+            compression_level=self.compression_level,
+            metadata_collector=self._metadata)
+        self._stats['files'] += 1
+        self.files.append(file)
+
+        return writer
+
+    def _flush(self, partition: str):
+        buffers = self._buffers.pop(partition, [])
+        self._buffered.pop(partition, None)
+        if not buffers:
+            return
+
+        writer = self._writers.get(partition)
+        if writer is None:
+            writer = self._open(partition)
+        else:
+            self._writers.move_to_end(partition)
+
+        writer.write_table(pa.concat_tables(buffers), row_group_size=self.row_group_size)
+
+    def _append(self, partition: str, table: pa.Table):
+        self._buffers.setdefault(partition, []).append(table)
+        self._buffered[partition] = self._buffered.get(partition, 0) + table.num_rows
+
+        if self._buffered[partition] >= self.row_group_size:
+            self._flush(partition)
+
+    def write(self, data):
+        """Writes a batch
+
+        Parameters
+        ----------
+        data : ColumnarBatch | pa.Table | pd.DataFrame
+            Accepted rows of a batch
+        """
+        try:
+            if len(data) == 0:
+                return
+
+            if self._file_schema is None:
+                self.schema = extend_schema(self.schema, data)
+
+            table = to_arrow(data, self.schema)
+            self._stats['rows'] += table.num_rows
+
+            if not self.partition_by:
+                self._file_schema = self.schema
+                self._append('', table)
+                return
+
+            keys = {}
+            for name in self.partition_by:
+                if name in table.column_names:
+                    keys[name] = table[name]
+                elif name in DERIVED_COLUMNS:
+                    keys[name] = DERIVED_COLUMNS[name](table)
+                else:
+                    raise KeyError(f"Unknown partition column {name}")
+
+            table = table.select([n for n in table.column_names if n not in self.partition_by])
+            self._file_schema = table.schema
+
+            groups = pa.table(keys).to_pandas().groupby(self.partition_by, dropna=False,
+                                                        sort=False).indices
+            for values, positions in groups.items():
+                values = values if isinstance(values, tuple) else (values,)
+                self._append(partition_path(self.partition_by, values), table.take(positions))
+
+        except Exception:
+            log_exception(log, "ParquetBatchWriter.write failed")
+            raise
+
+    def close(self) -> dict:
+        """Writes the buffered rows and closes the files
+
+        Returns
+        -------
+        dict
+            Rows, row groups and files written. The row groups are the
+            ones in the metadata of the files
+        """
+        try:
+            for partition in [*self._buffers]:
+                self._flush(partition)
+
+            for writer in self._writers.values():
+                writer.close()
+
+            self._writers = OrderedDict()
+            self._stats['row_groups'] = sum(m.num_row_groups for m in self._metadata)
+
+            return dict(self._stats)
+        except Exception:
+            log_exception(log, "ParquetBatchWriter.close failed")
+            raise
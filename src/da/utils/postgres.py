@@ -0,0 +1,256 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Remember to update the PYTHON_PATH to
+# export PYTHONPATH=`pwd`:`pwd`
+"""
+Bulk loader of the validated batches into the PostgreSQL schema of
+da_postgres.sql. The batches are COPYed to the staging tables and merged
+with the set-based merge_* functions, one round-trip per table.
+"""
+import io
+import os
+
+from pathlib import Path
+from typing import Dict, NamedTuple
+
+import pandas as pd
+
+from dotenv import load_dotenv
+
+from da.models.batch import ColumnarBatch, as_frame
+from da.utils.log import get_logger, log_exception
+
+load_dotenv()
+
+log = get_logger(__name__)
+
+try:
+    import psycopg
+except ImportError:
+    psycopg = None
+
+SCHEMA_FILE = Path(__file__).parent.parent / "models" / "da_postgres.sql"
+
+# Staging columns and the batch column of each one
+STAGE_TAXA = {
+    'taxon_id': 'id',
+    'verbatim_source': 'verbatimSource',
+    'verbatim_id': 'verbatimID',
+    'kingdom': 'kingdom',
+    'phylum': 'phylum',
+    'class_taxon': 'class_taxon',
+    '"order"': 'order',
+    'family': 'family',
+    'subfamily': 'subfamily',
+    'genus': 'genus',
+    'subgenus': 'subgenus',
+    'species': 'species',
+    'scientific_name': 'scientificName',
+    'canonical_name': 'canonicalName',
+}
+
+STAGE_EVENTS = {
+    'event_id': 'id',
+    'longitude': 'longitude',
+    'latitude': 'latitude',
+    'event_type': 'eventType',
+    'event_date': 'eventDate',
+}
+
+# The Events of the Occurrence batches, whose id is the one of the Occurrence
+STAGE_OCCURRENCE_EVENTS = {**STAGE_EVENTS, 'event_id': 'eventID'}
+
+STAGE_OCCURRENCES = {
+    'occurrence_id': 'occurrenceID',
+    'verbatim_source': 'verbatimSource',
+    'verbatim_id': 'verbatimID',
+    'event_id': 'eventID',
+}
+
+
+class LoadReport(NamedTuple):
+    """Result of merging one staged batch"""
+    staged: int
+    inserted: int
+    updated: int
+    skipped: int
+
+
+def to_copy_csv(data, columns: Dict[str, str]) -> bytes:
+    """Serializes the batch columns as the CSV read by COPY. Missing values
+    are empty, which COPY reads as NULL
+
+    Parameters
+    ----------
+    data : ColumnarBatch | pd.DataFrame | pa.Table
+        Batch to serialize
+    columns : Dict[str, str]
+        Staging column by batch column
+
+    Returns
+    -------
+    bytes
+        CSV without header
+    """
+    if isinstance(data, ColumnarBatch):
+        frame = pd.DataFrame({stage: data.columns.get(name) for stage, name in columns.items()})
+    else:
+        frame = as_frame(data)
+        frame = pd.DataFrame({stage: frame[name] if name in frame else None
+                              for stage, name in columns.items()})
+
+    buffer = io.StringIO()
+    frame.to_csv(buffer, header=False, index=False, date_format='%Y-%m-%d %H:%M:%S.%f')
+
+    return buffer.getvalue().encode()
+
+
+def has_column(data, name: str) -> bool:
+    if isinstance(data, ColumnarBatch):
+        return name in data.columns
+
+    return name in as_frame(data)
+
+
+class PostgresLoader:
+    """Loads the batches with COPY and the merge_* functions. The staging
+    tables are temporary, so loaders in different sessions do not collide.
+
+    Parameters
+    ----------
+    connection : str, optional
+        Connection string, by default DA_DB_CONNECTION
+    conn : psycopg.Connection, optional
+        Connection to use, it is not closed by close()
+    """
+
+    def __init__(self, connection: str = None, conn=None) -> None:
+        if conn is None:
+            if psycopg is None:
+                raise ImportError("PostgresLoader needs psycopg, install da[postgres]")
+
+            if connection is None:
+                connection = os.environ.get("DA_DB_CONNECTION")
+            conn = psycopg.connect(connection)
+            self._owns_conn = True
+        else:
+            self._owns_conn = False
+
+        self.conn = conn
+        self._staging = False
+
+    def __enter__(self) -> 'PostgresLoader':
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._owns_conn:
+            self._owns_conn = False
+            self.conn.close()
+
+    def install_schema(self, schema_file: Path = SCHEMA_FILE):
+        """Creates the tables and functions of da_postgres.sql
+        """
+        try:
+            with self.conn.cursor() as cursor:
+                cursor.execute(Path(schema_file).read_text())
+            self.conn.commit()
+        except Exception:
+            self.conn.rollback()
+            log_exception(log, "PostgresLoader.install_schema failed")
+            raise
+
+    def _load(self, table: str, columns: Dict[str, str], merge: str, data) -> LoadReport:
+        """COPYs the batch to the staging table and merges it in the same
+        transaction
+        """
+        try:
+            payload = to_copy_csv(data, columns)
+
+            with self.conn.cursor() as cursor:
+                # Creates the staging tables once per session, then only empties them
+                if not self._staging:
+                    cursor.execute("SELECT public.create_staging_tables()")
+                    self._staging = True
+                else:
+                    cursor.execute(f"TRUNCATE {table}")
+
+                with cursor.copy(f"COPY {table} ({', '.join(columns)}) "
+                                 "FROM STDIN WITH (FORMAT csv)") as copy:
+                    copy.write(payload)
+
+                cursor.execute(f"SELECT inserted, updated, skipped FROM public.{merge}()")
+                inserted, updated, skipped = cursor.fetchone()
+
+            self.conn.commit()
+
+            report = LoadReport(len(data), inserted, updated, skipped)
+            log.info(f"{merge}: {report}")
+
+            return report
+        except Exception:
+            self.conn.rollback()
+            # The rollback also drops the staging tables created in the transaction
+            self._staging = False
+            log_exception(log, "PostgresLoader._load failed")
+            raise
+
+    def load_taxa(self, taxa) -> LoadReport:
+        """Registers the verbatim ids and merges the taxa. Taxa whose
+        (verbatimSource, verbatimID) is already registered keep its id
+
+        Parameters
+        ----------
+        taxa : ColumnarBatch | pd.DataFrame | pa.Table
+            Taxa, e.g. TaxonRegistry.to_batch()
+
+        Returns
+        -------
+        LoadReport
+            Rows staged, inserted, updated and skipped
+        """
+        return self._load('stage_taxa', STAGE_TAXA, 'merge_taxa', taxa)
+
+    def load_events(self, events) -> LoadReport:
+        """Merges the Events. The id column is id, as in
+        EventRegistry.to_batch(), or eventID, as in Event.dict()
+
+        Parameters
+        ----------
+        events : ColumnarBatch | pd.DataFrame | pa.Table
+            Events
+
+        Returns
+        -------
+        LoadReport
+            Rows staged, inserted, updated and skipped
+        """
+        columns = STAGE_EVENTS
+        if not has_column(events, 'id') and has_column(events, 'eventID'):
+            columns = STAGE_OCCURRENCE_EVENTS
+
+        return self._load('stage_events', columns, 'merge_raw_events', events)
+
+    def load_occurrences(self, occurrences) -> Dict[str, LoadReport]:
+        """Merges the Events of the Occurrences and then the Occurrences.
+        The taxa must be loaded first, the Occurrences of unknown taxa
+        are skipped
+
+        Parameters
+        ----------
+        occurrences : ColumnarBatch | pd.DataFrame | pa.Table
+            Output of OccurrenceBuilder.transform_batch
+
+        Returns
+        -------
+        Dict[str, LoadReport]
+            Report of the events and of the occurrences
+        """
+        return {
+            'events': self._load('stage_events', STAGE_OCCURRENCE_EVENTS,
+                                 'merge_raw_events', occurrences),
+            'occurrences': self._load('stage_occurrences', STAGE_OCCURRENCES,
+                                      'merge_raw_occurrences', occurrences)
+        }
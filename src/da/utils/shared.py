@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+# Remember to update the PYTHON_PATH to
+# export PYTHONPATH=`pwd`:`pwd`
+"""
+Tables shared by the processes of a pool without copying them per task
+"""
+import sys
+
+from multiprocessing import shared_memory
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from da.utils.log import get_logger, log_exception
+
+log = get_logger(__name__)
+
+# Shared memory blocks attached by this process, by name
+_ATTACHED = {}
+
+
+def to_table(data) -> pa.Table:
+    """Converts the supported data to an arrow Table
+
+    Parameters
+    ----------
+    data : pa.Table | pd.DataFrame | ColumnarBatch | dict
+        Data to share
+
+    Returns
+    -------
+    pa.Table
+        Same data as Table
+    """
+    if isinstance(data, pa.Table):
+        return data
+    if isinstance(data, pd.DataFrame):
+        return pa.Table.from_pandas(data, preserve_index=False)
+    if hasattr(data, 'to_arrow'):
+        return data.to_arrow()
+    if isinstance(data, dict):
+        return pa.table(data)
+
+    raise TypeError(f"Cannot share {type(data).__name__}, use a DataFrame or an arrow Table")
+
+
+class SharedTable:
+    """Arrow table written once in shared memory. The instance is only a
+    descriptor, it is pickled to the workers without the data, and each
+    worker maps the same memory. Fixed width columns (floats, ints,
+    datetimes) are read as numpy views without copies.
+
+    Use SharedTable.create in the parent and unlink when the work is done.
+
+    Parameters
+    ----------
+    name : str
+        Name of the shared memory block
+    num_rows : int
+        Number of rows of the table
+    """
+
+    def __init__(self, name: str, num_rows: int) -> None:
+        self.name = name
+        self.num_rows = num_rows
+        self._shm = None
+
+    @classmethod
+    def create(cls, data) -> 'SharedTable':
+        """Writes the data in a new shared memory block
+
+        Parameters
+        ----------
+        data : pa.Table | pd.DataFrame | ColumnarBatch | dict
+            Data to share
+
+        Returns
+        -------
+        SharedTable
+            Owner of the block
+        """
+        try:
+            table = to_table(data)
+
+            # The size of the IPC stream is known before allocating the block
+            mock = pa.MockOutputStream()
+            with pa.ipc.new_stream(mock, table.schema) as writer:
+                writer.write_table(table)
+
+            shm = shared_memory.SharedMemory(create=True, size=max(mock.size(), 1))
+            stream = pa.FixedSizeBufferWriter(pa.py_buffer(shm.buf))
+            with pa.ipc.new_stream(stream, table.schema) as writer:
+                writer.write_table(table)
+            stream.close()
+
+            shared = cls(shm.name, table.num_rows)
+            shared._shm = shm
+
+            return shared
+        except Exception:
+            log_exception(log, "SharedTable.create failed")
+            raise
+
+    def __getstate__(self) -> dict:
+        return {'name': self.name, 'num_rows': self.num_rows}
+
+    def __setstate__(self, state: dict):
+        self.__init__(state['name'], state['num_rows'])
+
+    def __len__(self) -> int:
+        return self.num_rows
+
+    def table(self) -> pa.Table:
+        """Table mapped from the shared memory, without copies. The block is
+        attached once per process
+
+        Returns
+        -------
+        pa.Table
+            The shared table
+        """
+        attached = _ATTACHED.get(self.name)
+        if attached is None:
+            if sys.version_info >= (3, 13):
+                shm = shared_memory.SharedMemory(name=self.name, track=False)
+            else:
+                shm = shared_memory.SharedMemory(name=self.name)
+
+            table = pa.ipc.open_stream(pa.py_buffer(shm.buf)).read_all()
+            attached = _ATTACHED[self.name] = (shm, table)
+
+        return attached[1]
+
+    def column(self, name: str, start: int = 0, end: Optional[int] = None) -> np.ndarray:
+        """Rows [start, end) of a column. Fixed width columns without nulls
+        are numpy views over the shared memory
+
+        Parameters
+        ----------
+        name : str
+            Name of the column
+        start : int, optional
+            First row, by default 0
+        end : int, optional
+            Last row (excluded), by default the end of the table
+
+        Returns
+        -------
+        np.ndarray
+            Values of the column
+        """
+        end = self.num_rows if end is None else min(end, self.num_rows)
+        column = self.table().column(name).slice(start, max(end - start, 0))
+
+        return column.to_numpy(zero_copy_only=False)
+
+    def __getitem__(self, key):
+        """data[start:end] returns the rows as a DataFrame, as the
+        batchify functions expect. data[name] returns a whole column
+        """
+        if isinstance(key, str):
+            return self.column(key)
+        if not isinstance(key, slice) or key.step not in (None, 1):
+            raise TypeError("SharedTable only supports column names and contiguous slices")
+
+        start, end, _ = key.indices(self.num_rows)
+        table = self.table().slice(start, max(end - start, 0))
+        frame = table.to_pandas(split_blocks=True)
+        frame.index = pd.RangeIndex(start, start + len(frame))
+
+        return frame
+
+    def unlink(self):
+        """Releases the block. Only the owner created with create can unlink it
+        """
+        if self._shm is None:
+            raise RuntimeError("Only the SharedTable returned by create can be unlinked")
+
+        # The parent may have read the table too, e.g. with the thread backend
+        _ATTACHED.pop(self.name, None)
+
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
@@ -4,15 +4,23 @@
 # export PYTHONPATH=`pwd`:`pwd`
 
 import argparse
-import traceback
+import uuid
 
+import numpy as np
 import pandas as pd
 
-from da.models.occurrence import EventBuilder as EB, OccurrenceBuilder as OB
-from da.models.taxon import TaxonBuilder as TB
+from da.models.batch import reject
+from da.models.ids import CONTENT_NAMESPACE, ContentHashStrategy
+from da.models.occurrence import EventRegistry, OccurrenceBuilder as OB
+from da.models.taxon import TaxonBuilder as TB, TaxonRegistry
+from da.utils.checkpoint import ChunkManifest, fingerprint
+from da.utils.errors import ErrorPolicy
+from da.utils.parquet import ParquetBatchWriter
 
+from contextlib import ExitStack, contextmanager
 from pathlib import Path
-from da.utils.log import get_logger
+from typing import Any, Dict, Tuple
+from da.utils.log import get_logger, log_exception
 
 log = get_logger(__name__)
 
@@ -26,9 +34,11 @@ def sample_conversion(sample_file: Path):
         df = df[~df.verbatim_id.isnull()]
         df['eventDate'] = df['eventDate'].fillna('')
 
-        taxa = []
+        # Every distinct (verbatimSource, verbatimID) is validated once
+        registry = TaxonRegistry()
+        # And every distinct place, date and type
+        events = EventRegistry()
         occurrences = []
-        events = []
 
         # Simplest scenario
         for _, row in df.iterrows():
@@ -38,7 +48,7 @@ def sample_conversion(sample_file: Path):
                 'longitude': row.longitude,
                 'eventDate': row.eventDate
             }
-            event = EB.transform(tmp_event)
+            event = events.intern(tmp_event)
 
             tmp_occurrence = {
                 'occurrenceID': int(row.occurrence_id),
@@ -66,14 +76,392 @@ def sample_conversion(sample_file: Path):
                 'verbatimSource': row.verbatim_source
             }
 
-            taxon = TB.transform(tmp_taxon)
-            taxa.append(taxon)
+            registry.intern(tmp_taxon)
 
-        return occurrences, taxa
+        log.info(f"Taxa registry: {registry.stats()}")
+        log.info(f"Events registry: {events.stats()}")
+
+        return occurrences, registry.taxa(), events.events()
+
+    except Exception:
+        log_exception(log, "sample_conversion failed")
+        raise
+
+
+OCCURRENCE_COLUMNS = {
+    'occurrence_id': 'occurrenceID',
+    'verbatim_id': 'verbatimID',
+    'verbatim_source': 'verbatimSource',
+}
+
+TAXON_COLUMNS = {
+    'scientific_name': 'scientificName',
+    'verbatim_id': 'verbatimID',
+    'verbatim_source': 'verbatimSource',
+}
+
+
+# Declared types of the sample columns, so every chunk gets the same
+# ones. Coordinates are read as text to reject the bad values per row
+SAMPLE_DTYPES = {
+    # Read as text, see prepare_sample
+    'occurrence_id': str,
+    'verbatim_id': str,
+    'verbatim_source': str,
+    'latitude': str,
+    'longitude': str,
+    'eventDate': str,
+    **{name: str for name in ('kingdom', 'phylum', 'class_taxon', 'order', 'family',
+                              'subfamily', 'genus', 'subgenus', 'species',
+                              'scientific_name', 'canonicalName')}
+}
+
+CHUNK_SIZE = 100_000
+
+# Max Events kept by the EventRegistry of the streaming conversion, the
+# least recently used ones are written and evicted
+EVENT_REGISTRY_SIZE = 1_000_000
+
+MANIFEST = "manifest.json"
+
+# Bumped when the conversion changes its output, so the old checkpoints are not reused
+CONVERSION_VERSION = 2
+
+# Integer columns of the sample, coerced per row
+ID_COLUMNS = ('occurrence_id', 'verbatim_id')
+
+
+@contextmanager
+def content_ids():
+    """Ids derived from the content of the rows within the block, so a
+    resumed conversion writes the same ids as a clean one. The Event ids
+    already are, they come from the EventRegistry keys
+    """
+    occurrence_ids = ContentHashStrategy(('verbatimSource', 'occurrenceID'),
+                                         namespace=uuid.uuid5(CONTENT_NAMESPACE, 'occurrence'))
+    # The taxa without verbatimSource are hashed by the verbatimID alone, it is
+    # mandatory, instead of getting a random id
+    taxon_ids = ContentHashStrategy(fallback=ContentHashStrategy(
+        ('verbatimID',), namespace=uuid.uuid5(CONTENT_NAMESPACE, 'taxon')))
+
+    with OB.Model.id_strategy(occurrence_ids), TB.Model.id_strategy(taxon_ids):
+        yield
+
+
+def prepare_sample(df: pd.DataFrame) -> Tuple[pd.DataFrame, Dict[Any, str]]:
+    """Coerces the ID_COLUMNS of a chunk to integers. The rows with a
+    missing or non integer id, e.g. VerbatimID that is mandatory, are
+    left out instead of failing the whole chunk
+
+    Returns
+    -------
+    Tuple[pd.DataFrame, Dict[Any, str]]
+        Valid rows and the rejected ones with the reason
+    """
+    rejected = {}
+    valid = np.ones(len(df), dtype=bool)
+    ids = {}
+
+    for name in ID_COLUMNS:
+        ids[name] = pd.to_numeric(df[name], errors='coerce')
+        invalid = valid & ~(ids[name].notna() & (ids[name] % 1 == 0)).to_numpy()
+
+        for label, value in zip(df.index[invalid], df[name].to_numpy()[invalid]):
+            reject(rejected, label, f"{name}: missing" if pd.isna(value) else
+                   f"{name}: {value!r} is not an integer")
+        valid &= ~invalid
+
+    df = df[valid].copy()
+    df['eventDate'] = df['eventDate'].fillna('')
+    for name in ID_COLUMNS:
+        df[name] = ids[name][valid].astype('int64')
+
+    return df, rejected
+
+
+def sample_taxa(df: pd.DataFrame) -> pd.DataFrame:
+    """Taxon columns of a prepared chunk, named as the TaxonBuilder.Model fields
+    """
+    taxon_fields = [*TB.Model.__fields__]
+    taxa = df.rename(columns=TAXON_COLUMNS)
+
+    return taxa[[c for c in taxon_fields if c in taxa]]
+
+
+def convert_sample_chunk(df: pd.DataFrame, registry: TaxonRegistry,
+                         error_policy: ErrorPolicy = None,
+                         event_registry: EventRegistry = None):
+    """Transforms a chunk of the sample, its taxa are interned in the registry
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Chunk of the sample
+    registry : TaxonRegistry
+        Taxa of the whole sample
+    error_policy : ErrorPolicy, optional
+        Writes the rejected rows to its dead letter sink instead of the log
+    event_registry : EventRegistry, optional
+        Events of the whole sample, by default one Event per occurrence
+
+    Returns
+    -------
+    Tuple[ColumnarBatch, dict]
+        Occurrences and the rejected rows of the chunk
+    """
+    raw = df
+    df, ids_rejected = prepare_sample(raw)
+
+    occurrences = OB.transform_batch(df.rename(columns=OCCURRENCE_COLUMNS),
+                                     event_registry=event_registry,
+                                     error_policy=error_policy)
+
+    taxa = sample_taxa(df)
+    _, taxa_rejected = registry.intern_batch(taxa)
+
+    rejected = {**ids_rejected, **occurrences.rejected, **taxa_rejected}
+    if error_policy is not None:
+        error_policy.reject(ids_rejected, raw, 'prepare_sample')
+        error_policy.reject(taxa_rejected, taxa, 'TaxonRegistry')
+    else:
+        for label, reason in rejected.items():
+            log.warning(f"Row {label} rejected: {reason}")
+
+    return occurrences, rejected
+
+
+def sample_batch_conversion(sample_file: Path):
+    """Same as sample_conversion but the whole file is transformed
+    as a batch instead of row by row
+    """
+    try:
+        df = pd.read_csv(sample_file, dtype=SAMPLE_DTYPES)
+
+        registry = TaxonRegistry()
+        events = EventRegistry()
+        occurrences, _ = convert_sample_chunk(df, registry, event_registry=events)
+        log.info(f"Taxa registry: {registry.stats()}")
+        log.info(f"Events registry: {events.stats()}")
+
+        return occurrences, registry.to_batch(), events.to_batch()
+
+    except Exception:
+        log_exception(log, "sample_batch_conversion failed")
+        raise
+
+
+class EventsOutput:
+    """Events file of the streaming conversion, written as the EventRegistry
+    evicts them and at the end
+    """
+
+    def __init__(self, dest_path: Path, output_format: str, compression: str = 'zstd') -> None:
+        self.file = dest_path / f"events.{output_format}"
+        self.file.unlink(missing_ok=True)
+        self.writer = None
+        if output_format == 'parquet':
+            self.writer = ParquetBatchWriter(self.file, 'event', compression=compression)
+        self.rows = 0
+
+    def write(self, events):
+        if len(events) == 0:
+            return
+
+        if self.writer is not None:
+            self.writer.write(events)
+        else:
+            events.to_pandas().to_csv(self.file, mode='a', header=self.rows == 0, index=False)
+        self.rows += len(events)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+def write_chunk(occurrences, dest_path: Path, chunk: int, output_format: str,
+                partition_by: list = None, compression: str = 'zstd') -> list:
+    """Writes the occurrences of one chunk to their own files, so a chunk
+    can be written again without touching the rest
+
+    Returns
+    -------
+    list
+        Files written
+    """
+    out_path = dest_path / "occurrences"
+    basename = f"chunk-{chunk:05d}"
+
+    # Leftovers of a run that died while writing the chunk, with the
+    # extra parts of the partitions reopened by the writer
+    for pattern in (f"**/{basename}.*", f"**/{basename}-*.parquet"):
+        for stale in out_path.glob(pattern):
+            stale.unlink()
+
+    if output_format == 'parquet':
+        with ParquetBatchWriter(out_path, 'occurrence', partition_by=partition_by,
+                                compression=compression, basename=basename) as writer:
+            writer.write(occurrences)
+
+        return writer.files
+
+    out_path.mkdir(parents=True, exist_ok=True)
+    file = out_path / f"{basename}.csv"
+    occurrences.to_pandas().to_csv(file)
+
+    return [file]
+
+
+def sample_streaming_conversion(sample_file: Path, dest_path: Path,
+                                chunk_size: int = CHUNK_SIZE,
+                                output_format: str = 'csv',
+                                partition_by: list = None,
+                                compression: str = 'zstd',
+                                dead_letter: Path = None,
+                                max_errors: int = None,
+                                resume: bool = False) -> dict:
+    """Reads, transforms and writes the sample chunk by chunk, so the memory
+    depends on chunk_size and not on the size of the file. The taxa are
+    deduplicated across the chunks and written at the end. The Events are
+    deduplicated by an EventRegistry and written as it evicts them
+
+    With resume every chunk is written to its own files and recorded in
+    the MANIFEST of dest_path. A rerun skips the chunks whose content and
+    files did not change, and the ids are derived from the content, so
+    the output is the same as the one of a clean run.
+
+    Parameters
+    ----------
+    sample_file : Path
+        Sample to convert
+    dest_path : Path
+        Destination of the csv or parquet files
+    chunk_size : int, optional
+        Rows per chunk, by default CHUNK_SIZE
+    output_format : str, optional
+        csv or parquet, by default csv
+    partition_by : list, optional
+        Partition columns of the parquet occurrences
+    compression : str, optional
+        Parquet compression codec, by default zstd
+    dead_letter : Path, optional
+        .jsonl or .parquet file of the rejected rows, by default they are logged
+    max_errors : int, optional
+        Rejected rows before aborting the conversion, by default unlimited
+    resume : bool, optional
+        Checkpoints every chunk and skips the ones already converted, by default False
+
+    Returns
+    -------
+    dict
+        Rows read, occurrences written, rows rejected, chunks and chunks skipped
+    """
+    error_policy = None
+    if dead_letter is not None or max_errors is not None:
+        error_policy = ErrorPolicy(dead_letter, max_errors=max_errors)
+
+    # Restores the id strategies of the models at the end
+    scope = ExitStack()
+    try:
+        registry = TaxonRegistry()
+        stats = {'rows': 0, 'occurrences': 0, 'rejected': 0, 'chunks': 0, 'skipped': 0}
+
+        evicted = []
+        event_registry = EventRegistry(max_size=EVENT_REGISTRY_SIZE, on_evict=evicted.extend)
+        events_output = EventsOutput(dest_path, output_format, compression)
+
+        manifest = None
+        if resume:
+            scope.enter_context(content_ids())
+            manifest = ChunkManifest(dest_path / MANIFEST, config={
+                'version': CONVERSION_VERSION,
+                'chunk_size': chunk_size,
+                'output_format': output_format,
+                'partition_by': partition_by,
+                'compression': compression
+            })
+        elif output_format == 'parquet':
+            writer = ParquetBatchWriter(dest_path / "occurrences", 'occurrence',
+                                        partition_by=partition_by,
+                                        compression=compression)
+        else:
+            occurrences_file = dest_path / "occurrences.csv"
+            occurrences_file.unlink(missing_ok=True)
+
+        reader = pd.read_csv(sample_file, dtype=SAMPLE_DTYPES, chunksize=chunk_size)
+        with reader:
+            for chunk in reader:
+                n = stats['chunks']
+                stats['rows'] += len(chunk)
+                stats['chunks'] += 1
+
+                if manifest is not None:
+                    chunk_fingerprint = fingerprint(chunk)
+                    if manifest.is_done(n, chunk_fingerprint):
+                        # The taxa and Events of every chunk are needed for their files,
+                        # the Events only of the valid Occurrences as in transform_batch
+                        prepared, _ = prepare_sample(chunk)
+                        registry.intern_batch(sample_taxa(prepared))
+                        events = prepared.rename(columns=OCCURRENCE_COLUMNS)
+                        _, invalid = OB.validate_batch(events)
+                        events = events[~events.index.isin([*invalid])]
+                        event_registry.transform_batch(events.drop(columns=['id'], errors='ignore'))
+                        events_output.write(EventRegistry.to_columns(evicted))
+                        evicted.clear()
+
+                        entry = manifest.entry(n)
+                        stats['occurrences'] += entry['occurrences']
+                        stats['rejected'] += entry['rejected']
+                        stats['skipped'] += 1
+                        continue
+
+                    manifest.invalidate(n)
+
+                occurrences, rejected = convert_sample_chunk(chunk, registry, error_policy,
+                                                             event_registry)
+                stats['occurrences'] += len(occurrences)
+                stats['rejected'] += len(rejected)
+
+                events_output.write(EventRegistry.to_columns(evicted))
+                evicted.clear()
+
+                if manifest is not None:
+                    files = write_chunk(occurrences, dest_path, n, output_format,
+                                        partition_by, compression)
+                    manifest.done(n, chunk_fingerprint, files,
+                                  occurrences=len(occurrences), rejected=len(rejected))
+                elif output_format == 'parquet':
+                    writer.write(occurrences)
+                else:
+                    occurrences.to_pandas().to_csv(occurrences_file, mode='a',
+                                                   header=n == 0)
+
+        if manifest is not None:
+            manifest.prune(stats['chunks'])
+        elif output_format == 'parquet':
+            writer.close()
+
+        if output_format == 'parquet':
+            with ParquetBatchWriter(dest_path / "taxa.parquet", 'taxon',
+                                    compression=compression) as taxa_writer:
+                taxa_writer.write(registry.to_batch())
+        else:
+            registry.to_batch().to_pandas().to_csv(dest_path / "taxa.csv")
+
+        events_output.write(event_registry.to_batch())
+        events_output.close()
+
+        log.info(f"Taxa registry: {registry.stats()}")
+        log.info(f"Events registry: {event_registry.stats()}")
+
+        return stats
 
     except Exception:
-        log.exception(traceback.print_exc())
+        log_exception(log, "sample_streaming_conversion failed")
         raise
+    finally:
+        scope.close()
+        if error_policy is not None:
+            error_policy.close()
 
 
 if __name__ == '__main__':
@@ -85,9 +473,37 @@ if __name__ == '__main__':
     parser.add_argument('-dp', '--dest_path',
                         help='Destination path for the pipeline assets',
                         required=True)
+    parser.add_argument('-b', '--batch',
+                        help='Transform the sample as a columnar batch',
+                        action='store_true')
+    parser.add_argument('-f', '--format',
+                        help='Output format of the batch and streaming conversions',
+                        choices=['csv', 'parquet'], default='csv')
+    parser.add_argument('-pb', '--partition_by',
+                        help='Partition columns of the parquet occurrences, e.g. verbatimSource eventYear',
+                        nargs='*', default=None)
+    parser.add_argument('-c', '--compression',
+                        help='Parquet compression codec',
+                        default='zstd')
+    parser.add_argument('-cs', '--chunk_size',
+                        help='Streams the sample in chunks of this number of rows',
+                        type=int, default=None)
+    parser.add_argument('-dl', '--dead_letter',
+                        help='.jsonl or .parquet file of the rejected rows of the streaming conversion',
+                        default=None)
+    parser.add_argument('-me', '--max_errors',
+                        help='Rejected rows before aborting the streaming conversion',
+                        type=int, default=None)
+    parser.add_argument('-r', '--resume',
+                        help='Checkpoints the streaming conversion and skips the chunks already converted',
+                        action='store_true')
 
     ARGS = parser.parse_args()
 
+    if ARGS.format == 'parquet' and not (ARGS.batch or ARGS.chunk_size):
+        parser.error('--format parquet needs --batch or --chunk_size, '
+                     'the row by row conversion only writes csv')
+
     sample_file = Path(ARGS.sample_file)
     dest_path = Path(ARGS.dest_path)
 
@@ -98,16 +514,53 @@ if __name__ == '__main__':
         log.warning('Destination path does not exist. Making ...')
         dest_path.mkdir(parents=True)
 
-    occurrences, taxa = sample_conversion(sample_file=sample_file)
     csv_path = (dest_path / "csv")
-
-    csv_path.mkdir(exist_ok=True, parents=True)
-
-    occurrences = [*map(lambda x: x.dict(), occurrences)]
-    taxa = [*map(lambda x: x.dict(), taxa)]
+    parquet_path = (dest_path / "parquet")
 
     # RUN sample vía docker
     # docker run -it --rm -v /PATH/TO/HOST:/home/sources -v /PATH/TO/HOST:/home/results da python examples -sf /home/sources/file_name.csv -dp /home/results
 
-    pd.DataFrame(occurrences).to_csv(csv_path / "occurrences.csv")
-    pd.DataFrame(taxa).to_csv(csv_path / "taxa.csv")
+    if ARGS.chunk_size:
+        out_path = parquet_path if ARGS.format == 'parquet' else csv_path
+        out_path.mkdir(exist_ok=True, parents=True)
+
+        stats = sample_streaming_conversion(sample_file, out_path,
+                                            chunk_size=ARGS.chunk_size,
+                                            output_format=ARGS.format,
+                                            partition_by=ARGS.partition_by,
+                                            compression=ARGS.compression,
+                                            dead_letter=ARGS.dead_letter,
+                                            max_errors=ARGS.max_errors,
+                                            resume=ARGS.resume)
+        log.info(f"Streaming conversion: {stats}")
+    elif ARGS.batch and ARGS.format == 'parquet':
+        occurrences, taxa, events = sample_batch_conversion(sample_file=sample_file)
+
+        with ParquetBatchWriter(parquet_path / "occurrences", 'occurrence',
+                                partition_by=ARGS.partition_by,
+                                compression=ARGS.compression) as writer:
+            writer.write(occurrences)
+        with ParquetBatchWriter(parquet_path / "taxa.parquet", 'taxon',
+                                compression=ARGS.compression) as writer:
+            writer.write(taxa)
+        with ParquetBatchWriter(parquet_path / "events.parquet", 'event',
+                                compression=ARGS.compression) as writer:
+            writer.write(events)
+    elif ARGS.batch:
+        csv_path.mkdir(exist_ok=True, parents=True)
+        occurrences, taxa, events = sample_batch_conversion(sample_file=sample_file)
+
+        occurrences.to_pandas().to_csv(csv_path / "occurrences.csv")
+        taxa.to_pandas().to_csv(csv_path / "taxa.csv")
+        events.to_pandas().to_csv(csv_path / "events.csv", index=False)
+    else:
+        csv_path.mkdir(exist_ok=True, parents=True)
+        occurrences, taxa, events = sample_conversion(sample_file=sample_file)
+
+        occurrences = [*map(lambda x: x.dict(), occurrences)]
+        taxa = [*map(lambda x: x.dict(), taxa)]
+        events = [*map(lambda x: x.dict(), events)]
+
+        pd.DataFrame(occurrences).to_csv(csv_path / "occurrences.csv")
+        pd.DataFrame(taxa).to_csv(csv_path / "taxa.csv")
+        pd.DataFrame(events).to_csv(csv_path / "events.csv", index=False)
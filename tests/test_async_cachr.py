@@ -0,0 +1,182 @@
+"""
+AsyncCachr against a mongomock collection wrapped as an asyncio client
+"""
+import asyncio
+
+import mongomock
+import pytest
+
+from da.utils.async_cachr import AsyncCachr
+from da.utils.cachr import FrontCache
+
+
+class FakeCursor:
+    def __init__(self, collection, cursor):
+        self._collection = collection
+        self._cursor = cursor
+        self._docs = None
+
+    def limit(self, limit):
+        self._cursor = self._cursor.limit(limit)
+        return self
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._docs is None:
+            await self._collection.enter()
+            try:
+                self._docs = iter([*self._cursor])
+            finally:
+                self._collection.leave()
+
+        try:
+            return next(self._docs)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class FakeCollection:
+    """Async facade of a mongomock collection that records the operations
+    in flight
+    """
+
+    def __init__(self, collection, delay=0.01):
+        self._collection = collection
+        self.delay = delay
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def enter(self):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        # Gives the other tasks the chance to start their operations
+        await asyncio.sleep(self.delay)
+
+    def leave(self):
+        self.in_flight -= 1
+
+    async def _call(self, name, *args, **kwargs):
+        await self.enter()
+        try:
+            return getattr(self._collection, name)(*args, **kwargs)
+        finally:
+            self.leave()
+
+    async def create_index(self, *args, **kwargs):
+        return await self._call('create_index', *args, **kwargs)
+
+    async def update_one(self, *args, **kwargs):
+        return await self._call('update_one', *args, **kwargs)
+
+    async def bulk_write(self, *args, **kwargs):
+        return await self._call('bulk_write', *args, **kwargs)
+
+    def find(self, *args, **kwargs):
+        return FakeCursor(self, self._collection.find(*args, **kwargs))
+
+
+class FakeDatabase:
+    def __init__(self, database):
+        self._database = database
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self._database[name])
+        return self._collections[name]
+
+
+class FakeAsyncClient:
+    def __init__(self):
+        self._client = mongomock.MongoClient()
+        self._databases = {}
+        self.closed = False
+
+    def __getitem__(self, name):
+        if name not in self._databases:
+            self._databases[name] = FakeDatabase(self._client[name])
+        return self._databases[name]
+
+    async def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def client():
+    return FakeAsyncClient()
+
+
+def test_cach_and_is_cachd(client):
+    cachr = AsyncCachr('test', client=client)
+
+    async def run():
+        await cachr.cach('a', {'value': 1})
+        return await cachr.is_cachd('a'), await cachr.is_cachd('missing')
+
+    found, missing = asyncio.run(run())
+
+    assert found['document_id'] == 'a'
+    assert found['document'] == {'value': 1}
+    assert missing is None
+
+
+def test_get_many(client):
+    cachr = AsyncCachr('test', client=client)
+    items = {f'ep/{i}': {'value': i} for i in range(25)}
+
+    async def run():
+        written = await cachr.cach_many(items, bulk_size=10)
+        return written, await cachr.get_many([*items, 'ep/missing'], bulk_size=7)
+
+    written, docs = asyncio.run(run())
+
+    assert written == 25
+    assert set(docs) == set(items)
+    assert all(docs[ep]['document'] == data for ep, data in items.items())
+
+
+def test_get_many_with_front_cache(client):
+    cachr = AsyncCachr('test', client=client, front_cache=FrontCache())
+
+    async def run():
+        await cachr.cach('a', {'value': 1})
+        return await cachr.get_many(['a', 'b'])
+
+    docs = asyncio.run(run())
+
+    assert [*docs] == ['a']
+    assert cachr.front_cache.get(('test', 'b')) == (True, None)
+
+
+def test_concurrency_limit(client):
+    cachr = AsyncCachr('test', client=client, max_concurrency=3)
+    collection = cachr.cachr_collection
+    eps = [f'ep/{i}' for i in range(20)]
+
+    async def run():
+        await cachr.cach_many({ep: {} for ep in eps}, bulk_size=1)
+        collection.max_in_flight = 0
+        await cachr.is_cachd_many(eps)
+
+    asyncio.run(run())
+
+    assert collection.max_in_flight == 3
+
+
+def test_used_in_several_loops(client):
+    # Built outside the loops, as a module level or CLI instance
+    cachr = AsyncCachr('test', client=client, max_concurrency=2)
+
+    asyncio.run(cachr.cach('a', {'value': 1}))
+    doc = asyncio.run(cachr.is_cachd('a'))
+
+    assert doc['document'] == {'value': 1}
+
+
+def test_close_only_owned_clients(client):
+    cachr = AsyncCachr('test', client=client)
+    asyncio.run(cachr.close())
+
+    assert not client.closed
@@ -0,0 +1,54 @@
+"""
+Options of barified, iter_barified and batchify
+"""
+import pytest
+
+from da.utils.commons import AdaptiveScheduler, barified, batchify, iter_barified
+
+
+
+def keys(x, **kwargs):
+    return sorted(kwargs)
+
+
+@pytest.mark.parametrize('backend', ['threads', 'processes'])
+def test_barified_keeps_the_executor_options(backend):
+    res = barified(keys, [1, 2, 3], backend=backend, chunksize=1, max_workers=2,
+                   hide_bar=True, extra='x')
+
+    assert res == [['extra', 'hide_bar', 'max_workers']] * 3
+
+
+@pytest.mark.parametrize('backend', ['threads', 'processes'])
+def test_iter_barified_keeps_the_executor_options(backend):
+    res = iter_barified(keys, [1, 2, 3], backend=backend, max_in_flight=2, ordered=False,
+                        max_workers=2, hide_bar=True)
+
+    assert [*res] == [['hide_bar', 'max_workers']] * 3
+
+
+def test_barified_stream_keeps_the_executor_options():
+    res = barified(keys, [1, 2], stream=True, backend='threads', max_workers=2, hide_bar=True)
+
+    assert [*res] == [['hide_bar', 'max_workers']] * 2
+
+
+def batch_keys(ixs, data, **kwargs):
+    return [sorted(kwargs)]
+
+
+@pytest.mark.parametrize('backend', ['threads', 'processes'])
+def test_batchify_keeps_the_options_out_of_func(backend):
+    res = batchify(batch_keys, [*range(10)], backend=backend, adaptive=True,
+                   max_workers=2, hide_bar=True)
+
+    assert res and all(x == ['hide_bar', 'max_workers'] for x in res)
+
+
+def test_batchify_keeps_the_scheduler_in_the_parent():
+    scheduler = AdaptiveScheduler(initial_batch_size=2)
+    res = batchify(batch_keys, [*range(10)], backend='processes', scheduler=scheduler,
+                   max_workers=2, hide_bar=True)
+
+    assert all(x == ['hide_bar', 'max_workers'] for x in res)
+    assert sum(timing.size for timing in scheduler.stats) == 10
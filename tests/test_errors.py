@@ -0,0 +1,48 @@
+"""
+Dead letter sinks of the ErrorPolicy
+"""
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from da.utils.errors import DeadLetterSink, ErrorPolicy, Failure, JSONLSink, to_jsonable
+
+
+def test_sink_is_abstract():
+    with pytest.raises(TypeError):
+        DeadLetterSink()
+
+
+def test_to_jsonable_missing_values():
+    item = pd.Series({'a': np.nan, 'b': pd.NA, 'c': pd.NaT, 'd': None, 'e': 1.5,
+                      'f': [np.nan, 'x'], 'g': pd.Timestamp('2020-01-01')})
+
+    assert to_jsonable(item) == {'a': None, 'b': None, 'c': None, 'd': None, 'e': 1.5,
+                                 'f': [None, 'x'], 'g': '2020-01-01 00:00:00'}
+
+
+def test_jsonl_sink_writes_valid_json(tmp_path):
+    path = tmp_path / 'rejected.jsonl'
+    frame = pd.DataFrame({'name': ['a', 'b'], 'subfamily': [np.nan, 'x']})
+
+    with ErrorPolicy(JSONLSink(path)) as policy:
+        policy.reject({0: 'bad row'}, frame, 'test')
+        policy.record(Failure.of(frame.loc[1], ValueError('boom')), 'test', 1)
+
+    lines = path.read_text().splitlines()
+    # Strict parsers reject NaN
+    records = [json.loads(line, parse_constant=lambda c: pytest.fail(c)) for line in lines]
+
+    assert records[0]['item'] == {'name': 'a', 'subfamily': None}
+    assert records[1]['error'] == 'ValueError'
+    assert policy.stats() == {'processed': 2, 'errors': 2}
+
+
+def test_max_errors():
+    policy = ErrorPolicy(max_errors=1)
+    policy.record(Failure(1, 'ValueError', 'first', ''), 'test')
+
+    with pytest.raises(Exception, match='2 errors'):
+        policy.record(Failure(2, 'ValueError', 'second', ''), 'test')
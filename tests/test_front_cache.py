@@ -0,0 +1,44 @@
+"""
+FrontCache copies
+"""
+from datetime import datetime
+
+from da.utils.cachr import FrontCache
+
+
+def document():
+    return {'document_id': 'ep', 'updated_at': datetime.now(),
+            'document': {'name': 'a', 'tags': ['x']}}
+
+
+def test_get_returns_a_copy_of_the_nested_document():
+    cache = FrontCache()
+    cache.put('ep', document())
+
+    _, doc = cache.get('ep')
+    doc['document']['name'] = 'changed'
+    doc['document']['tags'].append('y')
+
+    _, doc = cache.get('ep')
+    assert doc['document'] == {'name': 'a', 'tags': ['x']}
+
+
+def test_put_keeps_a_copy_of_the_nested_document():
+    cache = FrontCache()
+    doc = document()
+    cache.put('ep', doc)
+
+    doc['document']['name'] = 'changed'
+
+    _, cached = cache.get('ep')
+    assert cached['document']['name'] == 'a'
+
+
+def test_missing_and_expired():
+    cache = FrontCache(ttl=0)
+    cache.put('ep', document())
+    cache.put_missing('missing')
+
+    assert cache.get('ep') == (False, None)
+    assert cache.get('missing') == (True, None)
+    assert cache.get('unknown') == (False, None)
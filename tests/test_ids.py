@@ -0,0 +1,91 @@
+"""
+ID strategies
+"""
+import uuid
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from da.models.basic import IDiedModel
+from da.models.ids import ContentHashStrategy, UUID4Strategy, UUID7Strategy
+
+
+class Model(IDiedModel):
+    verbatimID: str = None
+    verbatimSource: str = None
+
+
+class Child(Model):
+    pass
+
+
+def test_uuid7_is_monotonic():
+    strategy = UUID7Strategy()
+
+    # More ids than the 12 bits counter, so it borrows the next milliseconds
+    ids = [*strategy.create_many(10_000), *(strategy.create() for _ in range(100)),
+           *strategy.create_many(5_000)]
+
+    assert ids == sorted(ids)
+    assert len(set(ids)) == len(ids)
+    assert all(uuid.UUID(i).version == 7 for i in ids)
+
+
+def test_content_ids_are_deterministic():
+    columns = {'verbatimSource': ['gbif', 'gbif', 'inat'], 'verbatimID': [10.0, '11', 10]}
+
+    ids = ContentHashStrategy().create_many(3, columns)
+
+    assert ids == ContentHashStrategy().create_many(3, columns)
+    assert ids == [ContentHashStrategy().create({'verbatimSource': source, 'verbatimID': vid})
+                   for source, vid in zip(*columns.values())]
+    # 10.0 is read by pandas from an integer column with missing values
+    assert ids[0] == ContentHashStrategy().create({'verbatimSource': 'gbif', 'verbatimID': 10})
+    assert len(set(ids)) == 3
+
+
+@pytest.mark.parametrize('missing', [None, np.nan, pd.NA, pd.NaT])
+def test_content_ids_fall_back_on_missing_values(missing):
+    strategy = ContentHashStrategy()
+
+    single = strategy.create({'verbatimSource': 'gbif', 'verbatimID': missing})
+    many = strategy.create_many(2, {'verbatimSource': ['gbif', 'gbif'],
+                                    'verbatimID': [missing, missing]})
+
+    # Every missing record gets its own fallback id
+    assert len({single, *many}) == 3
+    assert all(uuid.UUID(i).version == 7 for i in (single, *many))
+
+
+def test_id_strategy_is_scoped():
+    with Model.id_strategy('content') as strategy:
+        assert isinstance(strategy, ContentHashStrategy)
+        assert Model.__ID_STRATEGY__ is strategy
+        assert Child.__ID_STRATEGY__ is strategy
+        assert Model(verbatimSource='gbif', verbatimID='1').id == \
+            strategy.create({'verbatimSource': 'gbif', 'verbatimID': '1'})
+
+        with Child.id_strategy('uuid7'):
+            assert isinstance(Child.__ID_STRATEGY__, UUID7Strategy)
+            assert Model.__ID_STRATEGY__ is strategy
+
+        assert Child.__ID_STRATEGY__ is strategy
+
+    # The inherited strategy again, not a copy of it
+    assert '__ID_STRATEGY__' not in Model.__dict__
+    assert Model.__ID_STRATEGY__ is IDiedModel.__ID_STRATEGY__
+    assert isinstance(Model.__ID_STRATEGY__, UUID4Strategy)
+
+
+def test_id_strategy_is_restored_on_errors():
+    Model.use_id_strategy('uuid7')
+    previous = Model.__ID_STRATEGY__
+    try:
+        with pytest.raises(RuntimeError):
+            with Model.id_strategy('content'):
+                raise RuntimeError()
+
+        assert Model.__ID_STRATEGY__ is previous
+    finally:
+        del Model.__ID_STRATEGY__
@@ -0,0 +1,59 @@
+"""
+ParquetBatchWriter row groups and open files
+"""
+import pandas as pd
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from da.utils.parquet import ParquetBatchWriter
+
+
+def events(start, size, source=None):
+    frame = pd.DataFrame({
+        'id': [f"e{i}" for i in range(start, start + size)],
+        'latitude': [float(i) for i in range(size)],
+        'longitude': [float(-i) for i in range(size)],
+        'eventType': 'Catalog',
+    })
+    if source is not None:
+        frame['eventType'] = source
+
+    return frame
+
+
+def test_row_groups_are_read_from_the_files(tmp_path):
+    writer = ParquetBatchWriter(tmp_path / "events.parquet", 'event', row_group_size=100)
+    for start in range(0, 350, 70):
+        writer.write(events(start, 70))
+
+    stats = writer.close()
+
+    metadata = pq.ParquetFile(tmp_path / "events.parquet").metadata
+    assert stats['rows'] == metadata.num_rows == 350
+    assert stats['row_groups'] == metadata.num_row_groups
+
+
+def test_open_files_are_capped(tmp_path):
+    writer = ParquetBatchWriter(tmp_path / "events", 'event', partition_by=['eventType'],
+                                row_group_size=10, max_open_files=2)
+
+    sources = ['a', 'b', 'c', 'a', 'b', 'c', 'a']
+    for n, source in enumerate(sources):
+        writer.write(events(10 * n, 10, source))
+        assert len(writer._writers) <= 2
+
+    stats = writer.close()
+
+    # The partitions closed to open another go on in new files
+    names = sorted(str(f.relative_to(tmp_path / "events")) for f in writer.files)
+    assert names == ['eventType=a/part-0-1.parquet', 'eventType=a/part-0-2.parquet',
+                     'eventType=a/part-0.parquet', 'eventType=b/part-0-1.parquet',
+                     'eventType=b/part-0.parquet', 'eventType=c/part-0-1.parquet',
+                     'eventType=c/part-0.parquet']
+    assert stats['files'] == len(names)
+    assert stats['row_groups'] == sum(pq.ParquetFile(f).metadata.num_row_groups
+                                      for f in writer.files)
+
+    table = ds.dataset(tmp_path / "events", partitioning='hive').to_table()
+    assert sorted(table['id'].to_pylist()) == sorted(f"e{i}" for i in range(70))
+    assert table.filter(ds.field('eventType') == 'a').num_rows == 30
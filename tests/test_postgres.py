@@ -0,0 +1,153 @@
+"""
+PostgresLoader against a fake connection that records the COPY payloads
+"""
+import csv
+import io
+
+import pandas as pd
+import pytest
+
+from da.models.occurrence import EventRegistry, OccurrenceBuilder as OB
+from da.models.taxon import TaxonRegistry
+from da.utils.postgres import PostgresLoader
+
+
+class FakeCopy:
+    def __init__(self, cursor, statement):
+        self.cursor = cursor
+        self.statement = statement
+        self.data = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cursor.conn.copies.append((self.statement, self.data))
+
+    def write(self, data):
+        self.data += data
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+    def execute(self, statement):
+        self.conn.statements.append(statement)
+
+    def copy(self, statement):
+        return FakeCopy(self, statement)
+
+    def fetchone(self):
+        statement, data = self.conn.copies[-1]
+        return len(data.splitlines()), 0, 0
+
+
+class FakeConnection:
+    def __init__(self):
+        self.statements = []
+        self.copies = []
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+def staged(copy):
+    """Columns of the COPY statement and its rows as dicts"""
+    statement, data = copy
+    columns = statement.split('(', 1)[1].split(')', 1)[0].split(', ')
+    rows = [*csv.reader(io.StringIO(data.decode()))]
+
+    return columns, [dict(zip(columns, row)) for row in rows]
+
+
+@pytest.fixture
+def sample():
+    return pd.DataFrame({
+        'occurrenceID': ['1', '2', '3'],
+        'verbatimID': ['10', '10', '11'],
+        'verbatimSource': ['gbif', 'gbif', 'gbif'],
+        'latitude': [10.5, 10.5, 11.0],
+        'longitude': [20.5, 20.5, 21.0],
+        'eventDate': ['2020-01-01', '2020-01-01', '2020-01-02'],
+        'scientificName': ['A b', 'A b', 'C d'],
+        'canonicalName': ['A b', 'A b', 'C d'],
+    })
+
+
+def test_load_taxa(sample):
+    conn = FakeConnection()
+    registry = TaxonRegistry()
+    registry.intern_batch(sample)
+
+    report = PostgresLoader(conn=conn).load_taxa(registry.to_batch())
+
+    columns, rows = staged(conn.copies[0])
+    assert conn.copies[0][0].startswith('COPY stage_taxa (taxon_id, verbatim_source')
+    assert '"order"' in columns
+    assert [row['verbatim_id'] for row in rows] == ['10', '11']
+    assert [row['taxon_id'] for row in rows] == [taxon.id for taxon in registry.taxa()]
+    assert [row['scientific_name'] for row in rows] == ['A b', 'C d']
+    assert rows[0]['kingdom'] == ''
+    assert report.staged == 2
+    assert conn.statements[0] == 'SELECT public.create_staging_tables()'
+
+
+def test_load_events(sample):
+    conn = FakeConnection()
+    registry = EventRegistry()
+    registry.transform_batch(sample)
+    events = registry.to_batch()
+
+    PostgresLoader(conn=conn).load_events(events)
+
+    columns, rows = staged(conn.copies[0])
+    assert columns == ['event_id', 'longitude', 'latitude', 'event_type', 'event_date']
+    assert [row['event_id'] for row in rows] == [*events['id']]
+    assert all(row['event_id'] for row in rows)
+    assert rows[0]['latitude'] == '10.5'
+    assert rows[0]['event_date'] == '2020-01-01 00:00:00.000000'
+
+
+def test_load_events_of_dicts(sample):
+    conn = FakeConnection()
+    event = EventRegistry().intern(sample.iloc[0].to_dict())
+
+    PostgresLoader(conn=conn).load_events(pd.DataFrame([event.dict()]))
+
+    _, rows = staged(conn.copies[0])
+    assert rows[0]['event_id'] == event.id
+
+
+def test_load_occurrences(sample):
+    conn = FakeConnection()
+    registry = EventRegistry()
+    occurrences = OB.transform_batch(sample, event_registry=registry)
+
+    reports = PostgresLoader(conn=conn).load_occurrences(occurrences)
+
+    (_, events), (columns, rows) = staged(conn.copies[0]), staged(conn.copies[1])
+    assert conn.copies[0][0].startswith('COPY stage_events')
+    assert conn.copies[1][0].startswith('COPY stage_occurrences')
+    # The Events are the ones of the Occurrences, not their ids
+    assert [row['event_id'] for row in events] == [*occurrences['eventID']]
+    assert columns == ['occurrence_id', 'verbatim_source', 'verbatim_id', 'event_id']
+    assert [row['occurrence_id'] for row in rows] == ['1', '2', '3']
+    assert [row['event_id'] for row in rows] == [*occurrences['eventID']]
+    assert rows[0]['event_id'] == rows[1]['event_id'] != rows[2]['event_id']
+    assert reports['occurrences'].staged == 3
+    assert conn.statements[-1] == 'SELECT inserted, updated, skipped FROM public.merge_raw_occurrences()'
+    assert 'TRUNCATE stage_occurrences' in conn.statements
@@ -0,0 +1,77 @@
+"""
+Resume of the streaming conversion
+"""
+import hashlib
+
+import pandas as pd
+import pytest
+
+from examples import sample_conversion as sc
+
+
+CHUNK_SIZE = 10
+
+
+@pytest.fixture
+def sample(tmp_path):
+    rows = []
+    for i in range(55):
+        rows.append({
+            'kingdom': f"Kingdom{i % 2}", 'phylum': 'Phylum0', 'class_taxon': 'Class0',
+            'order': f"Order{i % 3}", 'family': f"Family{i % 4}", 'genus': f"Genus{i % 5}",
+            'species': f"Genus{i % 5} sp{i % 7}", 'scientific_name': f"Genus{i % 5} sp{i % 7} L.",
+            'canonicalName': f"Genus{i % 5} sp{i % 7}",
+            'verbatim_source': 'gbif' if i % 2 else 'inat', 'verbatim_id': i % 7,
+            'occurrence_id': i,
+            # Repeated places and dates, so the Events are shared across the chunks
+            'latitude': 10 + i % 6, 'longitude': -20 - i % 4,
+            'eventDate': '' if i % 9 == 0 else f"2020-01-{1 + i % 5:02d}",
+        })
+    frame = pd.DataFrame(rows).astype(str)
+    frame.loc[13, 'latitude'] = 'bad'
+    frame.loc[27, 'occurrence_id'] = 'x'
+    # Rejected by the OccurrenceBuilder, with a valid Event of its own
+    frame.loc[34, ['verbatim_source', 'latitude']] = [None, '-45']
+
+    file = tmp_path / "sample.csv"
+    frame.to_csv(file, index=False)
+
+    return file
+
+
+def digest(path):
+    return {str(f.relative_to(path)): hashlib.md5(f.read_bytes()).hexdigest()
+            for f in sorted(path.rglob('*')) if f.is_file() and f.name != sc.MANIFEST}
+
+
+@pytest.mark.parametrize('output_format', ['csv', 'parquet'])
+def test_resume_after_an_interruption(sample, tmp_path, monkeypatch, output_format):
+    # Evicts Events while converting
+    monkeypatch.setattr(sc, 'EVENT_REGISTRY_SIZE', 8)
+    convert = dict(chunk_size=CHUNK_SIZE, output_format=output_format, resume=True)
+
+    clean = tmp_path / "clean"
+    clean.mkdir()
+    clean_stats = sc.sample_streaming_conversion(sample, clean, **convert)
+
+    # Dies while writing the chunk 3
+    resumed = tmp_path / "resumed"
+    resumed.mkdir()
+    write_chunk = sc.write_chunk
+
+    def interrupted(occurrences, dest_path, chunk, *args):
+        if chunk == 3:
+            raise KeyboardInterrupt()
+        return write_chunk(occurrences, dest_path, chunk, *args)
+
+    monkeypatch.setattr(sc, 'write_chunk', interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        sc.sample_streaming_conversion(sample, resumed, **convert)
+    monkeypatch.setattr(sc, 'write_chunk', write_chunk)
+
+    stats = sc.sample_streaming_conversion(sample, resumed, **convert)
+
+    assert stats['skipped'] == 3
+    assert {**stats, 'skipped': 0} == clean_stats
+    assert digest(resumed) == digest(clean)
+    assert len([f for f in digest(clean) if f.startswith('occurrences')]) == 6
@@ -0,0 +1,120 @@
+"""
+Parity of the columnar transform_batch with the row-wise transform
+"""
+import pandas as pd
+import pytest
+
+from da.models.occurrence import EventBuilder as EB, EventRegistry, OccurrenceBuilder as OB
+from da.models.taxon import TaxonBuilder as TB, TaxonRegistry
+
+
+INDEX = [10, 11, 12, 13, 14, 15, 16]
+
+EVENTS = pd.DataFrame({
+    'id': ['e1', 'e2', 'e3', 'e4', 'e5', 'e6', 'e7'],
+    'latitude': ['10.5', 'abc', '-3', '4', None, '6', ' 7.5 '],
+    'longitude': ['1', '2', '3.25', '4', '5', '-6.5', '7'],
+    'eventDate': ['2020-01-02', '2020-01-03', 'not a date', None, '2021-05-06',
+                  '2020-01-02T10:00:00Z', ''],
+    'eventType': ['Catalog', None, 'Survey', 'Survey', 'Catalog', None, 'Survey'],
+}, index=INDEX)
+
+OCCURRENCES = pd.DataFrame({
+    'id': ['o1', 'o2', 'o3', 'o4', 'o5', 'o6', 'o7'],
+    'occurrenceID': ['1', '2', None, '4', '5', '6', '7'],
+    'verbatimID': [7, None, 9, 10, 11, 12, 13],
+    'verbatimSource': ['gbif', 'gbif', 'gbif', None, 'inat', 'inat', 'inat'],
+    'eventID': ['e1', 'e2', 'e3', 'e4', 'e5', 'e6', 'e7'],
+    'latitude': [10.5, 2, 3, 4, None, 6, 7],
+    'longitude': [1, 2, 3.25, 4, 5, 'x', 7],
+    'eventDate': ['2020-01-02', None, '2020-01-03', '2020-01-03', None, '2020-01-04', 'bad'],
+}, index=INDEX)
+
+TAXA = pd.DataFrame({
+    'id': ['t1', 't2', 't3', 't4', 't5', 't6', 't7'],
+    'kingdom': ['Animalia', 'Plantae', None, 'Animalia', 'Fungi', 'Animalia', 'Plantae'],
+    'genus': ['Puma', 'Quercus', 'Canis', None, 'Amanita', 'Puma', None],
+    'scientificName': ['Puma concolor', 'Quercus robur', 'Canis lupus', 'Felis catus',
+                       None, 'Puma concolor', 'Abies alba'],
+    'canonicalName': ['Puma concolor', 'Quercus robur', 'Canis lupus', 'Felis catus',
+                      'Amanita muscaria', None, 'Abies alba'],
+    'verbatimID': ['1', '2', '3', '4', '5', '6', None],
+    'verbatimSource': ['gbif', 'gbif', 'gbif', 'inat', 'inat', 'inat', None],
+}, index=INDEX)
+
+
+def records(frame):
+    return zip(frame.index, frame.astype(object).where(frame.notna(), None).to_dict('records'))
+
+
+def row_wise(transform, frame):
+    """Dicts of the accepted rows and labels of the rejected ones, row by row"""
+    accepted, rejected = {}, []
+    for label, row in records(frame):
+        try:
+            accepted[label] = transform(row).dict()
+        except Exception:
+            rejected.append(label)
+
+    return accepted, rejected
+
+
+def columnar(batch):
+    return dict(zip(batch.index, batch.to_dicts())), sorted(batch.rejected)
+
+
+def occurrence(row):
+    event = {k: row[k] for k in ('latitude', 'longitude', 'eventDate')}
+    event['id'] = row['eventID']
+
+    return OB.transform({'id': row['id'],
+                         'occurrenceID': row['occurrenceID'],
+                         'verbatimID': row['verbatimID'],
+                         'verbatimSource': row['verbatimSource'],
+                         'event': EB.transform(event)})
+
+
+@pytest.mark.parametrize('transform, transform_batch, frame', [
+    (EB.transform, EB.transform_batch, EVENTS),
+    (occurrence, OB.transform_batch, OCCURRENCES),
+    (TB.transform, TB.transform_batch, TAXA),
+], ids=['event', 'occurrence', 'taxon'])
+def test_transform_batch_matches_transform(transform, transform_batch, frame):
+    accepted, rejected = row_wise(transform, frame)
+
+    batch_accepted, batch_rejected = columnar(transform_batch(frame))
+
+    # Both accept and reject something, so the fixture covers both paths
+    assert accepted and rejected
+    assert batch_rejected == rejected
+    assert batch_accepted == accepted
+
+
+def test_intern_batch_matches_intern():
+    rows, batch = TaxonRegistry(), TaxonRegistry()
+
+    ids, rejected = [], []
+    for label, row in records(TAXA):
+        try:
+            ids.append(rows.intern(row).id)
+        except Exception:
+            ids.append(None)
+            rejected.append(label)
+
+    batch_ids, batch_rejected = batch.intern_batch(TAXA)
+
+    assert sorted(batch_rejected) == rejected
+    assert [taxon.dict() for taxon in batch.taxa()] == [taxon.dict() for taxon in rows.taxa()]
+    # Same taxon for the same rows
+    assert pd.factorize(pd.Series(batch_ids))[0].tolist() == pd.factorize(pd.Series(ids))[0].tolist()
+
+
+def test_rejected_occurrences_are_not_interned():
+    registry = EventRegistry()
+
+    batch = OB.transform_batch(OCCURRENCES, event_registry=registry)
+
+    # Only the Events of the accepted rows, the rows 12 and 13 have valid Events
+    assert sorted(batch.rejected) == [12, 13, 14, 15, 16]
+    assert registry.stats()['misses'] == len(batch) == len(registry)
+    assert {e.id for e in registry.events()} == set(batch['eventID'])